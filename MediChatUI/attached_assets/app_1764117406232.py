@@ -1,9 +1,21 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import html
 
 API_URL = "http://127.0.0.1:8000"
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 120          # max silence between stream lines, not total answer time
+
+
+@st.cache_resource
+def http_session():
+    """One keep-alive connection pool shared by every rerun and browser tab of this app."""
+    s = requests.Session()
+    s.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    s.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return s
 
 st.set_page_config(page_title="Medical Wellness Assistant", layout="centered")
 
@@ -112,8 +124,9 @@ with st.sidebar:
 
     if st.button("Clear Chat"):
         try:
-            requests.post(f"{API_URL}/clear_memory", json={"session_id": st.session_state.session_id})
-        except:
+            http_session().post(f"{API_URL}/clear_memory", json={"session_id": st.session_state.session_id},
+                                timeout=(CONNECT_TIMEOUT, 10))
+        except requests.RequestException:
             pass
         st.session_state.messages = []
         st.rerun()
@@ -121,81 +134,112 @@ with st.sidebar:
 st.markdown("---")
 
 # --- Display existing messages -------------------------------------------------
-for m in st.session_state.messages:
-    role = m.get("role")
-    text = html.escape(str(m.get("content") or "")).replace("\n", "<br>")
-
-    if role == "user":
-        st.markdown(
-            f"""
+def user_bubble(content):
+    text = html.escape(str(content or "")).replace("\n", "<br>")
+    return f"""
             <div class='chat-row user'>
                 <div class='user-bubble'>{text}</div>
                 <div class='avatar user-avatar'>U</div>
             </div>
-            """,
-            unsafe_allow_html=True,
-        )
-    else:
-        meta = m.get("meta")
-        st.markdown(
-            f"""
+            """
+
+
+def assistant_bubble(content):
+    text = html.escape(str(content or "")).replace("\n", "<br>")
+    return f"""
             <div class='chat-row'>
                 <div class='avatar assistant-avatar'>AI</div>
                 <div class='assistant-bubble'>{text}</div>
             </div>
-            """,
-            unsafe_allow_html=True,
-        )
+            """
+
+
+for m in st.session_state.messages:
+    if m.get("role") == "user":
+        st.markdown(user_bubble(m.get("content")), unsafe_allow_html=True)
+    else:
+        st.markdown(assistant_bubble(m.get("content")), unsafe_allow_html=True)
+        meta = m.get("meta")
         if st.session_state.developer_mode and meta:
             st.markdown(f"<div class='meta-box'>Meta: {html.escape(json.dumps(meta))}</div>", unsafe_allow_html=True)
 
+
+def stream_answer(user_msg, placeholder):
+    """
+    POST /chat with stream=True and render partial text as NDJSON lines arrive.
+    meta is only requested (developer_mode) when the sidebar toggle is on.
+    Returns (answer, meta).
+    """
+    payload = {
+        "session_id": st.session_state.session_id,
+        "message": user_msg,
+        "developer_mode": st.session_state.developer_mode,
+        "stream": True,
+        # the API stops working on the answer once we would have given up waiting for it
+        "timeout_s": READ_TIMEOUT,
+    }
+    parts, meta, finished = [], {}, False
+
+    def cut_short(reason):
+        # keep what already arrived, but say it may be incomplete
+        answer = "".join(parts).rstrip()
+        answer = f"{answer}\n\nError: {reason}; the answer may be incomplete." if answer else f"Error: {reason}"
+        placeholder.markdown(assistant_bubble(answer), unsafe_allow_html=True)
+        return answer, {}
+
+    with http_session().post(f"{API_URL}/chat", json=payload, stream=True,
+                             timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as r:
+        if r.status_code != 200:
+            return f"Error: API responded with status {r.status_code}", {}
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            try:
+                ev = json.loads(line)
+            except json.JSONDecodeError:
+                # e.g. a proxy cut the stream in the middle of a line
+                return cut_short("the answer stream was interrupted")
+            if not isinstance(ev, dict):
+                return cut_short("unexpected data in the answer stream")
+            kind = ev.get("type")
+            if ev.get("session_id"):
+                st.session_state.session_id = ev["session_id"]
+            if kind == "status":
+                placeholder.markdown(assistant_bubble("🌸 Thinking..."), unsafe_allow_html=True)
+            elif kind == "partial":
+                parts.append(ev.get("text", ""))
+                placeholder.markdown(assistant_bubble("".join(parts) + " ▌"), unsafe_allow_html=True)
+            elif kind == "meta":
+                meta = ev.get("meta") or {}
+                finished = True
+            elif kind == "error":
+                return f"Error: {ev.get('error')}", {}
+    if not finished:
+        return cut_short("the answer stream ended early")
+    # pieces carry their own whitespace, newlines included
+    answer = "".join(parts) or "Error: No answer returned"
+    placeholder.markdown(assistant_bubble(answer), unsafe_allow_html=True)
+    return answer, meta
+
+
 # --- Chat Input ----------------------------------------------------------------
 prompt = st.chat_input("Ask a medical or wellness question...")
 
 if prompt:
-    # Show user's message
     st.session_state.messages.append({"role": "user", "content": prompt})
-
-    # Show temporary assistant bubble
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "🌸 Thinking...",
-        "meta": {"temp": True},
-    })
-    st.rerun()
-
-# --- Process pending temporary message ----------------------------------------
-if st.session_state.messages:
-    last = st.session_state.messages[-1]
-    if last.get("meta", {}).get("temp"):
-        user_msg = st.session_state.messages[-2]["content"]
-
-        try:
-            payload = {
-                "session_id": st.session_state.session_id,
-                "message": user_msg,
-                "developer_mode": st.session_state.developer_mode,
-                "stream": False,
-            }
-            r = requests.post(f"{API_URL}/chat", json=payload, timeout=120)
-            data = r.json()
-            answer = data.get("answer", "Error: No answer returned")
-            meta = data.get("meta", {})
-            sid = data.get("session_id")
-            if sid: st.session_state.session_id = sid
-
-        except Exception as e:
-            answer = f"Error: {e}"
-            meta = {}
-
-        # Replace temp bubble with real answer
-        st.session_state.messages[-1] = {
-            "role": "assistant",
-            "content": answer,
-            "meta": meta,
-        }
-
-        st.rerun()
+    st.markdown(user_bubble(prompt), unsafe_allow_html=True)
+
+    placeholder = st.empty()
+    placeholder.markdown(assistant_bubble("🌸 Thinking..."), unsafe_allow_html=True)
+    try:
+        answer, meta = stream_answer(prompt, placeholder)
+    except requests.RequestException as e:
+        answer, meta = f"Error: {e}", {}
+        placeholder.markdown(assistant_bubble(answer), unsafe_allow_html=True)
+
+    st.session_state.messages.append({"role": "assistant", "content": answer, "meta": meta})
+    if st.session_state.developer_mode and meta:
+        st.markdown(f"<div class='meta-box'>Meta: {html.escape(json.dumps(meta))}</div>", unsafe_allow_html=True)
 
 st.markdown("</div>", unsafe_allow_html=True)
 
@@ -19,9 +19,16 @@ export async function registerRoutes(app: Express): Promise<Server> {
 
     const { session_id, message, developer_mode, stream } = validation.data;
 
+    // If the browser goes away, drop the upstream request too; the API then cancels the pipeline run.
+    const upstream = new AbortController();
+    res.on("close", () => {
+      if (!res.writableEnded) upstream.abort();
+    });
+
     try {
       const response = await fetch(`${FLASK_API_URL}/chat`, {
         method: "POST",
+        signal: upstream.signal,
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
           session_id,
@@ -38,6 +45,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       const data = await response.json();
       res.json(data);
     } catch (error) {
+      if (upstream.signal.aborted) return;
       console.error("Chat API error:", error);
       res.status(500).json({
         answer: "Error: Unable to connect to the medical assistant backend. Please ensure the Flask API is running.",
@@ -1,17 +1,55 @@
 # Run: uvicorn api:app --host 127.0.0.1 --port 8000
 
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, Request, Response, Body
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import Dict, List, Any, Optional
-import uuid
-import json
+from typing import Optional
+import asyncio
+import os
 import time
+import uuid
+import importlib
+import re
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+
+from serving_scripts.session_store import make_session_store, compact_meta
+from serving_scripts.single_flight import SingleFlight, normalize_query
+from serving_scripts.trace_store import TraceStore
+from serving_scripts.answer_cache import AnswerCache
+from serving_scripts.fast_json import FastJSONResponse, ndjson_line
+from serving_scripts.request_context import RequestContext, Cancelled, activate, INTERACTIVE, BATCH
+from serving_scripts.degradation import DegradationController, is_degraded, SLO_P95_S
+from monitoring_scripts import metrics
+from monitoring_scripts.profiler import maybe_profile, should_profile, PROFILE_HEADER
+from monitoring_scripts.traffic_recorder import make_recorder
+from monitoring_scripts.process_memory import memory_usage
+from rag.batch_answer import parse_question_line
+
+# "module:function" answering a question; swap in benchmark_scripts.stub_pipeline:ask for load tests.
+PIPELINE = os.environ.get("MEDIQA_PIPELINE", "rag.rag_query_engine_safe:ask")
+
+def _load_pipeline(spec: str):
+    module, _, attr = spec.partition(":")
+    mod = importlib.import_module(module)
+    return getattr(mod, attr or "ask"), getattr(mod, "ask_batch", None), mod
+
+ask, ask_batch, _pipeline_module = _load_pipeline(PIPELINE)
+
+# Optional pipeline hooks for index hot-swap (see rag/index_snapshots.py).
+index_version = getattr(_pipeline_module, "index_version", lambda: None)
+reload_index = getattr(_pipeline_module, "reload_index", None)
 
-from rag.rag_query_engine_safe import ask
+# Default /chat deadline in seconds (ChatRequest.timeout_s overrides); past it the run stops and /chat
+# returns 504. Disconnected clients are checked every DISCONNECT_POLL_S.
+REQUEST_TIMEOUT_S = float(os.environ.get("REQUEST_TIMEOUT_S", "120"))
+DISCONNECT_POLL_S = 0.5
 
-app = FastAPI(title="Medical RAG API (fixed)")
+# /admin endpoints, /trace and X-Profile need ADMIN_TOKEN to be set and sent as X-Admin-Token;
+# without ADMIN_TOKEN they are disabled.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+app = FastAPI(title="Medical RAG API (fixed)", default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,13 +59,170 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-SESSIONS: Dict[str, List[Dict[str, Any]]] = {}
+# Set SESSION_DB_PATH to persist sessions in SQLite; otherwise they live in memory only.
+SESSIONS = make_session_store(db_path=os.environ.get("SESSION_DB_PATH"))
+
+# Set TRAFFIC_LOG_PATH to capture /chat traffic for benchmark_scripts/replay.py. Only emails, phone
+# numbers and digit runs are masked; names and addresses in the questions are kept.
+RECORDER = make_recorder()
+
+# Identical questions in flight at the same time share one pipeline run; SINGLE_FLIGHT=0 turns this off.
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "1") != "0"
+FLIGHTS = SingleFlight()
+
+# Answers by (index version, normalized question); ANSWER_CACHE_SIZE=0 disables. WARM_CACHE_PATH
+# (written by serving_scripts/cache_warmer.py) is loaded before traffic is admitted and after index reloads.
+ANSWER_CACHE = AnswerCache(max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", "5000")))
+WARM_CACHE_PATH = os.environ.get("WARM_CACHE_PATH")
+
+# With DEGRADE=1, /chat steps down to cheaper, more abstain-prone safety checks under load and recovers when
+# load falls (serving_scripts/degradation.py). Off by default: every request runs the full pipeline.
+DEGRADATION = DegradationController(slo_p95_s=float(os.environ.get("SLO_P95_S", SLO_P95_S))) \
+    if os.environ.get("DEGRADE", "0") != "0" else None
+
+def _load_warm_cache():
+    if WARM_CACHE_PATH and os.path.exists(WARM_CACHE_PATH):
+        n = ANSWER_CACHE.load_jsonl(WARM_CACHE_PATH, index_version())
+        print(f"Answer cache: loaded {n} warm entries for index {index_version()} from {WARM_CACHE_PATH}")
+
+# Full meta of recent requests, fetched with GET /trace/{request_id}; /chat itself returns a summary
+# unless developer_mode. TRACE_STORE_SIZE=0 disables.
+TRACES = TraceStore(max_traces=int(os.environ.get("TRACE_STORE_SIZE", "2000")))
+
+@app.on_event("startup")
+def warm_answer_cache():
+    # startup handlers finish before uvicorn accepts connections
+    _load_warm_cache()
+
+@app.on_event("shutdown")
+def close_sessions():
+    SESSIONS.close()
+    if RECORDER is not None:
+        RECORDER.close()
+
+def _session_gauges():
+    st = SESSIONS.stats()
+    out = [
+        ("mediqa_sessions", "Sessions held in memory.", st["sessions"]),
+        ("mediqa_session_messages", "Messages held in memory.", st["messages"]),
+        ("mediqa_session_bytes", "Approximate bytes held by the session store.", st["bytes"]),
+    ]
+    for reason, n in st["evictions"].items():
+        out.append((f"mediqa_session_evictions_{reason}", f"Session store evictions ({reason}).", n))
+    return out
+
+def _flight_gauges():
+    st = FLIGHTS.stats()
+    return [
+        ("mediqa_singleflight_in_flight", "Distinct questions currently running.", st["in_flight"]),
+        ("mediqa_singleflight_leaders", "Requests that started a pipeline run.", st["leaders"]),
+        ("mediqa_singleflight_coalesced", "Requests served by another request's run.", st["coalesced"]),
+        ("mediqa_singleflight_max_fanout", "Most requests sharing one run.", st["max_fanout"]),
+    ]
+
+def _cache_gauges():
+    st = ANSWER_CACHE.stats()
+    return [
+        ("mediqa_answer_cache_entries", "Answers held in the answer cache.", st["entries"]),
+        ("mediqa_answer_cache_hits", "Requests answered from the cache.", st["hits"]),
+        ("mediqa_answer_cache_misses", "Requests that ran the pipeline.", st["misses"]),
+        ("mediqa_answer_cache_hit_rate", "hits / (hits + misses).", st["hit_rate"]),
+        ("mediqa_answer_cache_warmed", "Entries loaded from WARM_CACHE_PATH.", st["warmed"]),
+        ("mediqa_answer_cache_warm_skipped", "Unreadable WARM_CACHE_PATH lines skipped.", st["warm_skipped"]),
+    ]
+
+def _degradation_gauges():
+    if DEGRADATION is None:
+        return []
+    st = DEGRADATION.stats()
+    return [
+        ("mediqa_degradation_level", "Current safety pipeline degradation level (0 = full).", st["level"]),
+        ("mediqa_degradation_in_flight", "/chat pipeline runs in flight.", st["in_flight"]),
+        ("mediqa_degradation_p95_seconds", "p95 latency of recent runs at the current level.", st["p95_s"] or 0.0),
+        ("mediqa_degradation_steps_up", "Times the controller degraded the pipeline.", st["steps_up"]),
+        ("mediqa_degradation_steps_down", "Times the controller recovered a level.", st["steps_down"]),
+    ]
+
+def _memory_gauges():
+    # per worker: each scrape reports the worker that served it (see GET /memory for its pid)
+    mem = memory_usage()
+    return [(f"mediqa_process_{k}_bytes", f"{k.upper()} of this worker process.", mem[k])
+            for k in ("rss", "pss", "shared", "private") if k in mem]
+
+def _trace_gauges():
+    st = TRACES.stats()
+    return [
+        ("mediqa_traces", "Full request traces held for /trace.", st["traces"]),
+        ("mediqa_trace_evictions_lru", "Traces dropped for the size cap.", st["evictions"]["lru"]),
+        ("mediqa_trace_evictions_ttl", "Traces dropped after their TTL.", st["evictions"]["ttl"]),
+    ]
+
+def _scheduler_gauges():
+    # the generator lock of the pipeline, when it exposes one (inference_scripts/mistral_inference.py)
+    lock = getattr(_pipeline_module, "generator_lock", lambda: None)()
+    if lock is None:
+        return []
+    out = [("mediqa_generator_queue", "Pipeline runs waiting for the generator.", lock.queued())]
+    for name, n in lock.waits.items():
+        out.append((f"mediqa_generator_waits_{name}", f"Runs at {name} priority that had to queue for the generator.", n))
+    return out
+
+metrics.register_collector(_session_gauges)
+metrics.register_collector(_flight_gauges)
+metrics.register_collector(_cache_gauges)
+metrics.register_collector(_trace_gauges)
+metrics.register_collector(_memory_gauges)
+metrics.register_collector(_degradation_gauges)
+metrics.register_collector(_scheduler_gauges)
+
+def _is_admin(request: Request) -> bool:
+    return bool(ADMIN_TOKEN) and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+def _admin_denied(request: Request):
+    if not ADMIN_TOKEN:
+        return FastJSONResponse({"ok": False, "detail": "admin endpoints are disabled (ADMIN_TOKEN is not set)"},
+                                status_code=403)
+    if not _is_admin(request):
+        return FastJSONResponse({"ok": False, "detail": "invalid admin token"}, status_code=403)
+    return None
+
+def _run_pipeline(message: str, request_id: str, profile: bool, ctx: RequestContext):
+    """Runs in a worker thread; returns (resp, {stage: ms}). Raises Cancelled once `ctx` is cancelled."""
+    with activate(ctx), metrics.request_timings() as timings, maybe_profile(request_id, selected=profile):
+        ctx.check()
+        resp = ask(message)
+    return resp, metrics.timing_breakdown(timings)
+
+async def _until_done(aw, request: Request, ctx: RequestContext):
+    """
+    Await `aw`, cancelling `ctx` if the client goes away in the meantime. Raises Cancelled
+    as soon as `ctx` is cancelled or past its deadline: a follower waiting on another
+    request's coalesced run has no pipeline of its own that would notice and stop.
+    """
+    task = asyncio.ensure_future(aw)
+    try:
+        while True:
+            remaining = ctx.remaining()
+            timeout = DISCONNECT_POLL_S if remaining is None else max(0.0, min(DISCONNECT_POLL_S, remaining))
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if not ctx.cancelled and await request.is_disconnected():
+                ctx.cancel("disconnected")
+            ctx.check()
+    finally:
+        if not task.done():
+            task.cancel()
 
 class ChatRequest(BaseModel):
     session_id: Optional[str] = None
     message: str
     developer_mode: bool = False
     stream: bool = False
+    timeout_s: Optional[float] = None
+
+class ReloadIndexRequest(BaseModel):
+    version: Optional[str] = None
 
 class NewSessionResponse(BaseModel):
     session_id: str
@@ -37,57 +232,225 @@ class ClearMemoryRequest(BaseModel):
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    return {"status": "ok", "index_version": index_version()}
+
+@app.post("/admin/reload_index")
+async def admin_reload_index(req: ReloadIndexRequest, request: Request):
+    """Load an index snapshot (default: CURRENT) off the event loop and swap it in; /chat keeps serving meanwhile."""
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    if reload_index is None:
+        return FastJSONResponse({"ok": False, "detail": f"pipeline {PIPELINE} has no reload_index"}, status_code=501)
+    try:
+        old, new = await run_in_threadpool(reload_index, req.version)
+    except (FileNotFoundError, ValueError) as e:
+        return FastJSONResponse({"ok": False, "detail": str(e)}, status_code=400)
+    if new != old:
+        await run_in_threadpool(_load_warm_cache)
+    return {"ok": True, "previous": old, "index_version": new}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/memory")
+async def memory():
+    """RSS / PSS / shared / private bytes of the worker serving this request."""
+    return dict(memory_usage(), pid=os.getpid())
+
+@app.get("/session_stats")
+async def session_stats():
+    return SESSIONS.stats()
 
 @app.post("/new_session", response_model=NewSessionResponse)
 async def new_session():
-    sid = "sess_" + uuid.uuid4().hex[:12]
-    SESSIONS[sid] = []
-    return {"session_id": sid}
+    return {"session_id": SESSIONS.create()}
 
 @app.post("/clear_memory")
 async def clear_memory(req: ClearMemoryRequest):
     sid = req.session_id
-    if not sid or sid not in SESSIONS:
-        return JSONResponse({"ok": False, "detail": "invalid session_id"}, status_code=400)
-    SESSIONS[sid] = []
+    # an unknown session_id may be looked up in SQLite; keep that IO off the event loop
+    if not sid or not await run_in_threadpool(SESSIONS.exists, sid):
+        return FastJSONResponse({"ok": False, "detail": "invalid session_id"}, status_code=400)
+    await run_in_threadpool(SESSIONS.clear, sid)
     return {"ok": True}
 
-@app.post("/chat")
-async def chat_endpoint(req: ChatRequest):
-    sid = req.session_id or ("sess_" + uuid.uuid4().hex[:12])
-    if sid not in SESSIONS:
-        SESSIONS[sid] = []
+STREAM_CHUNK_WORDS = 12
+_WHITESPACE = re.compile(r"(\s+)")
+
+def _stream_chunks(text: str, words: int = STREAM_CHUNK_WORDS):
+    """About `words` words per piece, whitespace (newlines, list breaks) kept, so "".join() gives `text` back."""
+    if not text:
+        return
+    parts = _WHITESPACE.split(text)      # word, space, word, space, ...
+    for i in range(0, len(parts), 2 * words):
+        yield "".join(parts[i:i + 2 * words])
+
+async def _answer(req: ChatRequest, request: Request, request_id: str, sid: str, ctx: RequestContext):
+    """Run (or join) the pipeline for one /chat message; returns (status, answer, meta). Raises Cancelled."""
+    arrival = time.time()
+    t0 = time.perf_counter()
+    # X-Profile writes a file per request, so only admin callers may ask for it. Decided once here:
+    # the header's value, not its presence, is what selects a request.
+    profile = should_profile(request.headers.get(PROFILE_HEADER) if _is_admin(request) else None)
+
+    async def run():
+        # only a run that executes counts as load: coalesced followers add nothing and share its level
+        if DEGRADATION is not None:
+            ctx.degradation = DEGRADATION.start()
+        t_run = time.perf_counter()
+        try:
+            resp, stages = await run_in_threadpool(_run_pipeline, req.message, request_id, profile, ctx)
+        finally:
+            if DEGRADATION is not None:
+                DEGRADATION.finish(time.perf_counter() - t_run, ctx.degradation)
+        return resp, stages, ctx.degradation
 
+    # keyed by index version too, so a question asked after a swap never joins a run on (or gets
+    # a cached answer from) the old index
+    key = (index_version(), normalize_query(req.message))
+    # a profiled request always gets its own run so the profile belongs to it
+    resp = ANSWER_CACHE.get(key) if not profile else None
+    cached = resp is not None
+    if cached:
+        stages, shared = {}, False
+    elif SINGLE_FLIGHT and not profile:
+        try:
+            (resp, stages, ctx.degradation), shared = await FLIGHTS.do(key, run)
+        except Cancelled:
+            # the run belonged to a leader that disconnected or timed out; ours is still wanted
+            ctx.check()
+            (resp, stages, _), shared = await run(), False
+    else:
+        (resp, stages, _), shared = await run(), False
+    # a degraded answer would outlive the load that caused it
+    if not cached and isinstance(resp, dict) and resp.get("status") in ("accept", "abstain") and not is_degraded(resp):
+        ANSWER_CACHE.put(key, resp)
+    elapsed = time.perf_counter() - t0
+    metrics.REQUEST_LATENCY.observe(elapsed, endpoint="chat_stream" if req.stream else "chat")
+
+    if RECORDER is not None and RECORDER.sampled():
+        RECORDER.record(arrival, sid, req.message, req.stream, resp, elapsed, stages)
+
+    status = resp.get("status") if isinstance(resp, dict) else None
+    answer = resp.get("answer") if isinstance(resp, dict) else str(resp)
+    full_meta = (resp.get("meta") if isinstance(resp, dict) else None) or {}
+    timings_ms = dict(stages, total=round(elapsed * 1000.0, 1))
+
+    # the trace holds references only; nothing is copied or serialized unless /trace asks for it
+    TRACES.put(request_id, {"request_id": request_id, "session_id": sid, "question": req.message,
+                            "status": status, "meta": full_meta, "timings_ms": timings_ms, "coalesced": shared,
+                            "cached": cached})
+    if req.developer_mode:
+        meta = dict(full_meta, timings_ms=timings_ms, coalesced=shared, cached=cached)
+    else:
+        meta = compact_meta(full_meta)
+
+    await run_in_threadpool(SESSIONS.append, sid, {"role": "assistant", "content": answer, "meta": meta})
+    return status, answer, meta
+
+@app.post("/chat")
+async def chat_endpoint(req: ChatRequest, request: Request, response: Response):
     if not req.message or not req.message.strip():
-        return JSONResponse({"error": "message cannot be empty"}, status_code=422)
+        return FastJSONResponse({"error": "message cannot be empty"}, status_code=422)
 
-    SESSIONS[sid].append({"role": "user", "content": req.message})
+    request_id = "req_" + uuid.uuid4().hex[:12]
+    response.headers["X-Request-ID"] = request_id
+
+    # session lookups may read SQLite (serving_scripts/session_store.py); run them off the event loop
+    sid = await run_in_threadpool(SESSIONS.create, req.session_id)
+
+    await run_in_threadpool(SESSIONS.append, sid, {"role": "user", "content": req.message})
+    ctx = RequestContext(timeout_s=req.timeout_s or REQUEST_TIMEOUT_S, priority=INTERACTIVE)
+
+    if req.stream:
+        async def gen():
+            # first line goes out before the pipeline runs, so clients can show progress right away
+            yield ndjson_line({"type": "status", "stage": "started", "session_id": sid, "request_id": request_id})
+            try:
+                status, answer, meta = await _until_done(_answer(req, request, request_id, sid, ctx), request, ctx)
+            except asyncio.CancelledError:
+                # StreamingResponse cancels us when the client disconnects; stop the worker thread too
+                ctx.cancel("disconnected")
+                metrics.record_cancelled("disconnected")
+                raise
+            except Cancelled as e:
+                metrics.record_cancelled(e.reason)
+                yield ndjson_line({"type": "error", "error": "deadline exceeded" if e.reason == "deadline" else e.reason})
+                return
+            except Exception as e:
+                yield ndjson_line({"type": "error", "error": str(e)})
+                return
+            for piece in _stream_chunks(answer or ""):
+                yield ndjson_line({"type": "partial", "text": piece})
+            end = {"type": "meta", "status": status, "session_id": sid}
+            if req.developer_mode:
+                end["meta"] = meta
+            yield ndjson_line(end)
+        return StreamingResponse(gen(), media_type="application/x-ndjson", headers={"X-Request-ID": request_id})
 
     try:
-        resp = ask(req.message)
+        status, answer, meta = await _until_done(_answer(req, request, request_id, sid, ctx), request, ctx)
+    except Cancelled as e:
+        metrics.record_cancelled(e.reason)
+        if e.reason == "deadline":
+            return FastJSONResponse({"error": "deadline exceeded", "request_id": request_id}, status_code=504)
+        # nobody is listening; 499 only shows up in access logs
+        return FastJSONResponse({"error": e.reason, "request_id": request_id}, status_code=499)
     except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
+        return FastJSONResponse({"error": str(e)}, status_code=500)
 
-    answer = resp.get("answer") if isinstance(resp, dict) else str(resp)
-    meta = resp.get("meta") if isinstance(resp, dict) else {}
+    return {"answer": answer, "status": status, "meta": meta, "session_id": sid, "request_id": request_id}
 
-    SESSIONS[sid].append({"role": "assistant", "content": answer, "meta": meta})
+@app.get("/trace/{request_id}")
+async def get_trace(request_id: str, request: Request):
+    """Full meta (consistency samples, NLI details, timings) of a recent /chat request. Admin only."""
+    # traces hold other users' questions; without a valid admin token, answer as if the id were unknown
+    trace = TRACES.get(request_id) if _is_admin(request) else None
+    if trace is None:
+        return FastJSONResponse({"ok": False, "detail": "unknown or expired request_id"}, status_code=404)
+    return trace
 
-    if req.stream:
-        def gen():
-            text = answer or ""
-            words = text.split()
-            buf = []
-            for i, w in enumerate(words, 1):
-                buf.append(w)
-                if i % 12 == 0:
-                    yield json.dumps({"type": "partial", "text": " ".join(buf)}) + "\n"
-                    buf = []
-                    time.sleep(0.02)
-            if buf:
-                yield json.dumps({"type": "partial", "text": " ".join(buf)}) + "\n"
-            yield json.dumps({"type": "meta", "meta": meta}) + "\n"
-        return StreamingResponse(gen(), media_type="text/event-stream")
-
-    return {"answer": answer, "meta": meta, "session_id": sid}
+@app.post("/batch_chat")
+def batch_chat(body: bytes = Body(..., media_type="application/x-ndjson"), developer_mode: bool = False):
+    """
+    Body: NDJSON, one {"id": ..., "question": ...} (or a bare string) per line.
+    Streams back one {"id", "status", "answer", "meta"} line per question as it finishes,
+    not necessarily in input order; a question that fails gets status "error" and an
+    "error" message, and the rest go on. Does not touch sessions.
+    """
+    if ask_batch is None:
+        return FastJSONResponse({"error": f"pipeline {PIPELINE} has no ask_batch"}, status_code=501)
+    try:
+        items = [it for n, line in enumerate(body.decode("utf-8").splitlines())
+                 if (it := parse_question_line(line, n)) is not None]
+    except (ValueError, UnicodeDecodeError) as e:
+        return FastJSONResponse({"error": str(e)}, status_code=422)
+    if not items:
+        return FastJSONResponse({"error": "no questions in body"}, status_code=422)
+
+    def gen():
+        # batch jobs queue behind interactive /chat for the generator; closing the stream cancels the rest
+        ctx = RequestContext(priority=BATCH)
+        t0 = time.perf_counter()
+        it = ask_batch([q for _, q in items])
+        try:
+            while True:
+                # each step runs in a threadpool thread of its own, so the context is set per step
+                with activate(ctx):
+                    step = next(it, None)
+                if step is None:
+                    break
+                pos, resp = step
+                meta = resp.get("meta") or {}
+                out = {"id": items[pos][0], "status": resp.get("status"), "answer": resp.get("answer"),
+                       "meta": meta if developer_mode else compact_meta(meta)}
+                if "error" in resp:
+                    out["error"] = resp["error"]
+                yield ndjson_line(out)
+        finally:
+            it.close()
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - t0, endpoint="batch_chat")
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
@@ -0,0 +1,151 @@
+"""
+Autotune the CPU thread budget (inference_scripts/thread_budget.py).
+
+For each candidate split (llama.cpp share of the cores, prompt threads,
+n_batch), this starts --workers fresh processes, as `uvicorn --workers`
+would. Each process applies the candidate budget, loads the pipeline and
+answers its share of --questions with --concurrency threads. All processes
+start answering at the same time. The split with the highest throughput
+wins; when two are within 5%, the one with the lower p95 wins. It is
+written to thread_budget.json, and the models pick it up on their next
+start.
+
+Every candidate reloads the models, so use a small --questions on the real
+pipeline. The stub pipeline tunes only the torch / FAISS side, because its
+generator does no CPU work.
+
+Run from the Medical QA folder:
+python -m benchmark_scripts.autotune_threads --workers 2 --concurrency 8 --questions 32
+python -m benchmark_scripts.autotune_threads --pin --shares 0.5 0.75 --n-batch 512
+python -m benchmark_scripts.autotune_threads --pipeline benchmark_scripts.stub_pipeline:ask --questions 64
+"""
+import argparse
+import importlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark_scripts.microbench import QUERIES
+from inference_scripts.thread_budget import BUDGET_PATH, WORKERS, apply_thread_budget
+
+PIPELINE = os.environ.get("MEDIQA_PIPELINE", "rag.rag_query_engine_safe:ask")
+SHARES = (0.25, 0.5, 0.75)
+N_BATCH = (256, 512)
+TIE = 0.05
+
+
+def _child(args):
+    """One worker process: apply the budget, load the pipeline, wait for "go", answer, report."""
+    config = json.loads(args.config)
+    apply_thread_budget(tunables=config, workers=args.workers, pin=args.pin)
+    module, _, attr = args.pipeline.partition(":")
+    ask = getattr(importlib.import_module(module), attr or "ask")
+    ask(QUERIES[0])  # warm-up: lazy model loads, first-call allocations
+
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    questions = [f"{QUERIES[i % len(QUERIES)]} ({i})" for i in range(args.questions)]
+
+    def one(q):
+        t0 = time.perf_counter()
+        ask(q)
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(one, questions))
+    print(json.dumps({"elapsed": time.perf_counter() - t0, "latencies": latencies}), flush=True)
+
+
+def _read_until(proc, match):
+    # the pipeline prints its own loading messages on stdout too
+    for line in proc.stdout:
+        if match(line.strip()):
+            return line
+    raise RuntimeError(f"worker exited early (code {proc.wait()})")
+
+
+def run_candidate(config, args):
+    """Start --workers processes on `config` together; returns throughput and latency percentiles."""
+    env = dict(os.environ, MEDIQA_WORKERS=str(args.workers))
+    per_worker = max(1, args.questions // args.workers)
+    cmd = [sys.executable, "-m", "benchmark_scripts.autotune_threads", "--child", "--config", json.dumps(config),
+           "--pipeline", args.pipeline, "--workers", str(args.workers),
+           "--questions", str(per_worker), "--concurrency", str(max(1, args.concurrency // args.workers))]
+    if args.pin:
+        cmd.append("--pin")
+    procs = [subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+             for _ in range(args.workers)]
+    try:
+        for p in procs:
+            _read_until(p, lambda line: line == "ready")
+        for p in procs:
+            p.stdin.write("go\n")
+            p.stdin.flush()
+        results = [json.loads(_read_until(p, lambda line: line.startswith("{"))) for p in procs]
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+
+    latencies = np.array([lat for r in results for lat in r["latencies"]])
+    elapsed = max(r["elapsed"] for r in results)
+    return {
+        "throughput_qps": len(latencies) / elapsed,
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p95_s": float(np.percentile(latencies, 95)),
+    }
+
+
+def pick_best(results):
+    """Highest throughput; within TIE of it, the lowest p95."""
+    top = max(r["throughput_qps"] for _, r in results)
+    close = [(c, r) for c, r in results if r["throughput_qps"] >= (1.0 - TIE) * top]
+    return min(close, key=lambda cr: cr[1]["p95_s"])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pipeline", default=PIPELINE)
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--concurrency", type=int, default=8, help="concurrent questions across all workers")
+    ap.add_argument("--questions", type=int, default=32, help="questions per candidate across all workers")
+    ap.add_argument("--shares", type=float, nargs="+", default=list(SHARES), help="llama.cpp share of the cores")
+    ap.add_argument("--n-batch", type=int, nargs="+", default=list(N_BATCH))
+    ap.add_argument("--pin", action="store_true", help="pin workers and models to core sets (Linux)")
+    ap.add_argument("--out", default=BUDGET_PATH)
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--config", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        return _child(args)
+
+    candidates = [{"llama_share": s, "llama_batch_all": b, "n_batch": n}
+                  for s, b, n in itertools.product(args.shares, (True, False), args.n_batch)]
+    print(f"{len(candidates)} candidates, {args.workers} workers, concurrency {args.concurrency}, "
+          f"{args.questions} questions each ({args.pipeline})")
+
+    results = []
+    for config in candidates:
+        r = run_candidate(config, args)
+        results.append((config, r))
+        print(f"{config} -> {r['throughput_qps']:.2f} q/s, p50 {r['p50_s']:.2f}s, p95 {r['p95_s']:.2f}s")
+
+    best, r = pick_best(results)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(dict(best, measured=r, workers=args.workers, pinned=args.pin, pipeline=args.pipeline), f, indent=2)
+    print(f"\nBest: {best} ({r['throughput_qps']:.2f} q/s, p95 {r['p95_s']:.2f}s) -> {args.out}")
+    if args.pin:
+        print("Start the API with MEDIQA_PIN_CORES=1 to use the pinned layout.")
+
+
+if __name__ == "__main__":
+    main()
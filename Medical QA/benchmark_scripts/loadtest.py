@@ -0,0 +1,206 @@
+"""
+HTTP load test for api.py.
+
+Starts uvicorn in a subprocess on the stub pipeline (benchmark_scripts/stub_pipeline.py)
+unless --url points at an already running server. Then, for each concurrency
+level, N virtual users each open a session and loop over /chat (a --stream-ratio
+share in stream mode), occasionally calling /clear_memory, until --duration
+elapses.
+
+Reported per level and endpoint: throughput, p50/p95/p99 latency,
+time-to-first-byte for stream mode, error rate and 429 rate.
+
+Run from the Medical QA folder:
+python -m benchmark_scripts.loadtest --users 10 50 200 --duration 30 --gen-tps 40 --out load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+import httpx
+import numpy as np
+
+from benchmark_scripts.microbench import QUERIES
+
+DEFAULT_PORT = 8765
+STARTUP_TIMEOUT = 180.0
+REQUEST_TIMEOUT = 300.0
+
+QUESTIONS = QUERIES + [
+    "Is paracetamol safe during pregnancy?",
+    "What causes iron deficiency anaemia?",
+    "What are the first-line drugs for hypertension?",
+    "How does insulin lower blood glucose?",
+]
+
+
+class LevelStats:
+
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.ttfb = []
+        self.status = defaultdict(Counter)
+        self.errors = Counter()
+
+    def record(self, endpoint, status, latency, ttfb=None):
+        self.status[endpoint][status] += 1
+        if status == 200:
+            self.latency[endpoint].append(latency)
+        if ttfb is not None:
+            self.ttfb.append(ttfb)
+
+    def summary(self, elapsed):
+        out = {"elapsed_s": elapsed, "endpoints": {}}
+        for ep, counts in self.status.items():
+            n = sum(counts.values())
+            lat = np.array(self.latency[ep]) * 1000.0 if self.latency[ep] else np.array([np.nan])
+            out["endpoints"][ep] = {
+                "requests": n,
+                "throughput_rps": n / elapsed,
+                "p50_ms": float(np.nanpercentile(lat, 50)),
+                "p95_ms": float(np.nanpercentile(lat, 95)),
+                "p99_ms": float(np.nanpercentile(lat, 99)),
+                "error_rate": sum(v for k, v in counts.items() if k != 200 and k != 429) / n,
+                "rate_429": counts.get(429, 0) / n,
+                "status": {str(k): v for k, v in counts.items()},
+            }
+        if self.ttfb:
+            t = np.array(self.ttfb) * 1000.0
+            out["stream_ttfb_ms"] = {"p50": float(np.percentile(t, 50)), "p95": float(np.percentile(t, 95)),
+                                     "p99": float(np.percentile(t, 99))}
+        out["exceptions"] = dict(self.errors)
+        return out
+
+
+async def _chat(client, stats, sid, stream, rng):
+    payload = {"session_id": sid, "message": rng.choice(QUESTIONS), "developer_mode": False, "stream": stream}
+    t0 = time.perf_counter()
+    if stream:
+        ttfb = None
+        async with client.stream("POST", "/chat", json=payload) as r:
+            async for _ in r.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - t0
+        stats.record("chat_stream", r.status_code, time.perf_counter() - t0, ttfb if r.status_code == 200 else None)
+    else:
+        r = await client.post("/chat", json=payload)
+        stats.record("chat", r.status_code, time.perf_counter() - t0)
+
+
+async def virtual_user(client, stats, deadline, seed, stream_ratio, clear_ratio):
+    rng = random.Random(seed)
+    sid = None
+    while time.perf_counter() < deadline:
+        try:
+            if sid is None:
+                t0 = time.perf_counter()
+                r = await client.post("/new_session")
+                stats.record("new_session", r.status_code, time.perf_counter() - t0)
+                sid = r.json().get("session_id") if r.status_code == 200 else None
+
+            await _chat(client, stats, sid, rng.random() < stream_ratio, rng)
+
+            if sid and rng.random() < clear_ratio:
+                t0 = time.perf_counter()
+                r = await client.post("/clear_memory", json={"session_id": sid})
+                stats.record("clear_memory", r.status_code, time.perf_counter() - t0)
+        except Exception as e:
+            stats.errors[type(e).__name__] += 1
+
+
+async def run_level(url, users, duration, stream_ratio, clear_ratio):
+    stats = LevelStats()
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=REQUEST_TIMEOUT) as client:
+        t0 = time.perf_counter()
+        deadline = t0 + duration
+        await asyncio.gather(*[virtual_user(client, stats, deadline, i, stream_ratio, clear_ratio)
+                               for i in range(users)])
+        elapsed = time.perf_counter() - t0
+    return stats.summary(elapsed)
+
+
+def start_server(args):
+    env = dict(os.environ)
+    env.update({
+        "MEDIQA_PIPELINE": "benchmark_scripts.stub_pipeline:ask",
+        "LOADTEST_CORPUS_SIZE": str(args.corpus_size),
+        "LOADTEST_PROMPT_TPS": str(args.prompt_tps),
+        "LOADTEST_GEN_TPS": str(args.gen_tps),
+        "LOADTEST_FIXED_LATENCY": str(args.fixed_latency),
+    })
+    # QUESTIONS repeat, so a warm answer cache would measure the cache, not the pipeline
+    env.setdefault("ANSWER_CACHE_SIZE", "0")
+    cmd = [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(args.port),
+           "--workers", str(args.workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    url = f"http://127.0.0.1:{args.port}"
+    t_end = time.time() + STARTUP_TIMEOUT
+    while time.time() < t_end:
+        if proc.poll() is not None:
+            raise RuntimeError("API server exited during startup")
+        try:
+            if httpx.get(url + "/health", timeout=1.0).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("API server did not become healthy in time")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default=None, help="existing server; skips starting the stub server")
+    ap.add_argument("--users", type=int, nargs="+", default=[10, 50, 200])
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds per concurrency level")
+    ap.add_argument("--stream-ratio", type=float, default=0.5)
+    ap.add_argument("--clear-ratio", type=float, default=0.05)
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--corpus-size", type=int, default=5000)
+    ap.add_argument("--prompt-tps", type=float, default=0.0, help="stub prompt tokens/sec (0 = instant)")
+    ap.add_argument("--gen-tps", type=float, default=0.0, help="stub generated tokens/sec (0 = instant)")
+    ap.add_argument("--fixed-latency", type=float, default=0.0, help="stub seconds added per generation")
+    ap.add_argument("--out", default="loadtest.json")
+    args = ap.parse_args(argv)
+
+    proc = None
+    url = args.url
+    if url is None:
+        proc, url = start_server(args)
+
+    report = {"url": url, "config": vars(args), "levels": {}}
+    try:
+        for users in args.users:
+            print(f"\n=== {users} concurrent users, {args.duration:.0f}s ===")
+            res = asyncio.run(run_level(url, users, args.duration, args.stream_ratio, args.clear_ratio))
+            report["levels"][str(users)] = res
+            for ep, r in res["endpoints"].items():
+                print(f"{ep:>13} | {r['throughput_rps']:7.2f} req/s | p50 {r['p50_ms']:8.1f} | "
+                      f"p95 {r['p95_ms']:8.1f} | p99 {r['p99_ms']:8.1f} ms | "
+                      f"err {r['error_rate']:.1%} | 429 {r['rate_429']:.1%}")
+            if "stream_ttfb_ms" in res:
+                t = res["stream_ttfb_ms"]
+                print(f"{'stream TTFB':>13} | p50 {t['p50']:.1f} | p95 {t['p95']:.1f} | p99 {t['p99']:.1f} ms")
+            if res["exceptions"]:
+                print("  exceptions:", res["exceptions"])
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("\nSaved ->", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Offline component microbenchmarks with deterministic stub models.
+
+Components:
+ - retrieve          : RAG.retrieve over a synthetic corpus (stub embedder + FAISS flat IP)
+ - build_context     : RAG.build_context on top-k results
+ - pack_context      : rag.context_packing.pack_context on top-k results (stub tokenizer)
+ - rerank            : rag.reranker.Reranker over 30 candidates with the stub cross-encoder
+ - clean_page_text   : dataset_scripts.pdf_preprocess_and_chunk.clean_page_text
+ - chunk_text        : dataset_scripts.pdf_preprocess_and_chunk.chunk_text
+ - entailment_check  : safety_entailment.entailment_check with the stub NLI model
+ - check_consistency : safety_consistency.check_consistency with stub Llama + stub embedder
+
+Each component reports ops/sec, p50/p95 latency, tracemalloc peak and max RSS.
+Results are written as JSON so two commits can be compared.
+
+Run from the Medical QA folder:
+python -m benchmark_scripts.microbench --corpus-size 20000 --out bench_a.json
+python -m benchmark_scripts.microbench --compare bench_a.json bench_b.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmark_scripts.stubs import (
+    StubEmbedder, StubLlama, StubNLITokenizer, StubNLIModel, stub_generator_fn, install_stub_nli, install_stub_consistency_embedder,
+    synthetic_corpus, synthetic_page, synthetic_sentence,
+)
+
+DEFAULT_CORPUS_SIZE = 5000
+DEFAULT_MIN_TIME = 2.0
+DEFAULT_EMBED_DIM = 1024
+MEMORY_ITERS = 3
+
+QUERIES = [
+    "What are the symptoms of asthma?",
+    "What is the dose of metformin in renal impairment?",
+    "How is tuberculosis treated?",
+    "What are the adverse effects of statins?",
+]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def run_bench(name, fn, min_time=DEFAULT_MIN_TIME, min_iters=5):
+    fn()  # warm-up
+    lat = []
+    t_end = time.perf_counter() + min_time
+    while time.perf_counter() < t_end or len(lat) < min_iters:
+        t0 = time.perf_counter()
+        fn()
+        lat.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    for _ in range(MEMORY_ITERS):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lat = np.array(lat)
+    row = {
+        "ops_per_sec": float(len(lat) / lat.sum()),
+        "p50_ms": float(np.percentile(lat, 50) * 1000),
+        "p95_ms": float(np.percentile(lat, 95) * 1000),
+        "iters": int(len(lat)),
+        "peak_alloc_kb": peak / 1024.0,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+    print(f"{name:>18} | {row['ops_per_sec']:10.1f} ops/s | p50 {row['p50_ms']:8.2f} ms | "
+          f"p95 {row['p95_ms']:8.2f} ms | peak {row['peak_alloc_kb']:9.1f} KB")
+    return row
+
+
+def build_rag(corpus, dim, embedder=None):
+    import faiss
+    from rag.rag_query_engine import RAG
+
+    embedder = embedder or StubEmbedder(dim)
+    embs = embedder.encode([c["text"] for c in corpus], normalize_embeddings=True)
+    index = faiss.IndexFlatIP(dim)
+    index.add(embs)
+    index_map = [{"row": i, "book": c["book"], "page": c["page"], "preview": c["text"][:300]}
+                 for i, c in enumerate(corpus)]
+    return RAG(embedder=embedder, index=index, index_map=index_map, texts=[c["text"] for c in corpus])
+
+
+def run_all(corpus_size, min_time, dim, only=None):
+    from dataset_scripts.pdf_preprocess_and_chunk import clean_page_text, chunk_text, CHUNK_WORDS, CHUNK_OVERLAP
+    from safety_scripts.safety_entailment import entailment_check
+    from safety_scripts.safety_consistency import check_consistency
+    from rag.context_packing import pack_context
+    from rag.reranker import Reranker, RERANK_CANDIDATES
+
+    rng = random.Random(0)
+    corpus = synthetic_corpus(corpus_size)
+    rag = build_rag(corpus, dim)
+    install_stub_nli()
+    install_stub_consistency_embedder(dim)
+
+    q_iter = itertools.cycle(QUERIES)
+    retrieved = rag.attach_texts(rag.retrieve(QUERIES[0], k=5))
+    candidates = rag.retrieve(QUERIES[0], k=RERANK_CANDIDATES)
+    reranker = Reranker(tokenizer=StubNLITokenizer(), model=StubNLIModel(), device="cpu", budget_ms=None)
+    pages = [synthetic_page(rng) for _ in range(50)]
+    page_words = [clean_page_text(p).split() for p in pages]
+    hypotheses = [synthetic_sentence(rng) for _ in range(4)]
+    premises = [r["preview"] for r in retrieved]
+    prompt = "Context:\n" + rag.build_context(retrieved)
+    llm = StubLlama()
+    gen = stub_generator_fn(llm)
+    count_tokens = lambda text: len(llm.tokenize(text, add_bos=False))
+
+    def _gen_text(p, seed, temperature=0.2):
+        return gen(p, seed=seed, temperature=temperature)["text"]
+
+    benches = {
+        "retrieve": lambda: rag.retrieve(next(q_iter), k=5),
+        "build_context": lambda: rag.build_context(retrieved),
+        "pack_context": lambda: pack_context(retrieved, count_tokens),
+        "rerank": lambda: reranker.rerank(QUERIES[0], candidates),
+        "clean_page_text": lambda: [clean_page_text(p) for p in pages],
+        "chunk_text": lambda: [chunk_text(w, CHUNK_WORDS, CHUNK_OVERLAP) for w in page_words],
+        "entailment_check": lambda: entailment_check(hypotheses, premises, device="cpu"),
+        "check_consistency": lambda: check_consistency(_gen_text, prompt, n=3),
+    }
+
+    results = {}
+    for name, fn in benches.items():
+        if only and name not in only:
+            continue
+        results[name] = run_bench(name, fn, min_time=min_time)
+    return results
+
+
+def compare(path_a, path_b):
+    with open(path_a) as f:
+        a = json.load(f)
+    with open(path_b) as f:
+        b = json.load(f)
+    print(f"{'component':>18} | {'A ops/s':>10} | {'B ops/s':>10} | {'speedup':>8} | {'peak KB A->B':>20}")
+    for name in sorted(set(a["results"]) | set(b["results"])):
+        ra, rb = a["results"].get(name), b["results"].get(name)
+        if not ra or not rb:
+            print(f"{name:>18} | {'only in ' + ('A' if ra else 'B'):>33}")
+            continue
+        print(f"{name:>18} | {ra['ops_per_sec']:10.1f} | {rb['ops_per_sec']:10.1f} | "
+              f"{rb['ops_per_sec'] / ra['ops_per_sec']:7.2f}x | "
+              f"{ra['peak_alloc_kb']:9.1f} -> {rb['peak_alloc_kb']:9.1f}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus-size", type=int, default=DEFAULT_CORPUS_SIZE)
+    ap.add_argument("--dim", type=int, default=DEFAULT_EMBED_DIM)
+    ap.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="seconds per component")
+    ap.add_argument("--only", nargs="*", help="component names to run")
+    ap.add_argument("--out", default=None, help="JSON output path")
+    ap.add_argument("--compare", nargs=2, metavar=("A", "B"), help="compare two result files")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run_all(args.corpus_size, args.min_time, args.dim, only=args.only)
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "corpus_size": args.corpus_size,
+        "dim": args.dim,
+        "results": results,
+    }
+    out = args.out or f"bench_{report['commit'] or 'local'}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("\nSaved ->", out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Replay a captured /chat traffic log (monitoring_scripts/traffic_recorder.py)
+against a running build and diff it with the original.
+
+Requests are re-sent with their original inter-arrival gaps divided by
+--speed (--speed 0 sends back-to-back with --concurrency workers), always
+with developer_mode so the server reports its stage timings.
+
+The report compares:
+ - end-to-end latency p50/p95/p99 (server-side total, original vs replay)
+ - per-stage p50 latency
+ - decision outcomes (accept/abstain transition counts)
+ - retrieval rows (top-1 agreement and mean top-k overlap)
+
+Start the target with ANSWER_CACHE_SIZE=0 (and no WARM_CACHE_PATH): a
+production log repeats questions, and with the answer cache on the replay
+mostly measures cache hits. Replies served from the cache (meta.cached) are
+counted in the report and left out of the latency figures unless
+--include-cached is given.
+
+Run from the Medical QA folder:
+python -m benchmark_scripts.replay traffic.jsonl.gz --url http://127.0.0.1:8000 --speed 2 --out replay.json
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+
+import httpx
+import numpy as np
+
+from monitoring_scripts.traffic_recorder import read_log
+
+REQUEST_TIMEOUT = 300.0
+
+
+def _pcts(values):
+    if not values:
+        return None
+    v = np.array(values, dtype="float64")
+    return {"p50": float(np.percentile(v, 50)), "p95": float(np.percentile(v, 95)),
+            "p99": float(np.percentile(v, 99)), "n": int(len(v))}
+
+
+async def _send(client, rec):
+    payload = {"session_id": None, "message": rec["q"], "developer_mode": True, "stream": False}
+    t0 = time.perf_counter()
+    try:
+        r = await client.post("/chat", json=payload)
+        body = r.json() if r.status_code == 200 else {}
+        code = r.status_code
+    except Exception as e:
+        body, code = {}, type(e).__name__
+    meta = body.get("meta") or {}
+    timings = meta.get("timings_ms") or {}
+    return {
+        "http": code,
+        "status": body.get("status"),
+        "rows": meta.get("retrieved_rows"),
+        "cached": bool(meta.get("cached")),
+        "latency_ms": timings.get("total", (time.perf_counter() - t0) * 1000.0),
+        "stages": {k: v for k, v in timings.items() if k != "total"},
+    }
+
+
+async def replay(records, url, speed, concurrency):
+    results = [None] * len(records)
+    sem = asyncio.Semaphore(concurrency)
+    t_first = records[0]["t"]
+
+    async with httpx.AsyncClient(base_url=url, timeout=REQUEST_TIMEOUT,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        start = time.perf_counter()
+
+        async def one(i, rec):
+            if speed > 0:
+                delay = (rec["t"] - t_first) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            async with sem:
+                results[i] = await _send(client, rec)
+
+        await asyncio.gather(*[one(i, r) for i, r in enumerate(records)])
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def diff(records, results, include_cached: bool = False):
+    timed = [(a, b) for a, b in zip(records, results) if include_cached or not b.get("cached")]
+    orig_lat = [a["latency_ms"] for a, _ in timed]
+    new_lat = [b["latency_ms"] for _, b in timed if b["http"] == 200]
+
+    stages_a, stages_b = defaultdict(list), defaultdict(list)
+    for a, b in timed:
+        for k, v in (a.get("stages") or {}).items():
+            stages_a[k].append(v)
+        for k, v in b["stages"].items():
+            stages_b[k].append(v)
+
+    transitions = Counter()
+    top1_same, overlaps = [], []
+    for a, b in zip(records, results):
+        transitions[f"{a.get('status')}->{b['status'] if b['http'] == 200 else 'error'}"] += 1
+        if a.get("rows") and b["rows"]:
+            top1_same.append(a["rows"][0] == b["rows"][0])
+            sa, sb = set(a["rows"]), set(b["rows"])
+            overlaps.append(len(sa & sb) / max(1, len(sa | sb)))
+
+    changed = sum(n for k, n in transitions.items() if k.split("->")[0] != k.split("->")[1])
+    return {
+        "latency_ms": {"original": _pcts(orig_lat), "replay": _pcts(new_lat)},
+        "stage_p50_ms": {
+            k: {"original": float(np.median(stages_a[k])) if stages_a[k] else None,
+                "replay": float(np.median(stages_b[k])) if stages_b[k] else None}
+            for k in sorted(set(stages_a) | set(stages_b))
+        },
+        "decisions": {"transitions": dict(transitions), "changed": changed,
+                      "changed_rate": changed / max(1, len(records))},
+        "retrieval": {"top1_agreement": float(np.mean(top1_same)) if top1_same else None,
+                      "mean_jaccard": float(np.mean(overlaps)) if overlaps else None},
+        "errors": sum(1 for r in results if r["http"] != 200),
+        "cached": {"replies": sum(1 for r in results if r.get("cached")), "in_latency": include_cached},
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("log", help="traffic log written with TRAFFIC_LOG_PATH")
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--speed", type=float, default=1.0, help="1 = original pace, 2 = twice as fast, 0 = no pacing")
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--limit", type=int, default=None, help="replay only the first N records")
+    ap.add_argument("--include-cached", action="store_true",
+                    help="keep replies served from the target's answer cache in the latency figures")
+    ap.add_argument("--out", default="replay.json")
+    args = ap.parse_args(argv)
+
+    records = sorted(read_log(args.log), key=lambda r: r["t"])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("Empty traffic log.")
+        return
+
+    span = records[-1]["t"] - records[0]["t"]
+    print(f"Replaying {len(records)} requests ({span:.0f}s of traffic) at speed {args.speed} -> {args.url}")
+    results, elapsed = asyncio.run(replay(records, args.url, args.speed, args.concurrency))
+
+    report = diff(records, results, args.include_cached)
+    report["replay_elapsed_s"] = elapsed
+
+    lat = report["latency_ms"]
+    for name in ("original", "replay"):
+        p = lat[name]
+        if p:
+            print(f"{name:>9} | p50 {p['p50']:8.1f} | p95 {p['p95']:8.1f} | p99 {p['p99']:8.1f} ms | n={p['n']}")
+    for k, v in report["stage_p50_ms"].items():
+        print(f"{k:>24} | p50 {v['original']} -> {v['replay']}")
+    print("decisions:", report["decisions"])
+    print("retrieval:", report["retrieval"], "| errors:", report["errors"])
+    cached = report["cached"]["replies"]
+    if cached:
+        print(f"cached: {cached}/{len(results)} replies came from the target's answer cache "
+              f"({'included in' if args.include_cached else 'left out of'} the latency figures); "
+              f"start it with ANSWER_CACHE_SIZE=0 to replay the pipeline itself")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("\nSaved ->", args.out)
+
+
+if __name__ == "__main__":
+    main()
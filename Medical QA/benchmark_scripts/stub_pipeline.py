@@ -0,0 +1,72 @@
+"""
+rag.rag_query_engine_safe on stub models, with no real models.
+
+The pipeline code is the real one; only its models are swapped (via
+rag_query_engine_safe.use_models): the stub embedder over a synthetic
+index, the stub NLI and a StubLlama generator whose speed is set by
+environment variables (so api.py can be started with it in a subprocess):
+
+ - LOADTEST_CORPUS_SIZE    synthetic chunks in the index       (default 5000)
+ - LOADTEST_PROMPT_TPS     prompt tokens/sec, 0 = instant       (default 0)
+ - LOADTEST_GEN_TPS        generated tokens/sec, 0 = instant    (default 0)
+ - LOADTEST_FIXED_LATENCY  extra seconds per generation call    (default 0)
+ - LOADTEST_NLI            "stub" or "disable"                  (default stub)
+
+Run the API on it:
+MEDIQA_PIPELINE=benchmark_scripts.stub_pipeline:ask uvicorn api:app
+"""
+import os
+import time
+
+# read by rag_query_engine_safe at import: do not load the real models
+os.environ["MEDIQA_GENERATOR"] = "stub"
+
+from benchmark_scripts.stubs import (
+    StubEmbedder, StubLlama, StubNLITokenizer, StubNLIModel, stub_generator_fn, install_stub_nli,
+    install_stub_consistency_embedder, synthetic_corpus
+)
+from benchmark_scripts.microbench import build_rag
+from rag import rag_query_engine_safe as engine
+from rag.reranker import Reranker
+
+CORPUS_SIZE = int(os.environ.get("LOADTEST_CORPUS_SIZE", "5000"))
+PROMPT_TPS = float(os.environ.get("LOADTEST_PROMPT_TPS", "0"))
+GEN_TPS = float(os.environ.get("LOADTEST_GEN_TPS", "0"))
+FIXED_LATENCY = float(os.environ.get("LOADTEST_FIXED_LATENCY", "0"))
+NLI = os.environ.get("LOADTEST_NLI", "stub")
+
+EMBED_DIM = 1024
+# questions score ~0.65-0.75 against the synthetic chunks, like BGE on the real corpus, so the
+# pipeline's own retrieval and consistency thresholds behave as they do on real models
+EMBED_ANISOTROPY = 1.2
+
+rag = build_rag(synthetic_corpus(CORPUS_SIZE), EMBED_DIM, embedder=StubEmbedder(EMBED_DIM, EMBED_ANISOTROPY))
+install_stub_consistency_embedder(EMBED_DIM, EMBED_ANISOTROPY)
+if NLI == "stub":
+    install_stub_nli()
+
+_llm = StubLlama(prompt_tps=PROMPT_TPS, gen_tps=GEN_TPS)
+_gen = stub_generator_fn(_llm)
+
+
+def generator_fn_stub(prompt, seed=0, temperature=0.0, return_generate_obj=False, max_tokens=256):
+    if FIXED_LATENCY:
+        time.sleep(FIXED_LATENCY)
+    return _gen(prompt, seed=seed, temperature=temperature, return_generate_obj=return_generate_obj,
+                max_tokens=max_tokens)
+
+
+def count_tokens(text):
+    return len(_llm.tokenize(text, add_bos=False))
+
+
+engine.use_models(
+    rag, generator_fn_stub, count_tokens, lambda: _gen.lock,
+    reranker_model=Reranker(tokenizer=StubNLITokenizer(), model=StubNLIModel(), device="cpu") if engine.RERANK else None,
+    nli_model_id="stub" if NLI == "stub" else "disable"
+)
+
+ask = engine.ask
+ask_batch = engine.ask_batch
+index_version = engine.index_version
+generator_lock = engine.generator_lock
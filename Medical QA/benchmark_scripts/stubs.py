@@ -0,0 +1,294 @@
+"""
+Deterministic stand-ins for the heavy models, for offline benchmarks and load tests.
+
+ - StubEmbedder   : SentenceTransformer.encode-compatible feature-hashing embedder
+ - StubNLITokenizer / StubNLIModel : HF-style tokenizer + tiny torch classifier
+ - StubLlama      : llama_cpp.Llama.create_completion-compatible generator with
+                    configurable prompt/generation speed
+ - synthetic_corpus(n) : chunk records shaped like rag/chunks/*.jsonl
+
+Everything is seeded, so two runs over the same inputs do the same work.
+"""
+import random
+import re
+import time
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+
+from serving_scripts.request_context import PriorityLock, check_cancelled, stop_requested
+
+_WORD_RE = re.compile(r"\w+")
+
+MEDICAL_WORDS = (
+    "asthma bronchitis diabetes insulin metformin hypertension fever infection antibiotic "
+    "penicillin dose tablet renal hepatic cardiac arrhythmia pneumonia tuberculosis anaemia "
+    "platelet thrombosis inflammation cytokine receptor agonist antagonist clearance "
+    "symptoms treatment diagnosis chronic acute patient therapy contraindicated adverse "
+    "effect mg daily oral intravenous plasma glucose lipid cholesterol statin aspirin"
+).split()
+
+BOOKS = ("Ramdas_Nayak_Pathology", "Gale Encyclopedia of Medicine", "Oxford_Handbook", "Tripathi_Pharmacology")
+
+
+def _tokens(text):
+    return _WORD_RE.findall(text.lower())
+
+
+def _h(token):
+    return zlib.crc32(token.encode("utf-8"))
+
+
+# -------------------------------------------------------
+# EMBEDDER
+# -------------------------------------------------------
+
+class StubEmbedder:
+    """
+    Signed feature hashing of unigrams; similar texts get similar vectors.
+    anisotropy=a adds a shared direction of length a to every unit vector, so
+    unrelated texts still score about a^2 / (1 + a^2), as with real sentence encoders.
+    """
+
+    def __init__(self, dim: int = 1024, anisotropy: float = 0.0):
+        self.dim = dim
+        self.anisotropy = anisotropy
+        common = np.random.default_rng(0).standard_normal(dim).astype("float32")
+        self._common = common / np.linalg.norm(common)
+
+    def _embed_one(self, text):
+        v = np.zeros(self.dim, dtype="float32")
+        for tok in _tokens(text):
+            h = _h(tok)
+            v[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return v
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, convert_to_tensor=False,
+               normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embs = np.stack([self._embed_one(s) for s in sentences]) if sentences else np.zeros((0, self.dim), "float32")
+        if self.anisotropy:
+            embs /= np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+            embs += self.anisotropy * self._common
+        if normalize_embeddings:
+            embs /= np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+        if single:
+            embs = embs[0]
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(embs)
+        return embs
+
+
+# -------------------------------------------------------
+# NLI
+# -------------------------------------------------------
+
+class _Encoding(dict):
+
+    def to(self, device):
+        return _Encoding({k: v.to(device) for k, v in self.items()})
+
+
+class StubNLITokenizer:
+    """Hashes words into a 30522-id vocab; honours truncation/padding/max_length like a HF tokenizer."""
+
+    vocab_size = 30522
+
+    def _ids(self, text):
+        return [101 + _h(t) % (self.vocab_size - 101) for t in _tokens(text)]
+
+    def __call__(self, premise, hypothesis=None, truncation=True, padding=False, max_length=512,
+                 return_tensors="pt", **kwargs):
+        import torch
+        premises = [premise] if isinstance(premise, str) else list(premise)
+        if hypothesis is None:
+            hyps = [None] * len(premises)
+        else:
+            hyps = [hypothesis] * len(premises) if isinstance(hypothesis, str) else list(hypothesis)
+
+        rows = []
+        for p, hy in zip(premises, hyps):
+            a, b = self._ids(p), self._ids(hy) if hy is not None else []
+            if truncation and len(a) + len(b) + 3 > max_length:
+                a = a[:max(0, max_length - len(b) - 3)]
+            rows.append(([101] + a + [102] + b + [102])[:max_length])
+
+        width = max_length if padding == "max_length" else max(len(r) for r in rows)
+        ids = torch.zeros((len(rows), width), dtype=torch.long)
+        mask = torch.zeros((len(rows), width), dtype=torch.long)
+        for i, r in enumerate(rows):
+            ids[i, :len(r)] = torch.tensor(r)
+            mask[i, :len(r)] = 1
+        return _Encoding(input_ids=ids, attention_mask=mask)
+
+
+def StubNLIModel(hidden: int = 64, seed: int = 0):
+    """Embedding + masked mean pool + linear head; a few ms per 512-token pair on CPU."""
+    import torch
+
+    class _Model(torch.nn.Module):
+
+        def __init__(self):
+            super().__init__()
+            torch.manual_seed(seed)
+            self.emb = torch.nn.Embedding(StubNLITokenizer.vocab_size, hidden)
+            self.ff = torch.nn.Sequential(torch.nn.Linear(hidden, hidden), torch.nn.GELU())
+            self.head = torch.nn.Linear(hidden, 3)
+            self.config = SimpleNamespace(id2label={0: "contradiction", 1: "neutral", 2: "entailment"})
+
+        def forward(self, input_ids, attention_mask, **kwargs):
+            h = self.ff(self.emb(input_ids))
+            m = attention_mask.unsqueeze(-1).float()
+            pooled = (h * m).sum(1) / m.sum(1).clamp(min=1.0)
+            return SimpleNamespace(logits=self.head(pooled))
+
+    return _Model().eval()
+
+
+def install_stub_nli():
+    """Point safety_entailment's lazy singletons at the stub model."""
+    from safety_scripts import safety_entailment
+    model = StubNLIModel()
+    safety_entailment._nli_tokenizer = StubNLITokenizer()
+    safety_entailment._nli_model = model
+    safety_entailment._label_map = {v: k for k, v in model.config.id2label.items()}
+
+
+def install_stub_consistency_embedder(dim: int = 1024, anisotropy: float = 0.0):
+    from safety_scripts import safety_consistency
+    safety_consistency._embedder = StubEmbedder(dim, anisotropy)
+
+
+# -------------------------------------------------------
+# LLAMA
+# -------------------------------------------------------
+
+class StubLlama:
+    """
+    Mimics llama_cpp.Llama.create_completion. Answers are built from sentences of
+    the prompt's context so the safety checks behave like they do on real output.
+    Latency = prompt_tokens / prompt_tps + completion_tokens / gen_tps (0 disables).
+    """
+
+    def __init__(self, prompt_tps: float = 0.0, gen_tps: float = 0.0, seed: int = 0):
+        self.prompt_tps = prompt_tps
+        self.gen_tps = gen_tps
+        self.seed = seed
+
+    def tokenize(self, text, add_bos=True, special=False):
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode("utf-8", errors="ignore")
+        ids = [_h(t) % 32000 for t in text.split()]
+        return ([1] if add_bos else []) + ids
+
+    def _answer(self, prompt, temperature, max_tokens, rng):
+        ctx = prompt.split("Context:", 1)[-1]
+        sents = [s.strip() for s in re.split(r"(?<=[.!?])\s+", ctx) if len(s.split()) >= 5]
+        if not sents:
+            sents = [" ".join(rng.choice(MEDICAL_WORDS) for _ in range(12)) + "."]
+        n = 2 if temperature <= 0 else rng.randint(1, 3)
+        start = 0 if temperature <= 0 else rng.randrange(len(sents))
+        words = " ".join(sents[(start + i) % len(sents)] for i in range(n)).split()
+        return words[:max_tokens]
+
+    def create_completion(self, prompt, max_tokens=256, temperature=0.2, top_p=0.9,
+                          logprobs=None, stop=None, seed=None, stream=False, stopping_criteria=None, **kwargs):
+        rng = random.Random(zlib.crc32(prompt.encode("utf-8")) ^ (self.seed + (seed or 0)) ^ int(temperature * 1000))
+        words = self._answer(prompt, temperature, max_tokens, rng)
+        n_prompt = len(self.tokenize(prompt))
+        if self.prompt_tps:
+            time.sleep(n_prompt / self.prompt_tps)
+        if stopping_criteria is not None:
+            # token by token, like llama.cpp, so a stopping criterion can cut generation short
+            for i in range(len(words)):
+                if self.gen_tps:
+                    time.sleep(1.0 / self.gen_tps)
+                if stopping_criteria(None, None):
+                    words = words[:i + 1]
+                    break
+        elif self.gen_tps:
+            time.sleep(len(words) / self.gen_tps)
+
+        tokens = [(" " if i else "") + w for i, w in enumerate(words)]
+        offsets, pos = [], len(prompt)
+        for t in tokens:
+            offsets.append(pos)
+            pos += len(t)
+        choice = {"text": "".join(tokens), "index": 0, "finish_reason": "stop"}
+        if logprobs:
+            choice["logprobs"] = {
+                "tokens": tokens,
+                "token_logprobs": [-abs(rng.gauss(0.4, 0.3)) for _ in tokens],
+                "text_offset": offsets,
+                "top_logprobs": None,
+            }
+        return {
+            "choices": [choice],
+            "usage": {"prompt_tokens": n_prompt, "completion_tokens": len(tokens),
+                      "total_tokens": n_prompt + len(tokens)},
+        }
+
+
+def stub_generator_fn(llm: StubLlama):
+    """generator_fn for safety_check_and_answer, shaped like mistral_generate_with_meta (one context, priority lock)."""
+    lock = PriorityLock()
+
+    def _gen(prompt, seed=0, temperature=0.2, return_generate_obj=False, max_tokens=256):
+        with lock:
+            out = llm.create_completion(prompt, max_tokens=max_tokens, temperature=temperature, logprobs=1, seed=seed,
+                                        stopping_criteria=stop_requested)
+        check_cancelled()
+        lp = out["choices"][0]["logprobs"]
+        return {
+            "text": out["choices"][0]["text"].strip(),
+            "generate_obj": {"tokens": lp["tokens"], "token_logprobs": lp["token_logprobs"],
+                             "text_offset": lp["text_offset"]},
+            "tokenizer": None,
+            "input_len": out["usage"]["prompt_tokens"],
+            "avg_logprob": float(np.mean(lp["token_logprobs"])) if lp["token_logprobs"] else None,
+        }
+
+    _gen.lock = lock
+    return _gen
+
+
+# -------------------------------------------------------
+# CORPUS
+# -------------------------------------------------------
+
+def synthetic_sentence(rng):
+    n = rng.randint(8, 20)
+    return " ".join(rng.choice(MEDICAL_WORDS) for _ in range(n)).capitalize() + "."
+
+
+def synthetic_corpus(n_chunks: int, words_per_chunk: int = 250, seed: int = 0):
+    """Chunk records {"book", "page", "text"} like pdf_preprocess_and_chunk.py writes."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(n_chunks):
+        sents, n = [], 0
+        while n < words_per_chunk:
+            s = synthetic_sentence(rng)
+            sents.append(s)
+            n += len(s.split())
+        out.append({"book": BOOKS[i % len(BOOKS)], "page": 1 + i // 3, "text": " ".join(sents)})
+    return out
+
+
+def synthetic_page(rng, n_lines: int = 45):
+    """Raw PDF-like page text with headers, figure labels and table rows mixed in."""
+    lines = ["OXFORD HANDBOOK OF CLINICAL MEDICINE", f"Page {rng.randint(1, 900)}"]
+    for i in range(n_lines):
+        r = rng.random()
+        if r < 0.05:
+            lines.append(f"Figure {rng.randint(1, 40)} Chest radiograph")
+        elif r < 0.10:
+            lines.append("Drug        Dose        Route")
+        else:
+            lines.append(synthetic_sentence(rng))
+    lines.append("www.example-medical-site.com")
+    return "\n".join(lines)
@@ -1,6 +1,11 @@
 # convert_to_instruction.py
+# Converts already split question/answer JSONL (eda&data_split.ipynb) to instruction JSONL.
+# For raw MedDialog files use ingest_meddialog.py, which extracts, filters, dedups and splits in one pass.
+import argparse
 import json
 
+from dataset_scripts.ingest_meddialog import MIN_ANSWER_CHARS
+
 def convert_file(in_path, out_path):
     print("Converting:", in_path)
     with open(in_path, "r", encoding="utf-8") as fin, open(out_path, "w", encoding="utf-8") as fout:
@@ -10,7 +15,7 @@ def convert_file(in_path, out_path):
             q = ex.get("question", "").strip()
             a = ex.get("answer", "").strip()
 
-            if not q or not a or len(a) < 20:
+            if not q or not a or len(a) < MIN_ANSWER_CHARS:
                 continue
 
             out = {
@@ -23,8 +28,16 @@ def convert_file(in_path, out_path):
     print("Saved:", out_path)
 
 
-convert_file("../datasets/processed/train.jsonl", "../datasets/processed/train_inst.jsonl")
-convert_file("../datasets/processed/val.jsonl", "../datasets/processed/val_inst.jsonl")
-convert_file("../datasets/processed/test.jsonl", "../datasets/processed/test_inst.jsonl")
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="question/answer JSONL -> instruction JSONL")
+    ap.add_argument("--dir", default="datasets/processed", help="folder with train/val/test.jsonl")
+    args = ap.parse_args(argv)
+
+    for split in ("train", "val", "test"):
+        convert_file(f"{args.dir}/{split}.jsonl", f"{args.dir}/{split}_inst.jsonl")
+
+    print("DONE")
+
 
-print("DONE")
+if __name__ == "__main__":
+    main()
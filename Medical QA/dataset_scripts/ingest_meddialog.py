@@ -0,0 +1,202 @@
+"""
+ingest_meddialog.py
+
+MedDialog raw dialogues -> train/val/test instruction JSONL, in one pass.
+
+This script:
+1. Streams each datasets/raw/meddialog/english-*.json file (a single JSON
+   array; ".gz" also works) one dialogue at a time, so memory stays
+   bounded by READ_CHUNK_CHARS plus the largest dialogue
+2. In a process pool, turns each dialogue's "utterances" into
+   question/answer pairs (consecutive "patient:" lines answered by the
+   following "doctor:" lines), normalizes whitespace and filters them
+   (the same limits as eda&data_split.ipynb)
+3. Drops exact duplicate pairs (8-byte hashes of the normalized text)
+4. Splits 80/10/10 by a hash of the question, so a repeated question never
+   lands in two splits and reruns give the same split
+5. Writes datasets/processed/{train,val,test}_inst.jsonl as
+   {"instruction", "input", "output", "source"}
+
+Run from the Medical QA folder:
+python -m dataset_scripts.ingest_meddialog
+python -m dataset_scripts.ingest_meddialog --inputs /data/meddialog/*.json --workers 16
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from glob import glob
+from multiprocessing import Pool
+
+RAW_GLOB = "datasets/raw/meddialog/english-*.json"
+OUT_DIR = "datasets/processed"
+
+MIN_ANSWER_CHARS = 20
+MAX_QUESTION_CHARS = 500
+SPLITS = (("train", 80), ("val", 10), ("test", 10))
+
+READ_CHUNK_CHARS = 1 << 20
+BATCH_DIALOGS = 500
+MAX_BATCHES_IN_FLIGHT = 4       # per worker; bounds memory while workers are busy
+
+_WS = re.compile(r"\s+")
+_SPEAKER = re.compile(r"^\s*(patient|doctor)\s*:\s*", re.IGNORECASE)
+
+
+def iter_json_array(path, chunk_chars: int = READ_CHUNK_CHARS):
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        buf, pos, started = "", 0, False
+        while True:
+            chunk = f.read(chunk_chars)
+            buf = buf[pos:] + chunk
+            pos = 0
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if not started and pos < len(buf):
+                    if buf[pos] != "[":
+                        raise ValueError(f"{path}: expected a JSON array")
+                    started = True
+                    pos += 1
+                    continue
+                if pos >= len(buf) or buf[pos] == "]":
+                    break
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    break               # element continues in the next chunk
+                yield obj
+                pos = end
+            if not chunk:
+                return
+
+
+def normalize(text: str) -> str:
+    return _WS.sub(" ", text or "").strip()
+
+
+def dialogue_pairs(dialogue):
+    """[(question, answer)] from consecutive patient turns and the doctor turns that answer them."""
+    pairs, q, a = [], [], []
+    for utt in dialogue.get("utterances") or []:
+        m = _SPEAKER.match(utt)
+        if not m:
+            continue
+        speaker, text = m.group(1).lower(), normalize(utt[m.end():])
+        if speaker == "patient":
+            if a:
+                pairs.append((" ".join(q), " ".join(a)))
+                q, a = [], []
+            q.append(text)
+        elif q:
+            a.append(text)
+    if q and a:
+        pairs.append((" ".join(q), " ".join(a)))
+    return pairs
+
+
+def process_batch(dialogues):
+    """Worker: extract and filter pairs; returns (records, counts)."""
+    out = []
+    counts = {"pairs": 0, "short_answer": 0, "long_question": 0}
+    for d in dialogues:
+        for q, a in dialogue_pairs(d):
+            counts["pairs"] += 1
+            if len(a) < MIN_ANSWER_CHARS:
+                counts["short_answer"] += 1
+                continue
+            if not q or len(q) >= MAX_QUESTION_CHARS:
+                counts["long_question"] += 1
+                continue
+            key = hashlib.blake2b((q.lower() + "\x00" + a.lower()).encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(hashlib.blake2b(q.lower().encode("utf-8"), digest_size=4).digest(), "big") % 100
+            out.append((key, bucket, q, a))
+    return out, counts
+
+
+def split_for(bucket: int) -> str:
+    edge = 0
+    for name, pct in SPLITS:
+        edge += pct
+        if bucket < edge:
+            return name
+    return SPLITS[-1][0]
+
+
+def _batches(paths, stats, window: threading.BoundedSemaphore):
+    for path in paths:
+        print("Reading:", path)
+        batch = []
+        for d in iter_json_array(path):
+            stats["dialogues"] += 1
+            batch.append(d)
+            if len(batch) >= BATCH_DIALOGS:
+                window.acquire()
+                yield batch
+                batch = []
+        if batch:
+            window.acquire()
+            yield batch
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--inputs", nargs="+", default=None, help=f"MedDialog JSON array files (default {RAW_GLOB})")
+    ap.add_argument("--out-dir", default=OUT_DIR)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args(argv)
+
+    paths = sorted(args.inputs or glob(RAW_GLOB))
+    if not paths:
+        print("[WARN] No MedDialog files found.")
+        return
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    outs = {name: open(os.path.join(args.out_dir, f"{name}_inst.jsonl"), "w", encoding="utf-8")
+            for name, _ in SPLITS}
+    stats = {"dialogues": 0, "pairs": 0, "short_answer": 0, "long_question": 0, "duplicates": 0}
+    written = {name: 0 for name, _ in SPLITS}
+    seen = set()
+
+    # the pool's feeder thread pulls batches only while fewer than the window are unprocessed
+    window = threading.BoundedSemaphore(MAX_BATCHES_IN_FLIGHT * max(1, args.workers))
+    t0 = time.perf_counter()
+    try:
+        with Pool(args.workers) as pool:
+            for records, counts in pool.imap(process_batch, _batches(paths, stats, window)):
+                window.release()
+                for k, v in counts.items():
+                    stats[k] += v
+                for key, bucket, q, a in records:
+                    if key in seen:
+                        stats["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    name = split_for(bucket)
+                    outs[name].write(json.dumps({"instruction": q, "input": "", "output": a, "source": "meddialog"},
+                                                ensure_ascii=False) + "\n")
+                    written[name] += 1
+    finally:
+        for f in outs.values():
+            f.close()
+
+    elapsed = time.perf_counter() - t0
+    print(f"\nDialogues: {stats['dialogues']} | pairs: {stats['pairs']} | "
+          f"short answers: {stats['short_answer']} | long questions: {stats['long_question']} | "
+          f"duplicates: {stats['duplicates']}")
+    for name, n in written.items():
+        print(f"{name:>5}: {n} -> {os.path.join(args.out_dir, f'{name}_inst.jsonl')}")
+    print(f"Done in {elapsed:.1f}s ({stats['dialogues'] / max(elapsed, 1e-9):.0f} dialogues/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,6 @@ import os
 import re
 import json
 from glob import glob
-import pdfplumber
 from tqdm import tqdm
 
 # -------------------------------------------------------
@@ -31,7 +30,6 @@ from tqdm import tqdm
 # -------------------------------------------------------
 
 OUTPUT_DIR = "../rag/chunks"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # Book paths (replace with your actual paths)
 PDFS = [
@@ -153,51 +151,60 @@ def chunk_text(words, chunk_size, overlap):
 # MAIN EXTRACTION LOOP
 # -------------------------------------------------------
 
-all_chunks_meta = []
+def main():
+    import pdfplumber
 
-for book in PDFS:
-    pdf_path = book["path"]
-    name = book["name"]
-    skip_first = book["skip_first"]
-    skip_last = book["skip_last"]
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    if not os.path.exists(pdf_path):
-        print(f"[WARN] Missing PDF: {pdf_path}")
-        continue
+    all_chunks_meta = []
 
-    print(f"\nProcessing: {name}")
+    for book in PDFS:
+        pdf_path = book["path"]
+        name = book["name"]
+        skip_first = book["skip_first"]
+        skip_last = book["skip_last"]
 
-    chunks_file = os.path.join(OUTPUT_DIR, f"{name}.jsonl")
+        if not os.path.exists(pdf_path):
+            print(f"[WARN] Missing PDF: {pdf_path}")
+            continue
 
-    with pdfplumber.open(pdf_path) as pdf, open(chunks_file, "w", encoding="utf-8") as out:
-        total_pages = len(pdf.pages)
-        start = skip_first
-        end = total_pages - skip_last
+        print(f"\nProcessing: {name}")
 
-        for p in tqdm(range(start, end), desc=f"{name} pages"):
-            raw = pdf.pages[p].extract_text()
-            if not raw:
-                continue
+        chunks_file = os.path.join(OUTPUT_DIR, f"{name}.jsonl")
 
-            cleaned = clean_page_text(raw)
-            if len(cleaned) < 200:
-                continue
+        with pdfplumber.open(pdf_path) as pdf, open(chunks_file, "w", encoding="utf-8") as out:
+            total_pages = len(pdf.pages)
+            start = skip_first
+            end = total_pages - skip_last
 
-            if stop_section_reached(cleaned):
-                break
+            for p in tqdm(range(start, end), desc=f"{name} pages"):
+                raw = pdf.pages[p].extract_text()
+                if not raw:
+                    continue
 
-            words = cleaned.split()
-            chunks = chunk_text(words, CHUNK_WORDS, CHUNK_OVERLAP)
+                cleaned = clean_page_text(raw)
+                if len(cleaned) < 200:
+                    continue
 
-            for c in chunks:
-                record = {
-                    "book": name,
-                    "page": p + 1,
-                    "text": c
-                }
-                out.write(json.dumps(record, ensure_ascii=False) + "\n")
-                all_chunks_meta.append(record)
+                if stop_section_reached(cleaned):
+                    break
 
-print("\nCompleted clean chunk generation.")
-print(f"Files saved in: {OUTPUT_DIR}")
-print(f"Total chunks generated: {len(all_chunks_meta)}")
+                words = cleaned.split()
+                chunks = chunk_text(words, CHUNK_WORDS, CHUNK_OVERLAP)
+
+                for c in chunks:
+                    record = {
+                        "book": name,
+                        "page": p + 1,
+                        "text": c
+                    }
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    all_chunks_meta.append(record)
+
+    print("\nCompleted clean chunk generation.")
+    print(f"Files saved in: {OUTPUT_DIR}")
+    print(f"Total chunks generated: {len(all_chunks_meta)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+CPU-optimized backends for the encoder models (BGE embedder, PubMedBERT NLI).
+
+Backends:
+ - "torch"      : fp32 PyTorch, unchanged behaviour
+ - "torch_int8" : torch dynamic int8 quantization of every nn.Linear (built at load time)
+ - "onnx_int8"  : ONNX export + onnxruntime dynamic int8 quantization, cached on disk
+
+The ONNX artifacts live in ONNX_CACHE_DIR/<model name>/ together with the
+tokenizer and config, so after the first export the torch weights are not
+loaded at all. Each export is followed by a parity check against fp32.
+
+Functions:
+ - load_sentence_encoder(model_id, backend, device, cache_folder) -> object with .encode(...)
+ - load_sequence_classifier(model_id, backend, device) -> (tokenizer, model)
+ - embedder_parity(reference, candidate, texts) -> dict
+ - classifier_parity(tokenizer, reference, candidate, pairs) -> dict
+"""
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from inference_scripts.shared_weights import SHARED_MEMORY, share_weights
+from inference_scripts.thread_budget import apply_thread_budget
+
+ENCODER_BACKENDS = ("torch", "torch_int8", "onnx_int8")
+
+ONNX_CACHE_DIR = "models/onnx/"
+ONNX_OPSET = 14
+
+PARITY_TEXTS = [
+    "Asthma causes wheezing, breathlessness and chest tightness.",
+    "Metformin is a first-line drug for type 2 diabetes.",
+    "Fever above 39 C in infants needs urgent evaluation.",
+]
+PARITY_PAIRS = [
+    ("Asthma is a chronic inflammatory disease of the airways.", "Asthma affects the airways."),
+    ("Metformin lowers hepatic glucose output.", "Metformin raises blood glucose."),
+    ("Aspirin irreversibly inhibits cyclooxygenase.", "The patient has a fever."),
+]
+PARITY_MIN_COSINE = 0.98
+PARITY_MAX_PROB_DIFF = 0.05
+
+
+def _check_backend(backend):
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend} (expected one of {ENCODER_BACKENDS})")
+
+
+def _artifact_dir(model_id):
+    return os.path.join(ONNX_CACHE_DIR, model_id.replace("/", "__"))
+
+
+def _quantize_onnx(fp32_path, int8_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+
+def _ort_session(path):
+    import onnxruntime as ort
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.intra_op_num_threads = apply_thread_budget()["torch_threads"]
+    return ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+
+def _ort_feed(session, enc):
+    names = {i.name for i in session.get_inputs()}
+    return {k: np.asarray(v, dtype="int64") for k, v in enc.items() if k in names}
+
+
+# -------------------------------------------------------
+# SENTENCE ENCODER (BGE)
+# -------------------------------------------------------
+
+class _SentenceEmbeddingGraph(torch.nn.Module):
+    """Wraps a SentenceTransformer so pooling + normalization are part of the exported graph."""
+
+    def __init__(self, st):
+        super().__init__()
+        self.st = st
+
+    def forward(self, input_ids, attention_mask):
+        return self.st({"input_ids": input_ids, "attention_mask": attention_mask})["sentence_embedding"]
+
+
+class OnnxSentenceEncoder:
+    """Drop-in for the subset of SentenceTransformer.encode used by RAG and check_consistency."""
+
+    def __init__(self, session, tokenizer, max_seq_length=512):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, convert_to_tensor=False,
+               normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # length-sorted batches keep padding per batch small
+        order = np.argsort([-len(s) for s in sentences])
+        out = [None] * len(sentences)
+        for start in range(0, len(sentences), batch_size):
+            idx = order[start:start + batch_size]
+            enc = self.tokenizer([sentences[i] for i in idx], padding=True, truncation=True,
+                                 max_length=self.max_seq_length, return_tensors="np")
+            embs = self.session.run(None, _ort_feed(self.session, enc))[0]
+            for i, e in zip(idx, embs):
+                out[i] = e
+
+        embs = np.stack(out).astype("float32")
+        if normalize_embeddings:
+            norms = np.linalg.norm(embs, axis=1, keepdims=True)
+            embs = embs / np.maximum(norms, 1e-12)
+
+        if single:
+            embs = embs[0]
+        if convert_to_tensor:
+            return torch.from_numpy(embs)
+        return embs
+
+
+def _export_sentence_encoder(model_id, cache_folder, out_dir):
+    from sentence_transformers import SentenceTransformer
+
+    print("Exporting sentence encoder to ONNX:", model_id)
+    st = SentenceTransformer(model_id, device="cpu", cache_folder=cache_folder)
+    st.eval()
+    os.makedirs(out_dir, exist_ok=True)
+
+    enc = st.tokenizer(PARITY_TEXTS, padding=True, return_tensors="pt")
+    fp32_path = os.path.join(out_dir, "model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            _SentenceEmbeddingGraph(st),
+            (enc["input_ids"], enc["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "sentence_embedding": {0: "batch"},
+            },
+            opset_version=ONNX_OPSET,
+        )
+    _quantize_onnx(fp32_path, os.path.join(out_dir, "model_int8.onnx"))
+    st.tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, "max_seq_length.txt"), "w") as f:
+        f.write(str(st.max_seq_length))
+    return st
+
+
+def load_sentence_encoder(model_id: str, backend: str = "torch", device: str = None,
+                          cache_folder: str = "models/bge/"):
+    _check_backend(backend)
+    apply_thread_budget()
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    if backend == "torch" or device != "cpu":
+        from sentence_transformers import SentenceTransformer
+        st = SentenceTransformer(model_id, device=device, cache_folder=cache_folder)
+        if SHARED_MEMORY and device == "cpu":
+            share_weights(st, model_id)
+        return st
+
+    if backend == "torch_int8":
+        from sentence_transformers import SentenceTransformer
+        st = SentenceTransformer(model_id, device="cpu", cache_folder=cache_folder)
+        return torch.quantization.quantize_dynamic(st, {torch.nn.Linear}, dtype=torch.qint8)
+
+    from transformers import AutoTokenizer
+    out_dir = _artifact_dir(model_id)
+    onnx_path = os.path.join(out_dir, "model_int8.onnx")
+    reference = None
+    if not os.path.exists(onnx_path):
+        reference = _export_sentence_encoder(model_id, cache_folder, out_dir)
+
+    with open(os.path.join(out_dir, "max_seq_length.txt")) as f:
+        max_len = int(f.read().strip())
+    encoder = OnnxSentenceEncoder(_ort_session(onnx_path), AutoTokenizer.from_pretrained(out_dir), max_len)
+
+    if reference is not None:
+        report = embedder_parity(reference, encoder)
+        print("ONNX int8 parity:", report)
+        if report["min_cosine"] < PARITY_MIN_COSINE:
+            print(f"[WARN] {model_id} int8 embeddings drift from fp32 (min cosine {report['min_cosine']:.4f})")
+    return encoder
+
+
+def embedder_parity(reference, candidate, texts=None):
+    texts = texts or PARITY_TEXTS
+    a = np.asarray(reference.encode(texts, convert_to_numpy=True, normalize_embeddings=True), dtype="float32")
+    b = np.asarray(candidate.encode(texts, convert_to_numpy=True, normalize_embeddings=True), dtype="float32")
+    cos = np.sum(a * b, axis=1)
+    return {"min_cosine": float(cos.min()), "mean_cosine": float(cos.mean()),
+            "max_abs_diff": float(np.abs(a - b).max())}
+
+
+# -------------------------------------------------------
+# SEQUENCE CLASSIFIER (NLI)
+# -------------------------------------------------------
+
+class OnnxSequenceClassifier:
+    """Callable like a HF model: model(**enc).logits, with .config and a no-op .to()."""
+
+    def __init__(self, session, config):
+        self.session = session
+        self.config = config
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, **enc):
+        feed = _ort_feed(self.session, {k: v.cpu().numpy() for k, v in enc.items()})
+        logits = self.session.run(None, feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def _export_sequence_classifier(model_id, out_dir):
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    print("Exporting sequence classifier to ONNX:", model_id)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForSequenceClassification.from_pretrained(model_id)
+    model.eval()
+    os.makedirs(out_dir, exist_ok=True)
+
+    premises, hyps = zip(*PARITY_PAIRS)
+    enc = tokenizer(list(premises), list(hyps), padding=True, return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in enc]
+    fp32_path = os.path.join(out_dir, "model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(enc[n] for n in names),
+            fp32_path,
+            input_names=names,
+            output_names=["logits"],
+            dynamic_axes={**{n: {0: "batch", 1: "seq"} for n in names}, "logits": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        )
+    _quantize_onnx(fp32_path, os.path.join(out_dir, "model_int8.onnx"))
+    tokenizer.save_pretrained(out_dir)
+    model.config.save_pretrained(out_dir)
+    return model
+
+
+def load_sequence_classifier(model_id: str, backend: str = "torch", device: str = None):
+    _check_backend(backend)
+    apply_thread_budget()
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoConfig
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    if backend == "torch" or device != "cpu":
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        model = AutoModelForSequenceClassification.from_pretrained(model_id).to(device)
+        if SHARED_MEMORY and device == "cpu":
+            share_weights(model, model_id)
+        return tokenizer, model
+
+    if backend == "torch_int8":
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        model = AutoModelForSequenceClassification.from_pretrained(model_id)
+        model.eval()
+        return tokenizer, torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    out_dir = _artifact_dir(model_id)
+    onnx_path = os.path.join(out_dir, "model_int8.onnx")
+    reference = None
+    if not os.path.exists(onnx_path):
+        reference = _export_sequence_classifier(model_id, out_dir)
+
+    tokenizer = AutoTokenizer.from_pretrained(out_dir)
+    model = OnnxSequenceClassifier(_ort_session(onnx_path), AutoConfig.from_pretrained(out_dir))
+
+    if reference is not None:
+        report = classifier_parity(tokenizer, reference, model)
+        print("ONNX int8 parity:", report)
+        if report["max_prob_diff"] > PARITY_MAX_PROB_DIFF or report["label_agreement"] < 1.0:
+            print(f"[WARN] {model_id} int8 probabilities drift from fp32 (max diff {report['max_prob_diff']:.4f})")
+    return tokenizer, model
+
+
+def classifier_parity(tokenizer, reference, candidate, pairs=None):
+    pairs = pairs or PARITY_PAIRS
+    premises, hyps = zip(*pairs)
+    enc = tokenizer(list(premises), list(hyps), padding=True, truncation=True, return_tensors="pt")
+    with torch.no_grad():
+        p_ref = torch.softmax(reference(**enc).logits, dim=-1).cpu().numpy()
+        p_new = torch.softmax(candidate(**enc).logits, dim=-1).cpu().numpy()
+    return {"max_prob_diff": float(np.abs(p_ref - p_new).max()),
+            "label_agreement": float(np.mean(p_ref.argmax(-1) == p_new.argmax(-1)))}
@@ -0,0 +1,47 @@
+"""
+Parity check of the accelerated encoder backends against fp32 torch.
+
+Run from the Medical QA folder:
+python -m inference_scripts.encoder_parity
+"""
+import time
+
+from inference_scripts.encoder_backends import (
+    ENCODER_BACKENDS, PARITY_TEXTS, PARITY_PAIRS,
+    load_sentence_encoder, load_sequence_classifier,
+    embedder_parity, classifier_parity,
+)
+
+EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+NLI_MODEL = "pritamdeka/PubMedBERT-MNLI-MedNLI"
+N_RUNS = 10
+
+
+def _time(fn, n=N_RUNS):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1000.0
+
+
+def main():
+    ref_emb = load_sentence_encoder(EMBED_MODEL, "torch", device="cpu")
+    ref_tok, ref_nli = load_sequence_classifier(NLI_MODEL, "torch", device="cpu")
+    premises, hyps = zip(*PARITY_PAIRS)
+    enc = ref_tok(list(premises), list(hyps), padding=True, truncation=True, return_tensors="pt")
+
+    for backend in ENCODER_BACKENDS:
+        emb = ref_emb if backend == "torch" else load_sentence_encoder(EMBED_MODEL, backend, device="cpu")
+        tok, nli = (ref_tok, ref_nli) if backend == "torch" else load_sequence_classifier(NLI_MODEL, backend, device="cpu")
+
+        emb_ms = _time(lambda: emb.encode(PARITY_TEXTS, convert_to_numpy=True, normalize_embeddings=True))
+        nli_ms = _time(lambda: nli(**enc))
+
+        print(f"\n{backend}")
+        print(f"  BGE  {emb_ms:8.1f} ms/batch | {embedder_parity(ref_emb, emb)}")
+        print(f"  NLI  {nli_ms:8.1f} ms/batch | {classifier_parity(tok, ref_nli, nli)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,61 @@
-from llama_cpp import Llama
+from llama_cpp import Llama, StoppingCriteriaList
 import numpy as np
 
+from monitoring_scripts import metrics
+from serving_scripts.request_context import PriorityLock, stop_requested, check_cancelled
+from inference_scripts.thread_budget import llama_kwargs, llama_affinity
+
 MODEL_PATH = r"C:\Users\amanv\Downloads\Adv. NLP\Medical Wellness Assistant\Medical QA\models\mistral-7b-instruct.gguf"
 
 print("Loading Mistral GGUF with logits_all=True...")
 
-llm = Llama(
-    model_path=MODEL_PATH,
-    n_ctx=4096,
-    n_gpu_layers=35,
-    n_threads=6,
-    logits_all=True,      # <-- REQUIRED
-    verbose=False
-)
+# n_threads / n_threads_batch / n_batch come from the worker's CPU budget (inference_scripts/thread_budget.py)
+with llama_affinity():
+    llm = Llama(
+        model_path=MODEL_PATH,
+        n_ctx=4096,
+        n_gpu_layers=35,
+        logits_all=True,      # <-- REQUIRED
+        use_mmap=True,        # weights stay in the page cache, shared by all API workers
+        verbose=False,
+        **llama_kwargs()
+    )
+
+# A Llama context is not thread-safe; /chat and /batch_chat may generate concurrently.
+# Interactive requests get the context before batch / warming jobs (serving_scripts/request_context.py).
+_llm_lock = PriorityLock()
+
+# stops generation at the next token once the current request is cancelled or past its deadline
+_stop_on_cancel = StoppingCriteriaList([stop_requested])
+
+
+def generator_lock():
+    return _llm_lock
+
+
+def count_tokens(text):
+    """Prompt tokens as the GGUF tokenizer counts them (no BOS)."""
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
 
 
 def mistral_generate(prompt, max_tokens=256, temperature=0.2):
     """
     Simple text-only generation (no metadata)
     """
-    out = llm.create_completion(
-        prompt=prompt,
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=0.9,
-        stop=["</s>", "###"]
-    )
+    with _llm_lock, llama_affinity():
+        out = llm.create_completion(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=0.9,
+            stop=["</s>", "###"],
+            stopping_criteria=_stop_on_cancel
+        )
+    check_cancelled()
     return out["choices"][0]["text"].strip()
 
 
-def mistral_generate_with_meta(prompt, seed=0, temperature=0.2, return_generate_obj=False):
+def mistral_generate_with_meta(prompt, seed=0, temperature=0.2, return_generate_obj=False, max_tokens=256):
     """
     Full metadata generator compatible with your safety pipeline.
     Returns:
@@ -40,14 +66,21 @@ def mistral_generate_with_meta(prompt, seed=0, temperature=0.2, return_generate_
     """
 
     # 1. Run llama-cpp completion with logprobs enabled
-    out = llm.create_completion(
-        prompt=prompt,
-        max_tokens=256,
-        temperature=temperature,
-        top_p=0.9,
-        logprobs=1,            # <-- KEY
-        stop=["</s>", "###"]
-    )
+    with _llm_lock, llama_affinity():
+        out = llm.create_completion(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=0.9,
+            logprobs=1,            # <-- KEY
+            stop=["</s>", "###"],
+            stopping_criteria=_stop_on_cancel
+        )
+    # a generation cut short by cancellation is not an answer
+    check_cancelled()
+
+    usage = out["usage"]
+    metrics.record_tokens(usage["prompt_tokens"], usage["completion_tokens"])
 
     choice = out["choices"][0]
     text = choice["text"]
@@ -0,0 +1,78 @@
+"""
+Read-only model weights shared between API worker processes.
+
+`uvicorn api:app --workers N` starts N separate processes, and each one
+loads its own copy of every model. With MEDIQA_SHARED_MEMORY=1 the fp32
+CPU torch models (BGE embedder, NLI classifier, reranker) have their
+parameters saved once to SHARED_WEIGHTS_DIR/<model>.<digest>.pt. Each process then
+reloads them with torch.load(mmap=True) + load_state_dict(assign=True), so
+the tensors point into a read-only file mapping. All workers map the same
+file, and the OS keeps one copy in the page cache instead of N private
+copies. The FAISS index and chunk store are mapped the same way (see
+rag/rag_query_engine.py), and llama.cpp mmaps the GGUF file by default.
+
+<digest> is a hash of the weights the process just loaded, so a new hub
+revision or a local fine-tune gets a file of its own instead of silently
+reusing the old one (hashing BGE-large costs about a second at startup).
+Files of other digests for the same model are removed when a new one is written.
+
+Only for CPU inference: CUDA tensors and int8 / ONNX backends keep private memory.
+
+Use:
+from inference_scripts.shared_weights import SHARED_MEMORY, share_weights
+
+if SHARED_MEMORY:
+    share_weights(model, "BAAI/bge-large-en-v1.5")
+"""
+import gc
+import hashlib
+import os
+
+import torch
+
+SHARED_MEMORY = os.environ.get("MEDIQA_SHARED_MEMORY", "0") == "1"
+SHARED_WEIGHTS_DIR = "models/shared/"
+
+
+def state_digest(state: dict) -> str:
+    """Hash of every tensor's name, dtype, shape and bytes."""
+    h = hashlib.blake2b(digest_size=8)
+    for key, t in state.items():
+        t = t.detach().cpu().contiguous()
+        h.update(f"{key}:{t.dtype}:{tuple(t.shape)};".encode("utf-8"))
+        h.update(t.reshape(-1).view(torch.uint8).numpy().data)
+    return h.hexdigest()
+
+
+def shared_weights_path(name: str, digest: str) -> str:
+    return os.path.join(SHARED_WEIGHTS_DIR, f"{name.replace('/', '__')}.{digest}.pt")
+
+
+def _remove_stale(name: str, keep: str):
+    prefix = name.replace("/", "__") + "."
+    for f in os.listdir(SHARED_WEIGHTS_DIR):
+        path = os.path.join(SHARED_WEIGHTS_DIR, f)
+        # <name>.<digest>.pt, or <name>.pt from before files were keyed by digest
+        if f.startswith(prefix) and f.endswith(".pt") and path != keep and (f[len(prefix):-3].isalnum() or f == prefix + "pt"):
+            # workers still mapping the old file keep it until they exit
+            os.remove(path)
+
+
+def share_weights(model: torch.nn.Module, name: str) -> torch.nn.Module:
+    """Re-point `model`'s parameters and buffers at a memory-mapped copy on disk (written for new weights)."""
+    state = model.state_dict()
+    path = shared_weights_path(name, state_digest(state))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # workers may start together; each writes its own temp file and the rename is atomic
+        tmp = f"{path}.{os.getpid()}.tmp"
+        torch.save(state, tmp)
+        os.replace(tmp, path)
+        _remove_stale(name, path)
+    del state
+
+    state = torch.load(path, mmap=True, weights_only=True, map_location="cpu")
+    model.load_state_dict(state, assign=True)
+    # the private copies loaded by from_pretrained are freed here
+    gc.collect()
+    return model
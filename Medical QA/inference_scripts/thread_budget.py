@@ -0,0 +1,186 @@
+"""
+One CPU thread budget for every model in a worker process.
+
+By default llama.cpp, PyTorch (BGE embedder, PubMedBERT NLI, reranker) and
+FAISS (OpenMP) each size their thread pools for the whole machine. Under
+concurrency they all run at once with more threads than there are cores,
+and throughput collapses. thread_budget() first splits the cores this
+process may use between the `uvicorn --workers` processes
+(MEDIQA_WORKERS). It then splits one worker's share between llama.cpp
+(llama_share) and the torch / FAISS side:
+
+ - llama.cpp : n_threads (generation), n_threads_batch (prompt), n_batch
+ - torch     : torch.set_num_threads
+ - FAISS     : faiss.omp_set_num_threads and the sharded-index search pool
+
+With MEDIQA_PIN_CORES=1 (Linux only), each worker claims its own slice of
+cores. llama.cpp runs on the first llama_share of the slice, or on all of
+it when prompt processing uses every core. Torch and FAISS run on the
+rest of the slice.
+
+The split can be tuned. BUDGET_PATH (written by
+benchmark_scripts/autotune_threads.py) overrides the defaults, and
+MEDIQA_LLAMA_THREADS / MEDIQA_TORCH_THREADS override both for one-off runs.
+
+Use (model loaders call apply_thread_budget() before loading; only the first call does anything):
+from inference_scripts.thread_budget import apply_thread_budget, llama_kwargs, llama_affinity
+
+budget = apply_thread_budget()
+llm = Llama(model_path, **llama_kwargs())
+with llama_affinity():
+    llm.create_completion(...)
+
+Print the budget of a worker:
+python -m inference_scripts.thread_budget --workers 2
+"""
+import argparse
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+WORKERS = int(os.environ.get("MEDIQA_WORKERS", "1"))
+PIN_CORES = os.environ.get("MEDIQA_PIN_CORES", "0") == "1"
+BUDGET_PATH = os.environ.get("MEDIQA_THREAD_BUDGET", "thread_budget.json")
+
+# defaults, replaced by whatever BUDGET_PATH sets
+TUNABLES = {
+    "llama_share": 0.5,         # fraction of a worker's cores for llama.cpp generation
+    "llama_batch_all": True,    # prompt processing uses all of the worker's cores (it never overlaps generation)
+    "n_batch": 512,             # llama.cpp prompt tokens per forward pass
+}
+
+_budget = None
+_slot_lock = None
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def load_tunables(path: str = BUDGET_PATH) -> dict:
+    tunables = dict(TUNABLES)
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            tunables.update({k: v for k, v in json.load(f).items() if k in TUNABLES})
+    return tunables
+
+
+def claim_worker_slot(workers: int) -> int:
+    """
+    Index of this worker among `workers` processes on the machine.
+    uvicorn does not number its workers, so each claims the first free lock file (held until exit).
+    """
+    global _slot_lock
+    import fcntl
+    for slot in range(workers):
+        f = open(os.path.join(tempfile.gettempdir(), f"mediqa_worker_slot_{slot}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_lock = f
+        return slot
+    print(f"[WARN] More than {workers} workers claimed core slots; sharing slot 0")
+    return 0
+
+
+def thread_budget(workers: int = WORKERS, slot: int = 0, tunables: dict = None, cores=None) -> dict:
+    """Thread counts and core sets for worker `slot` of `workers`."""
+    t = dict(TUNABLES, **(tunables or {}))
+    cores = list(cores) if cores is not None else available_cores()
+    per_worker = max(1, len(cores) // max(1, workers))
+    worker_cores = cores[slot * per_worker:(slot + 1) * per_worker] or cores
+
+    n = len(worker_cores)
+    llama_threads = int(os.environ.get("MEDIQA_LLAMA_THREADS", "0")) or \
+        min(n, max(1, round(n * t["llama_share"])))
+    torch_threads = int(os.environ.get("MEDIQA_TORCH_THREADS", "0")) or max(1, n - llama_threads)
+    # prompt threads that span the slice need all of it; with fewer cores than two pools, both sides share it
+    llama_cores = worker_cores if t["llama_batch_all"] else worker_cores[:llama_threads]
+    torch_cores = worker_cores[llama_threads:] or worker_cores
+
+    return {
+        "cores": len(cores),
+        "workers": workers,
+        "slot": slot,
+        "worker_cores": worker_cores,
+        "llama_cores": llama_cores,
+        "torch_cores": torch_cores,
+        "n_threads": llama_threads,
+        "n_threads_batch": n if t["llama_batch_all"] else llama_threads,
+        "n_batch": int(t["n_batch"]),
+        "torch_threads": torch_threads,
+        "faiss_threads": torch_threads,
+        "pinned": False,
+        "tunables": t,
+    }
+
+
+def apply_thread_budget(tunables: dict = None, workers: int = WORKERS, pin: bool = PIN_CORES) -> dict:
+    """Compute this worker's budget and apply it to torch / FAISS (and the CPU affinity when pinning)."""
+    global _budget
+    if _budget is not None:
+        return _budget
+
+    pin = pin and hasattr(os, "sched_setaffinity")
+    slot = claim_worker_slot(workers) if pin and workers > 1 else 0
+    budget = thread_budget(workers, slot, tunables or load_tunables())
+
+    import torch
+    import faiss
+    torch.set_num_threads(budget["torch_threads"])
+    faiss.omp_set_num_threads(budget["faiss_threads"])
+    if pin:
+        # threads started from here on (uvicorn's threadpool, torch / OpenMP teams) inherit this set
+        os.sched_setaffinity(0, budget["torch_cores"])
+        budget["pinned"] = True
+
+    print(f"Thread budget (worker {slot + 1}/{workers}, {len(budget['worker_cores'])} of {budget['cores']} cores): "
+          f"llama {budget['n_threads']}/{budget['n_threads_batch']} threads, n_batch {budget['n_batch']}, "
+          f"torch {budget['torch_threads']}, faiss {budget['faiss_threads']}"
+          + (f", pinned llama={budget['llama_cores']} torch={budget['torch_cores']}" if pin else ""))
+    _budget = budget
+    return budget
+
+
+def llama_kwargs() -> dict:
+    b = apply_thread_budget()
+    return {"n_threads": b["n_threads"], "n_threads_batch": b["n_threads_batch"], "n_batch": b["n_batch"]}
+
+
+@contextmanager
+def llama_affinity():
+    """Run llama.cpp on its own cores; threads it starts inside inherit them. No-op unless pinned."""
+    b = apply_thread_budget()
+    if not b["pinned"]:
+        yield
+        return
+    previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, b["llama_cores"])
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--budget", default=BUDGET_PATH)
+    args = ap.parse_args(argv)
+
+    tunables = load_tunables(args.budget)
+    print(f"Tunables: {tunables}" + ("" if os.path.exists(args.budget) else " (defaults; no " + args.budget + ")"))
+    for slot in range(args.workers):
+        b = thread_budget(args.workers, slot, tunables)
+        print(f"worker {slot}: cores {b['worker_cores']} | llama n_threads={b['n_threads']} "
+              f"n_threads_batch={b['n_threads_batch']} n_batch={b['n_batch']} on {b['llama_cores']} | "
+              f"torch {b['torch_threads']} / faiss {b['faiss_threads']} on {b['torch_cores']}")
+
+
+if __name__ == "__main__":
+    main()
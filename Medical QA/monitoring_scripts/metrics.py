@@ -0,0 +1,171 @@
+"""
+In-process metrics for the /chat pipeline, exported in Prometheus text format.
+
+Every pipeline stage is wrapped in `span(stage)`, which observes the stage
+latency histogram and, inside `request_timings()`, also records the timing
+for the current request so api.py can add a breakdown to `meta`.
+
+Metrics:
+ - mediqa_stage_latency_seconds{stage}     histogram
+ - mediqa_request_latency_seconds{endpoint} histogram
+ - mediqa_prompt_tokens / mediqa_completion_tokens  histograms
+ - mediqa_tokens_total{kind}               counter
+ - mediqa_abstain_total{stage}             counter
+ - mediqa_decisions_total{status}          counter
+ - anything added with register_collector() (e.g. session store gauges)
+
+Each uvicorn worker keeps its own registry.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def _fmt_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple((n, str(labels.get(n, ""))) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {v}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((n, str(labels.get(n, ""))) for n in self.labelnames)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s["counts"][i] += 1
+            s["sum"] += value
+            s["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, s in sorted(self._series.items()):
+                for b, c in zip(self.buckets, s["counts"]):
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key + (('le', str(b)),))} {c}")
+                lines.append(f"{self.name}_bucket{_fmt_labels(key + (('le', '+Inf'),))} {s['count']}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {s['sum']}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {s['count']}")
+        return lines
+
+
+STAGE_LATENCY = Histogram("mediqa_stage_latency_seconds", "Latency of each pipeline stage.", labelnames=("stage",))
+REQUEST_LATENCY = Histogram("mediqa_request_latency_seconds", "End-to-end latency per endpoint.", labelnames=("endpoint",))
+PROMPT_TOKENS = Histogram("mediqa_prompt_tokens", "Prompt tokens per generation.", buckets=TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram("mediqa_completion_tokens", "Completion tokens per generation.", buckets=TOKEN_BUCKETS)
+TOKENS = Counter("mediqa_tokens_total", "Tokens processed by the generator.", labelnames=("kind",))
+ABSTAIN = Counter("mediqa_abstain_total", "Abstain decisions by the stage that triggered them.", labelnames=("stage",))
+DECISIONS = Counter("mediqa_decisions_total", "Final pipeline decisions.", labelnames=("status",))
+CANCELLED = Counter("mediqa_cancelled_total", "Requests stopped before finishing, by reason (deadline, disconnected).",
+                    labelnames=("reason",))
+
+_METRICS = [STAGE_LATENCY, REQUEST_LATENCY, PROMPT_TOKENS, COMPLETION_TOKENS, TOKENS, ABSTAIN, DECISIONS, CANCELLED]
+_COLLECTORS = []
+
+_request_timings: ContextVar = ContextVar("mediqa_request_timings", default=None)
+
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_LATENCY.observe(dt, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, dt))
+
+
+@contextmanager
+def request_timings():
+    """Collect (stage, seconds) pairs for every span() entered in this context."""
+    timings = []
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def timing_breakdown(timings) -> dict:
+    """Compact {stage: ms} summary; repeated stages (e.g. consistency generations) are summed."""
+    out = {}
+    for stage, dt in timings:
+        out[stage] = out.get(stage, 0.0) + dt * 1000.0
+    return {k: round(v, 1) for k, v in out.items()}
+
+
+def record_tokens(prompt_tokens: int, completion_tokens: int):
+    PROMPT_TOKENS.observe(prompt_tokens)
+    COMPLETION_TOKENS.observe(completion_tokens)
+    TOKENS.inc(prompt_tokens, kind="prompt")
+    TOKENS.inc(completion_tokens, kind="completion")
+
+
+def record_abstain(stage: str):
+    ABSTAIN.inc(stage=stage)
+
+
+def record_decision(status: str):
+    DECISIONS.inc(status=status)
+
+
+def record_cancelled(reason: str):
+    CANCELLED.inc(reason=reason)
+
+
+def register_collector(fn):
+    """fn() -> list of (name, help, value) gauges, evaluated at scrape time."""
+    _COLLECTORS.append(fn)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for m in _METRICS:
+        lines.extend(m.render())
+    for fn in _COLLECTORS:
+        for name, help, value in fn():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,75 @@
+"""
+Per-process memory, to check what API workers really share.
+
+RSS counts every resident page, including pages that other workers map
+too. PSS divides each shared page by the number of processes mapping it.
+The sum of worker PSS is therefore the real footprint, and
+shared / rss shows how much of a worker is shared. Read from
+/proc/<pid>/smaps_rollup on Linux; elsewhere only peak RSS is available.
+
+api.py exports these for the worker that serves the scrape as
+mediqa_process_*_bytes and at GET /memory.
+
+Report every worker of a running server (pid of the uvicorn / gunicorn master):
+python -m monitoring_scripts.process_memory 12345
+"""
+import argparse
+import os
+import sys
+
+_FIELDS = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared_clean", "Shared_Dirty": "shared_dirty",
+           "Private_Clean": "private_clean", "Private_Dirty": "private_dirty"}
+
+
+def memory_usage(pid="self"):
+    """{"rss", "pss", "shared", "private", ...} in bytes for one process."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            lines = f.readlines()
+    except OSError:
+        if pid != "self":
+            raise
+        try:
+            import resource
+        except ImportError:         # Windows
+            return {}
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss": peak if sys.platform == "darwin" else peak * 1024, "peak_only": True}
+
+    out = {}
+    for line in lines:
+        key, _, rest = line.partition(":")
+        if key in _FIELDS:
+            out[_FIELDS[key]] = int(rest.split()[0]) * 1024
+    out["shared"] = out.get("shared_clean", 0) + out.get("shared_dirty", 0)
+    out["private"] = out.get("private_clean", 0) + out.get("private_dirty", 0)
+    return out
+
+
+def child_pids(pid: int):
+    pids = []
+    task_dir = f"/proc/{pid}/task"
+    for tid in os.listdir(task_dir):
+        with open(os.path.join(task_dir, tid, "children"), "r") as f:
+            pids.extend(int(p) for p in f.read().split())
+    return pids
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("master_pid", type=int)
+    args = ap.parse_args(argv)
+
+    # uvicorn --workers starts a multiprocessing resource tracker too; it shows up as a tiny child
+    rows = [(pid, memory_usage(pid)) for pid in child_pids(args.master_pid)]
+    print(f"{'pid':>8} {'rss MB':>9} {'pss MB':>9} {'shared MB':>10} {'private MB':>11}")
+    for pid, m in rows:
+        print(f"{pid:>8} {m['rss'] / 1e6:>9.1f} {m['pss'] / 1e6:>9.1f} {m['shared'] / 1e6:>10.1f} "
+              f"{m['private'] / 1e6:>11.1f}")
+    rss = sum(m["rss"] for _, m in rows)
+    pss = sum(m["pss"] for _, m in rows)
+    print(f"\n{len(rows)} workers: sum RSS {rss / 1e6:.1f} MB, real footprint (sum PSS) {pss / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
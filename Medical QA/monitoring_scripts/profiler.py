@@ -0,0 +1,130 @@
+"""
+Opt-in stack-sampling profiler for single /chat requests.
+
+A request is profiled when it carries the `X-Profile: 1` header (api.py
+honours it only together with a valid X-Admin-Token) or when it falls in the
+PROFILE_SAMPLE_RATE fraction of traffic. A background thread
+then samples the stack of the thread running ask() every
+PROFILE_INTERVAL_SECONDS and the samples are written, on exit, as
+collapsed stacks to PROFILE_DIR/<request_id>.collapsed:
+
+    api:chat_endpoint;rag.rag_query_engine_safe:ask;safety_scripts.safety_pipeline:safety_check_and_answer;... 42
+
+The file can be fed to flamegraph.pl or opened in speedscope. Only the
+newest PROFILE_MAX_FILES profiles are kept. When a request is not selected
+the cost is one header lookup and one random().
+
+Use:
+profile = should_profile(header_value)      # decide once per request
+with maybe_profile(request_id, selected=profile):
+    resp = ask(query)
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_HEADER = "x-profile"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "200"))
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or os.path.basename(code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+def collapse_stack(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval from a daemon thread."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.n_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mediqa-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples[collapse_stack(frame)] += 1
+            self.n_samples += 1
+            del frame
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+        return path
+
+
+def prune_profiles(out_dir: str, keep: int = PROFILE_MAX_FILES):
+    """Delete all but the newest `keep` .collapsed files in `out_dir`."""
+    paths = [os.path.join(out_dir, f) for f in os.listdir(out_dir) if f.endswith(".collapsed")]
+    if len(paths) <= keep:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:len(paths) - keep]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # pruned concurrently by another request
+
+
+def should_profile(header_value: str = None, sample_rate: float = None) -> bool:
+    if header_value and header_value.strip().lower() in ("1", "true", "yes"):
+        return True
+    rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    return rate > 0 and random.random() < rate
+
+
+@contextmanager
+def maybe_profile(request_id: str, selected: bool = None, sample_rate: float = None, out_dir: str = None):
+    """
+    Profile the current thread for the duration of the block if `selected`
+    (None: decide here with should_profile). Yields the output path (or None when not profiling).
+    """
+    if selected is None:
+        selected = should_profile(sample_rate=sample_rate)
+    if not selected:
+        yield None
+        return
+
+    out_dir = out_dir or PROFILE_DIR
+    path = os.path.join(out_dir, f"{request_id}.collapsed")
+    sampler = StackSampler(threading.get_ident()).start()
+    t0 = time.perf_counter()
+    try:
+        yield path
+    finally:
+        sampler.stop()
+        sampler.write_collapsed(path)
+        prune_profiles(out_dir)
+        print(f"[profile] {request_id}: {sampler.n_samples} samples in {time.perf_counter() - t0:.2f}s -> {path}")
@@ -0,0 +1,114 @@
+"""
+Opt-in capture of /chat traffic for deterministic replay.
+
+Enabled when TRAFFIC_LOG_PATH is set (a ".gz" suffix writes gzip). A
+TRAFFIC_SAMPLE_RATE fraction of requests is written as one compact JSON
+line each:
+
+    {"t": 1718000000.123, "sid": "3f2a9c1e", "q": "...", "stream": false,
+     "status": "accept", "rows": [812, 44, ...], "latency_ms": 2311.4,
+     "stages": {"embed": 12.1, "nli": 301.7, ...}}
+
+Session ids are replaced by a salted hash, and emails, phone numbers and
+long digit runs in the question are masked. Lines are written by a
+background thread, so the request path only pays for a queue put.
+
+The masking is pattern-based only. Names, addresses, dates of birth and
+other identifying details in a patient's free text are written as they
+are, so treat a traffic log as patient data (access, retention).
+"""
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+
+# The log keeps patient free text: only emails, phone numbers and digit runs are masked (see above)
+TRAFFIC_LOG_PATH = os.environ.get("TRAFFIC_LOG_PATH")
+TRAFFIC_SAMPLE_RATE = float(os.environ.get("TRAFFIC_SAMPLE_RATE", "1.0"))
+TRAFFIC_SALT = os.environ.get("TRAFFIC_SALT", "mediqa")
+
+_PII_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+"), "<email>"),
+    (re.compile(r"\+?\d[\d\s().-]{7,}\d"), "<phone>"),
+    (re.compile(r"\b\d{5,}\b"), "<number>"),
+]
+
+
+def anonymize_text(text: str) -> str:
+    for pat, repl in _PII_PATTERNS:
+        text = pat.sub(repl, text)
+    return text
+
+
+def hash_id(value: str, salt: str = TRAFFIC_SALT) -> str:
+    return hashlib.sha256((salt + (value or "")).encode("utf-8")).hexdigest()[:8]
+
+
+class TrafficRecorder:
+
+    def __init__(self, path: str, sample_rate: float = TRAFFIC_SAMPLE_RATE):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.written = 0
+        self._q = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        opener = gzip.open if path.endswith(".gz") else open
+        self._f = opener(path, "at", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="mediqa-traffic", daemon=True)
+        self._thread.start()
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, arrival: float, session_id: str, question: str, stream: bool,
+               resp: dict, latency_s: float, stages: dict):
+        meta = (resp.get("meta") or {}) if isinstance(resp, dict) else {}
+        rec = {
+            "t": round(arrival, 3),
+            "sid": hash_id(session_id),
+            "q": anonymize_text(question),
+            "stream": bool(stream),
+            "status": resp.get("status") if isinstance(resp, dict) else None,
+            "rows": meta.get("retrieved_rows"),
+            "latency_ms": round(latency_s * 1000.0, 1),
+            "stages": stages,
+        }
+        try:
+            self._q.put_nowait(rec)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            rec = self._q.get()
+            if rec is None:
+                break
+            self._f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.written += 1
+            if self._q.empty():
+                self._f.flush()
+
+    def close(self):
+        self._q.put(None)
+        self._thread.join(timeout=5)
+        self._f.close()
+
+
+def make_recorder():
+    """Recorder configured from the environment, or None when capture is off."""
+    if not TRAFFIC_LOG_PATH:
+        return None
+    return TrafficRecorder(TRAFFIC_LOG_PATH)
+
+
+def read_log(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
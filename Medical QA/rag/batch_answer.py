@@ -0,0 +1,147 @@
+"""
+batch_answer.py
+
+Answer a JSONL file of questions in bulk, either in-process (ask_batch) or
+through the API's /batch_chat endpoint, writing one JSON line per answer.
+
+Input lines may be {"id": ..., "question": ...}, converted MedDialog
+records ({"instruction": ...}) or bare JSON strings. Lines without an id
+get "line-<n>" (n = 0-based line number), which cannot collide with a
+numeric id given explicitly.
+
+The run is resumable: ids already present in the output file are skipped
+and new answers are appended as they finish. A question whose processing
+raises is written with status "error" and its message, so it does not stop
+the run; delete its line from the output to retry it.
+
+Run from the Medical QA folder:
+python -m rag.batch_answer datasets/processed/test_inst.jsonl answers.jsonl
+python -m rag.batch_answer questions.jsonl answers.jsonl --url http://127.0.0.1:8000
+"""
+import argparse
+import json
+import os
+import time
+
+QUESTION_FIELDS = ("question", "instruction", "message", "q")
+
+# questions handed to ask_batch / one /batch_chat call at a time
+CHUNK_SIZE = 256
+
+
+def parse_question_line(line: str, lineno: int, field: str = None):
+    """Return (id, question) for one input line, or None for blank lines."""
+    line = line.strip()
+    if not line:
+        return None
+    rec = json.loads(line)
+    fallback_id = f"line-{lineno}"
+    if isinstance(rec, str):
+        return fallback_id, rec
+    if not isinstance(rec, dict):
+        raise ValueError(f"line {lineno}: expected a JSON object or string, got {type(rec).__name__}")
+    fields = (field,) if field else QUESTION_FIELDS
+    for f in fields:
+        if rec.get(f):
+            rid = rec.get("id")
+            return (fallback_id if rid is None else str(rid)), str(rec[f])
+    raise ValueError(f"line {lineno}: no question field (tried {', '.join(fields)})")
+
+
+def read_questions(path: str, field: str = None):
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f):
+            item = parse_question_line(line, lineno, field)
+            if item is not None:
+                yield item
+
+
+def done_ids(path: str):
+    if not os.path.exists(path):
+        return set()
+    ids = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                ids.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue  # partially written last line of an interrupted run
+    return ids
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def answer_local(items, pipeline: str):
+    import importlib
+    module, _, _ = pipeline.partition(":")
+    ask_batch = importlib.import_module(module).ask_batch
+    for chunk in _chunks(items, CHUNK_SIZE):
+        for pos, resp in ask_batch([q for _, q in chunk]):
+            rec = {"id": chunk[pos][0], "status": resp.get("status"), "answer": resp.get("answer"),
+                   "meta": resp.get("meta", {})}
+            if "error" in resp:
+                rec["error"] = resp["error"]
+            yield rec
+
+
+def answer_remote(items, url: str, developer_mode: bool):
+    import httpx
+    with httpx.Client(base_url=url, timeout=None) as client:
+        for chunk in _chunks(items, CHUNK_SIZE):
+            body = "".join(json.dumps({"id": i, "question": q}, ensure_ascii=False) + "\n" for i, q in chunk)
+            with client.stream("POST", "/batch_chat", content=body.encode("utf-8"),
+                               params={"developer_mode": developer_mode},
+                               headers={"Content-Type": "application/x-ndjson"}) as r:
+                r.raise_for_status()
+                for line in r.iter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("input")
+    ap.add_argument("output")
+    ap.add_argument("--field", default=None, help="question field name (default: auto)")
+    ap.add_argument("--url", default=None, help="use a running API's /batch_chat instead of loading models")
+    ap.add_argument("--pipeline", default="rag.rag_query_engine_safe:ask", help="module providing ask_batch")
+    ap.add_argument("--developer-mode", action="store_true", help="keep full meta in the output")
+    ap.add_argument("--limit", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    skip = done_ids(args.output)
+    items = [(i, q) for i, q in read_questions(args.input, args.field) if i not in skip]
+    if args.limit:
+        items = items[:args.limit]
+    print(f"{len(skip)} already answered, {len(items)} to go")
+    if not items:
+        return
+
+    results = answer_remote(items, args.url, args.developer_mode) if args.url else answer_local(items, args.pipeline)
+
+    t0 = time.perf_counter()
+    n = 0
+    status = {}
+    with open(args.output, "a", encoding="utf-8") as out:
+        for rec in results:
+            if not args.developer_mode and not args.url:
+                from serving_scripts.session_store import compact_meta
+                rec["meta"] = compact_meta(rec.get("meta"))
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            n += 1
+            status[rec.get("status")] = status.get(rec.get("status"), 0) + 1
+            if n % 50 == 0:
+                rate = n / (time.perf_counter() - t0)
+                print(f"{n}/{len(items)} answered | {rate:.2f} q/s | ETA {(len(items) - n) / rate / 60:.1f} min")
+
+    elapsed = time.perf_counter() - t0
+    print(f"\nDone: {n} answers in {elapsed:.1f}s ({n / max(elapsed, 1e-9):.2f} q/s) | {status}")
+    print("Saved ->", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+chunk_store.py
+
+index_map.json as a memory-mapped file, so API workers share one copy.
+
+json.load(index_map.json) gives every worker its own list of dicts (the
+300-char previews dominate). The chunk store keeps each entry's JSON bytes
+back to back in <index_map>.chunks.bin, with an int64 offsets array in
+<index_map>.chunks.idx.npy. Both are mapped read-only, and an entry is
+decoded only when a search returns it. ChunkStore supports len(), [row] and
+iteration, so RAG uses it in place of the list.
+
+The index_map keeps only a 300-char preview of each chunk. The full chunk
+texts, which the context packer needs (context_packing.py), go in a
+TextStore with the same layout: <index_map>.texts.bin / .texts.idx.npy.
+
+Built by embed_and_build_faiss.py; for an existing index_map.json run from the rag/ folder:
+python chunk_store.py
+python chunk_store.py --index-map index_map.json --chunks chunks_dedup
+"""
+import argparse
+import json
+import mmap
+import os
+
+import numpy as np
+
+
+def store_prefix(index_map_path: str) -> str:
+    return os.path.splitext(index_map_path)[0] + ".chunks"
+
+
+def text_store_prefix(index_map_path: str) -> str:
+    return os.path.splitext(index_map_path)[0] + ".texts"
+
+
+def _write_store(blobs, prefix: str):
+    offsets = [0]
+    with open(prefix + ".bin", "wb") as f:
+        for data in blobs:
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(prefix + ".idx.npy", np.array(offsets, dtype="int64"))
+    return len(offsets) - 1
+
+
+def build_chunk_store(index_map, prefix: str):
+    return _write_store((json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                         for entry in index_map), prefix)
+
+
+def build_text_store(texts, prefix: str):
+    """texts: full chunk texts in row order (an iterator is fine)."""
+    return _write_store((t.encode("utf-8") for t in texts), prefix)
+
+
+def iter_chunk_texts(files):
+    """Full texts of the chunk JSONL files, in the row order of embed_corpus.scan_chunks."""
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)["text"]
+
+
+class ChunkStore:
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.offsets = np.load(prefix + ".idx.npy", mmap_mode="r")
+        with open(prefix + ".bin", "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, data: bytes):
+        return json.loads(data)
+
+    def __getitem__(self, row):
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self._decode(self._mm[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class TextStore(ChunkStore):
+    """Full chunk texts by row."""
+
+    def _decode(self, data: bytes):
+        return data.decode("utf-8")
+
+
+def load_index_map(path: str, shared: bool = False):
+    """The chunk store next to `path` when `shared` and it exists, otherwise json.load(path)."""
+    prefix = store_prefix(path)
+    if shared:
+        if os.path.exists(prefix + ".idx.npy"):
+            return ChunkStore(prefix)
+        print(f"[WARN] No chunk store at {prefix}.*; loading {path} per process (run rag/chunk_store.py)")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_chunk_texts(index_map_path: str):
+    """TextStore next to `index_map_path`, or None for indexes built before it existed."""
+    prefix = text_store_prefix(index_map_path)
+    if os.path.exists(prefix + ".idx.npy"):
+        return TextStore(prefix)
+    print(f"[WARN] No chunk texts at {prefix}.*; context packing falls back to previews (run rag/chunk_store.py --chunks)")
+    return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--index-map", default="index_map.json")
+    ap.add_argument("--chunks", default=None, help="chunk JSONL folder the index was built from; also writes the text store")
+    args = ap.parse_args(argv)
+
+    with open(args.index_map, "r", encoding="utf-8") as f:
+        index_map = json.load(f)
+    prefix = store_prefix(args.index_map)
+    n = build_chunk_store(index_map, prefix)
+    print(f"Saved chunk store ({n} entries) -> {prefix}.bin, {prefix}.idx.npy")
+
+    if args.chunks:
+        from embed_corpus import chunk_files
+        prefix = text_store_prefix(args.index_map)
+        n_texts = build_text_store(iter_chunk_texts(chunk_files(args.chunks)), prefix)
+        if n_texts != n:
+            raise ValueError(f"{args.chunks} has {n_texts} chunks but {args.index_map} has {n} rows")
+        print(f"Saved chunk texts ({n_texts} entries) -> {prefix}.bin, {prefix}.idx.npy")
+
+
+if __name__ == "__main__":
+    main()
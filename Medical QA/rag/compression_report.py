@@ -0,0 +1,85 @@
+"""
+compression_report.py
+
+Compares every compressed storage mode against the exact float32 index:
+ - first-pass index size (bytes resident per worker) and memory saved
+ - recall@5 of the compressed index alone
+ - recall@5 after rescoring the shortlist against the full vectors
+
+Queries are a random sample of stored chunk vectors with small gaussian
+noise added, so the exact top-5 is not just the query row itself.
+
+Run from the rag/ folder after embed_and_build_faiss.py:
+python compression_report.py
+"""
+
+import json
+import numpy as np
+
+from vector_compression import (
+    STORAGE_MODES, COMPRESSED_DIM, RESCORE_FACTOR,
+    build_compressed_index, index_nbytes, CompressedSearcher, l2_normalize,
+)
+
+EMBEDDINGS_PATH = "embeddings.npy"
+REPORT_PATH     = "compression_report.json"
+
+N_QUERIES = 500
+NOISE_STD = 0.02
+K = 5
+SEED = 0
+
+
+def recall_at_k(approx_ids, exact_ids, k=K):
+    hits = 0
+    for a, e in zip(approx_ids, exact_ids):
+        hits += len(set(a[:k].tolist()) & set(e[:k].tolist()))
+    return hits / float(k * len(exact_ids))
+
+
+def main():
+    full = np.load(EMBEDDINGS_PATH, mmap_mode="r")
+    embeddings = np.ascontiguousarray(full, dtype="float32")
+    print("Embeddings:", embeddings.shape)
+
+    rng = np.random.default_rng(SEED)
+    n_q = min(N_QUERIES, len(embeddings))
+    rows = rng.choice(len(embeddings), size=n_q, replace=False)
+    queries = l2_normalize(embeddings[rows] + rng.normal(0, NOISE_STD, size=(n_q, embeddings.shape[1])))
+
+    exact, _ = build_compressed_index(embeddings, "float32")
+    _, exact_ids = exact.search(queries, K)
+    base_bytes = index_nbytes(exact, "float32")
+
+    report = []
+    for mode in STORAGE_MODES:
+        index, transform = build_compressed_index(embeddings, mode)
+        searcher = CompressedSearcher(index, mode, full, transform=transform)
+
+        first_pass = searcher.shortlist(queries, K)
+        _, rescored = searcher.search(queries, K)
+
+        nbytes = index_nbytes(index, mode)
+        row = {
+            "mode": mode,
+            "dim": COMPRESSED_DIM if mode in ("pca", "truncate") else embeddings.shape[1],
+            "index_bytes": nbytes,
+            "bytes_per_chunk": nbytes / max(1, index.ntotal),
+            "memory_saved_pct": 100.0 * (1.0 - nbytes / float(base_bytes)),
+            "recall@5_first_pass": recall_at_k(first_pass, exact_ids),
+            "recall@5_rescored": recall_at_k(rescored, exact_ids),
+            "rescore_factor": RESCORE_FACTOR,
+        }
+        report.append(row)
+
+        print(f"{mode:>9} | {nbytes / 1e6:9.2f} MB | saved {row['memory_saved_pct']:5.1f}% | "
+              f"recall@5 {row['recall@5_first_pass']:.3f} -> {row['recall@5_rescored']:.3f} (rescored)")
+
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print("\nSaved report ->", REPORT_PATH)
+
+
+if __name__ == "__main__":
+    main()
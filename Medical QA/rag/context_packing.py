@@ -0,0 +1,167 @@
+"""
+context_packing.py
+
+Builds the generator's context block from retrieved chunks under a token budget.
+
+1. Chunks are packed from their full text ("text", see RAG.attach_texts);
+   one without it falls back to its 300-char index_map preview
+2. Chunks with consecutive rows from the same book and page are merged
+   into one block when the end of one repeats at the start of the next (the
+   CHUNK_OVERLAP words of pdf_preprocess_and_chunk.py), and that overlap is
+   kept only once. Previews are never merged: they stop long before the
+   overlap
+3. Blocks are ordered by retrieval (or rerank) score, or by MMR when
+   mmr_lambda is set (lexical word-set Jaccard is the redundancy measure,
+   so no extra embedding pass is needed)
+4. Blocks are added while they fit in the budget; if even the best block
+   does not fit it is truncated to the budget
+
+Tokens are counted with the tokenizer passed in (the GGUF tokenizer for
+Mistral, see inference_scripts/mistral_inference.count_tokens).
+
+Use:
+from rag.context_packing import pack_context
+
+context, stats = pack_context(rag.attach_texts(retrieved), count_tokens, budget=1536)
+stats -> {"tokens": 1490, "tokens_unpacked": 1742, "tokens_saved": 252, "chunks": 5, "blocks": 3,
+          "merged": 2, "previews": 0, "dropped": 1}
+"""
+import re
+
+CONTEXT_TOKEN_BUDGET = 1536     # leaves room for instructions, query and 256 new tokens in n_ctx=4096
+MMR_LAMBDA = None               # e.g. 0.7 to trade some relevance for diversity; None = score order
+MIN_OVERLAP_WORDS = 5
+
+_WORD = re.compile(r"\w+")
+
+
+def source_label(r) -> str:
+    label = f"Source: {r.get('book')}, Page: {r.get('page')}"
+    # near-duplicate chunks merged by dedup_chunks.py keep their other sources
+    also = r.get("also_in")
+    if also:
+        label += "; also " + "; ".join(f"{a['book']}, Page: {a['page']}" for a in also[:3])
+    return label
+
+
+def chunk_text(r) -> str:
+    """Full chunk text when attached, else the index_map preview."""
+    return r["text"] if "text" in r else r.get("preview", "")
+
+
+def format_block(r) -> str:
+    return f"[{source_label(r)}]\n{chunk_text(r)}"
+
+
+def _rank_score(r) -> float:
+    return r.get("rerank_score", r.get("score", 0.0))
+
+
+def _merge_text(a: str, b: str):
+    """a followed by b without the longest prefix of b that repeats the end of a; None if they do not overlap."""
+    wa, wb = a.split(), b.split()
+    for n in range(min(len(wa), len(wb)), MIN_OVERLAP_WORDS - 1, -1):
+        if wa[-n:] == wb[:n]:
+            return " ".join(wa + wb[n:])
+    return None
+
+
+def _adjacent(block, r) -> bool:
+    row = r.get("row")
+    return ("text" in block and "text" in r and row is not None and block["rows"][-1] is not None
+            and row == block["rows"][-1] + 1
+            and (r.get("book"), r.get("page")) == (block.get("book"), block.get("page")))
+
+
+def merge_adjacent(retrieved):
+    """Blocks in row order: runs of neighbouring, overlapping chunks joined; rank_score = best chunk (rerank) score."""
+    blocks = []
+    for r in sorted(retrieved, key=lambda r: r.get("row") if r.get("row") is not None else -1):
+        prev = blocks[-1] if blocks else None
+        merged = _merge_text(prev["text"], r["text"]) if prev is not None and _adjacent(prev, r) else None
+        if merged is None:
+            block = dict(r, rank_score=_rank_score(r), rows=[r.get("row")])
+            if r.get("also_in"):
+                block["also_in"] = list(r["also_in"])
+            blocks.append(block)
+            continue
+        prev["text"] = merged
+        prev["rows"].append(r["row"])
+        prev["rank_score"] = max(prev["rank_score"], _rank_score(r))
+        if r.get("also_in"):
+            prev["also_in"] = prev.get("also_in", []) + list(r["also_in"])
+    return blocks
+
+
+def _words(text):
+    return set(_WORD.findall(text.lower()))
+
+
+def mmr_order(blocks, mmr_lambda: float):
+    """Greedy maximal marginal relevance: lambda * score - (1 - lambda) * max Jaccard to picked blocks."""
+    remaining = list(range(len(blocks)))
+    words = [_words(chunk_text(b)) for b in blocks]
+    order = []
+    while remaining:
+        def gain(i):
+            red = max((len(words[i] & words[j]) / max(1, len(words[i] | words[j])) for j in order), default=0.0)
+            return mmr_lambda * blocks[i]["rank_score"] - (1.0 - mmr_lambda) * red
+        best = max(remaining, key=gain)
+        order.append(best)
+        remaining.remove(best)
+    return [blocks[i] for i in order]
+
+
+def _truncate_to(block, count_tokens, budget):
+    key = "text" if "text" in block else "preview"
+    words = block.get(key, "").split()
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(format_block(dict(block, **{key: " ".join(words[:mid])}))) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return dict(block, **{key: " ".join(words[:lo])}) if lo else None
+
+
+def pack_context(retrieved, count_tokens, budget: int = CONTEXT_TOKEN_BUDGET, mmr_lambda: float = MMR_LAMBDA):
+    """Returns (context string, stats); see module docstring."""
+    sep = "\n\n"
+    unpacked = sep.join(format_block(r) for r in retrieved)
+    tokens_unpacked = count_tokens(unpacked) if unpacked else 0
+
+    merged = merge_adjacent(retrieved)
+    blocks = sorted(merged, key=lambda b: -b["rank_score"])
+    if mmr_lambda is not None:
+        blocks = mmr_order(blocks, mmr_lambda)
+
+    sep_tokens = count_tokens(sep)
+    used, picked, dropped = 0, [], 0
+    for b in blocks:
+        n = count_tokens(format_block(b)) + (sep_tokens if picked else 0)
+        if used + n <= budget:
+            picked.append(b)
+            used += n
+        elif not picked:
+            cut = _truncate_to(b, count_tokens, budget)
+            if cut is not None:
+                picked.append(cut)
+                used += count_tokens(format_block(cut))
+            else:
+                dropped += 1
+        else:
+            dropped += 1
+
+    context = sep.join(format_block(b) for b in picked)
+    tokens = count_tokens(context) if context else 0
+    return context, {
+        "tokens": tokens,
+        "tokens_unpacked": tokens_unpacked,
+        "tokens_saved": tokens_unpacked - tokens,
+        "chunks": len(retrieved),
+        "blocks": len(picked),
+        "merged": len(retrieved) - len(merged),
+        "previews": sum(1 for r in retrieved if "text" not in r),
+        "dropped": dropped,
+    }
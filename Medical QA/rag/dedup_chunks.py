@@ -0,0 +1,189 @@
+"""
+dedup_chunks.py
+
+Near-duplicate chunk removal between pdf_preprocess_and_chunk.py and
+embed_and_build_faiss.py.
+
+This script:
+1. Loads all chunk JSONL files from chunks/
+2. Computes a MinHash signature of each chunk's word 5-gram shingles
+3. Uses LSH banding to find candidate pairs, then checks their exact
+   Jaccard similarity against JACCARD_THRESHOLD
+4. Clusters duplicates around the first chunk that was kept (no chaining:
+   a chunk is only compared with kept representatives)
+5. Saves:
+   - chunks_dedup/<book>.jsonl  kept chunks; a representative carries
+     "also_in": [{"book", "page"}, ...] for the chunks it replaced, so
+     citations keep every source
+   - dedup_report.json          corpus reduction per book
+
+embed_and_build_faiss.py reads chunks_dedup/ when it exists.
+
+Run from the rag/ folder:
+python dedup_chunks.py
+"""
+
+import os
+import re
+import json
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+CHUNKS_DIR = "chunks"
+DEDUP_DIR = "chunks_dedup"
+REPORT_PATH = "dedup_report.json"
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+BANDS = 32                 # 32 bands x 4 rows: candidate pairs from Jaccard ~0.4 upwards
+JACCARD_THRESHOLD = 0.7
+SEED = 0
+
+_WORD = re.compile(r"\w+")
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+
+def shingles(text: str, k: int = SHINGLE_WORDS) -> np.ndarray:
+    """Unique 32-bit hashes of the lowercased word k-grams of `text`."""
+    words = _WORD.findall(text.lower())
+    if len(words) < k:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.unique(np.array([zlib.crc32(g.encode("utf-8")) for g in grams], dtype="uint64"))
+
+
+class MinHasher:
+    """Multiply-shift hash family; deterministic across runs for a given seed."""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = SEED):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype="uint64") | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype="uint64")
+
+    def signature(self, sh: np.ndarray) -> np.ndarray:
+        # (a*x + b) mod 2^64, keep the high 32 bits; uint64 wraparound is intended
+        with np.errstate(over="ignore"):
+            h = (np.outer(sh, self.a) + self.b) >> np.uint64(32)
+        return (h & _MASK32).min(axis=0).astype("uint32")
+
+
+def jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    inter = np.intersect1d(a, b, assume_unique=True).size
+    return inter / float(a.size + b.size - inter)
+
+
+def dedup(records, threshold: float = JACCARD_THRESHOLD, num_perm: int = NUM_PERM, bands: int = BANDS):
+    """
+    Returns (kept, dup_of):
+     - kept   : indices of records to keep, in input order
+     - dup_of : {dropped index: index of the kept record it duplicates}
+    """
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    buckets = [defaultdict(list) for _ in range(bands)]
+    kept_shingles = {}
+    kept, dup_of = [], {}
+
+    for i, rec in enumerate(records):
+        sh = shingles(rec["text"])
+        sig = hasher.signature(sh)
+        keys = [sig[b * rows:(b + 1) * rows].tobytes() for b in range(bands)]
+
+        match = None
+        seen = set()
+        for b, key in enumerate(keys):
+            for j in buckets[b].get(key, ()):
+                if j in seen:
+                    continue
+                seen.add(j)
+                if jaccard(sh, kept_shingles[j]) >= threshold:
+                    match = j
+                    break
+            if match is not None:
+                break
+
+        if match is not None:
+            dup_of[i] = match
+            continue
+
+        kept.append(i)
+        kept_shingles[i] = sh
+        for b, key in enumerate(keys):
+            buckets[b][key].append(i)
+
+    return kept, dup_of
+
+
+def main():
+    chunk_files = sorted(f for f in os.listdir(CHUNKS_DIR) if f.endswith(".jsonl"))
+    records, files = [], []
+    for cf in chunk_files:
+        with open(os.path.join(CHUNKS_DIR, cf), "r", encoding="utf-8") as f:
+            for line in f:
+                records.append(json.loads(line))
+                files.append(cf)
+    print(f"Loaded {len(records)} chunks from {len(chunk_files)} files")
+
+    kept, dup_of = dedup(records)
+
+    also_in = defaultdict(list)
+    for i, j in dup_of.items():
+        also_in[j].append({"book": records[i]["book"], "page": records[i]["page"]})
+
+    os.makedirs(DEDUP_DIR, exist_ok=True)
+    outs = {cf: open(os.path.join(DEDUP_DIR, cf), "w", encoding="utf-8") for cf in chunk_files}
+    try:
+        for i in kept:
+            rec = dict(records[i])
+            if also_in.get(i):
+                rec["also_in"] = also_in[i]
+            outs[files[i]].write(json.dumps(rec, ensure_ascii=False) + "\n")
+    finally:
+        for f in outs.values():
+            f.close()
+
+    per_book = defaultdict(lambda: {"chunks": 0, "kept": 0, "dropped": 0, "cross_book": 0})
+    for i, rec in enumerate(records):
+        per_book[rec["book"]]["chunks"] += 1
+    for i in kept:
+        per_book[records[i]["book"]]["kept"] += 1
+    for i, j in dup_of.items():
+        stats = per_book[records[i]["book"]]
+        stats["dropped"] += 1
+        if records[i]["book"] != records[j]["book"]:
+            stats["cross_book"] += 1
+
+    words_in = sum(len(r["text"].split()) for r in records)
+    words_out = sum(len(records[i]["text"].split()) for i in kept)
+    sizes = [len(v) + 1 for v in also_in.values()]
+    report = {
+        "threshold": JACCARD_THRESHOLD,
+        "num_perm": NUM_PERM,
+        "bands": BANDS,
+        "chunks_in": len(records),
+        "chunks_out": len(kept),
+        "reduction": 1.0 - len(kept) / max(1, len(records)),
+        "words_in": words_in,
+        "words_out": words_out,
+        "clusters": len(sizes),
+        "largest_cluster": max(sizes, default=1),
+        "books": dict(per_book),
+    }
+
+    print(f"\n{'book':<32} {'chunks':>8} {'kept':>8} {'dropped':>8} {'cross-book':>10}")
+    for book, s in sorted(per_book.items()):
+        print(f"{book:<32} {s['chunks']:>8} {s['kept']:>8} {s['dropped']:>8} {s['cross_book']:>10}")
+    print(f"\nTotal: {len(records)} -> {len(kept)} chunks ({report['reduction']:.1%} fewer to embed), "
+          f"{report['clusters']} duplicate clusters, largest {report['largest_cluster']}")
+
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("Saved kept chunks ->", DEDUP_DIR)
+    print("Saved report ->", REPORT_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,37 @@
 embed_and_build_faiss.py
 
 This script:
-1. Loads all clean chunk JSONL files from rag_data/chunks/
-2. Embeds them using BAAI/bge-large-en-v1.5
+1. Streams all clean chunk JSONL files from chunks_dedup/ (written by
+   dedup_chunks.py) or, if that has not been run, from chunks/
+2. Embeds them using BAAI/bge-large-en-v1.5 with embed_corpus.py:
+   length-bucketed batches, a pool of encoder processes, and checkpoints
+   in embeddings.npy.partial, so an interrupted run resumes where it stopped
 3. Builds a FAISS index (cosine similarity via IndexFlatIP)
 4. Saves:
    - faiss_index.bin
    - embeddings.npy
    - index_map.json
+   - faiss_index_<mode>.bin for each mode in COMPRESSED_STORAGE
+     (see vector_compression.py; rescoring reads embeddings.npy as a memmap)
+   - index_map.chunks.bin / .idx.npy (memory-mapped index_map, see chunk_store.py)
+   - index_map.texts.bin / .idx.npy (full chunk texts for context packing)
+   - shards/<book>.faiss + shards/manifest.json when BUILD_SHARDS
+     (see sharded_index.py; used with INDEX_LAYOUT = "sharded")
+
+Run from the rag/ folder:
+python embed_and_build_faiss.py
 """
 
 import os
 import json
 import numpy as np
 import faiss
-from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
+from vector_compression import build_compressed_index, save_compressed, index_nbytes
+from sharded_index import build_shards, SHARDS_DIR
+from chunk_store import build_chunk_store, build_text_store, iter_chunk_texts, store_prefix, text_store_prefix
+from embed_corpus import chunk_files, scan_chunks, embed_corpus
 
-CHUNKS_DIR = "chunks"
+CHUNKS_DIR = "chunks_dedup" if os.path.isdir("chunks_dedup") else "chunks"
 
 FAISS_INDEX_PATH = "faiss_index.bin"
 EMBEDDINGS_PATH  = "embeddings.npy"
@@ -26,94 +40,83 @@ INDEX_MAP_PATH   = "index_map.json"
 
 EMBED_MODEL = "BAAI/bge-large-en-v1.5"
 
-print("\nLoading chunks from:", CHUNKS_DIR)
-chunk_files = [f for f in os.listdir(CHUNKS_DIR) if f.endswith(".jsonl")]
+# Extra first-pass indexes to build: "fp16", "int8", "binary", "pca", "truncate"
+COMPRESSED_STORAGE = ["int8", "binary"]
 
-all_chunks = []
-all_texts  = []
+# One FAISS shard per book, for parallel search and book filters
+BUILD_SHARDS = True
 
-for cf in chunk_files:
-    path = os.path.join(CHUNKS_DIR, cf)
-    print(f"Reading: {cf}")
 
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            rec = json.loads(line)
-            all_chunks.append(rec)
-            all_texts.append(rec["text"])
+def main():
+    print("\nLoading chunks from:", CHUNKS_DIR)
+    files = chunk_files(CHUNKS_DIR)
+    index_map, lengths, locations = scan_chunks(files)
 
-print(f"\nTotal chunks loaded: {len(all_texts)}")
+    print(f"\nTotal chunks loaded: {len(index_map)}")
 
-print("\nLoading embedding model:", EMBED_MODEL)
+    print("\nEmbedding all chunks with:", EMBED_MODEL)
+    # memory-mapped; encoder processes are spawned, so this module only runs under __main__
+    embeddings = embed_corpus(files, lengths, locations, EMBEDDINGS_PATH, model=EMBED_MODEL)
 
-import torch
-if torch.cuda.is_available():
-    device = "cuda"
-    print("Using GPU:", torch.cuda.get_device_name(0))
-else:
-    device = "cpu"
-    print("Using CPU")
+    print("Embedding shape:", embeddings.shape)
+    print("Saved embeddings ->", EMBEDDINGS_PATH)
 
-embedder = SentenceTransformer(EMBED_MODEL, device=device, cache_folder="models/bge/")
+    print("\nBuilding FAISS index...")
 
-print("\nEmbedding all chunks...")
+    dim = embeddings.shape[1]
+    index = faiss.IndexFlatIP(dim)
+    index.add(np.ascontiguousarray(embeddings, dtype="float32"))
 
-BATCH_SIZE = 4 if device == "cuda" else 16
+    faiss.write_index(index, FAISS_INDEX_PATH)
 
-embeddings = embedder.encode(
-    all_texts,
-    batch_size=BATCH_SIZE,
-    convert_to_numpy=True,
-    normalize_embeddings=True,
-    show_progress_bar=True
-)
+    print("FAISS ntotal:", index.ntotal)
+    print("Saved FAISS index ->", FAISS_INDEX_PATH)
 
-print("Embedding shape:", embeddings.shape)
+    flat_bytes = index_nbytes(index, "float32")
+    for mode in COMPRESSED_STORAGE:
+        c_index, transform = build_compressed_index(embeddings, mode)
+        path = save_compressed(c_index, transform, mode, ".")
+        c_bytes = index_nbytes(c_index, mode)
+        print(f"Saved {mode} index -> {path} ({c_bytes / 1e6:.2f} MB vs {flat_bytes / 1e6:.2f} MB flat)")
 
-np.save(EMBEDDINGS_PATH, embeddings)
-print("Saved embeddings ->", EMBEDDINGS_PATH)
+    print("\nSaving index map...")
 
-print("\nBuilding FAISS index...")
+    with open(INDEX_MAP_PATH, "w", encoding="utf-8") as f:
+        json.dump(index_map, f, indent=2, ensure_ascii=False)
 
-dim = embeddings.shape[1]
-index = faiss.IndexFlatIP(dim) 
-index.add(embeddings.astype("float32"))
+    print("Saved index map ->", INDEX_MAP_PATH)
 
-faiss.write_index(index, FAISS_INDEX_PATH)
+    n_chunks = build_chunk_store(index_map, store_prefix(INDEX_MAP_PATH))
+    print(f"Saved chunk store ({n_chunks} entries) ->", store_prefix(INDEX_MAP_PATH) + ".*")
+    n_texts = build_text_store(iter_chunk_texts(files), text_store_prefix(INDEX_MAP_PATH))
+    print(f"Saved chunk texts ({n_texts} entries) ->", text_store_prefix(INDEX_MAP_PATH) + ".*")
 
-print("FAISS ntotal:", index.ntotal)
-print("Saved FAISS index ->", FAISS_INDEX_PATH)
+    if BUILD_SHARDS:
+        print("\nBuilding per-book shards...")
+        build_shards(embeddings, index_map, SHARDS_DIR)
 
-print("\nSaving index map...")
+    print("\nRunning quick retrieval test...")
 
-index_map = []
-for i, rec in enumerate(all_chunks):
-    index_map.append({
-        "row": i,
-        "book": rec["book"],
-        "page": rec["page"],
-        "preview": rec["text"][:300]
-    })
+    import torch
+    from sentence_transformers import SentenceTransformer
+    embedder = SentenceTransformer(EMBED_MODEL, device="cuda" if torch.cuda.is_available() else "cpu",
+                                   cache_folder="models/bge/")
+    query = "What are the symptoms of asthma?"
+    q_emb = embedder.encode(query, convert_to_numpy=True, normalize_embeddings=True)
 
-with open(INDEX_MAP_PATH, "w", encoding="utf-8") as f:
-    json.dump(index_map, f, indent=2, ensure_ascii=False)
+    D, I = index.search(np.array([q_emb]).astype("float32"), k=5)
 
-print("Saved index map ->", INDEX_MAP_PATH)
+    print("\nTop 5 results:")
+    for score, idx in zip(D[0], I[0]):
+        meta = index_map[idx]
+        print(f"\nScore: {score:.4f}")
+        print("Book:", meta["book"])
+        print("Page:", meta["page"])
+        print("Text:", meta["preview"])
+        print("-" * 60)
 
-print("\nRunning quick retrieval test...")
+    print("\nEmbedding + FAISS build completed successfully!")
 
-query = "What are the symptoms of asthma?"
-q_emb = embedder.encode(query, convert_to_numpy=True, normalize_embeddings=True)
 
-D, I = index.search(np.array([q_emb]).astype("float32"), k=5)
-
-print("\nTop 5 results:")
-for score, idx in zip(D[0], I[0]):
-    meta = index_map[idx]
-    print(f"\nScore: {score:.4f}")
-    print("Book:", meta["book"])
-    print("Page:", meta["page"])
-    print("Text:", meta["preview"])
-    print("-" * 60)
-
-print("\nEmbedding + FAISS build completed successfully!")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+embed_corpus.py
+
+Checkpointed, multi-process corpus embedding for embed_and_build_faiss.py.
+
+This script:
+1. Streams the chunk JSONL files once and keeps only the index_map entry,
+   text length and (file, byte offset) of each chunk, never the texts
+2. Sorts chunks by length and cuts the sorted order into blocks of
+   BLOCK_ROWS. Each encode batch then holds chunks of about the same
+   length, so there is little padding
+3. Fans the blocks out to a pool of encoder processes, each with its own
+   share of the cores. Workers read their texts from the JSONL by offset
+4. Writes each finished block straight into <out>.partial, a memory-mapped
+   .npy. Every CHECKPOINT_S seconds it flushes the file and records the
+   finished blocks in <out>.progress.json. A rerun on the same chunks and
+   model skips those blocks; different inputs start over
+5. Prints chunks/sec and an ETA as it goes, and renames the finished file
+   to <out>
+
+Row i of the output is the i-th chunk in file-name order, the same order
+as the index_map.
+
+Run from the rag/ folder:
+python embed_corpus.py
+python embed_corpus.py --chunks chunks_dedup --out embeddings.npy --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+MODEL_CACHE = "models/bge/"
+
+BLOCK_ROWS = 512          # rows per pool task (and per checkpoint unit)
+BATCH_SIZE = 32           # CPU; length bucketing keeps padding low at this size
+GPU_BATCH_SIZE = 64
+THREADS_PER_WORKER = 4
+CHECKPOINT_S = 30.0
+REPORT_S = 10.0
+
+
+def chunk_files(chunks_dir: str):
+    return sorted(os.path.join(chunks_dir, f) for f in os.listdir(chunks_dir) if f.endswith(".jsonl"))
+
+
+def index_map_entry(row: int, rec: dict) -> dict:
+    entry = {
+        "row": row,
+        "book": rec["book"],
+        "page": rec["page"],
+        "preview": rec["text"][:300]
+    }
+    if rec.get("also_in"):
+        entry["also_in"] = rec["also_in"]
+    return entry
+
+
+def scan_chunks(files):
+    """One streaming pass: (index_map, lengths, locations) with locations[row] = (file idx, byte offset)."""
+    index_map, lengths, locations = [], [], []
+    for fi, path in enumerate(files):
+        print(f"Reading: {os.path.basename(path)}")
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    row = len(index_map)
+                    index_map.append(index_map_entry(row, rec))
+                    lengths.append(len(rec["text"]))
+                    locations.append((fi, offset))
+                offset += len(line)
+    return index_map, np.array(lengths, dtype="int64"), np.array(locations, dtype="int64").reshape(-1, 2)
+
+
+def make_blocks(lengths, block_rows: int = BLOCK_ROWS):
+    """Row ids sorted by length, cut into consecutive blocks."""
+    order = np.argsort(lengths, kind="stable")
+    return [order[i:i + block_rows] for i in range(0, len(order), block_rows)]
+
+
+def fingerprint(files, n_rows: int, model: str, block_rows: int) -> dict:
+    return {
+        "model": model,
+        "rows": n_rows,
+        "block_rows": block_rows,
+        "files": [[os.path.basename(p), os.path.getsize(p), int(os.path.getmtime(p))] for p in files],
+    }
+
+
+# -------------------------------------------------------
+# ENCODER POOL
+# -------------------------------------------------------
+
+_worker = {}
+
+
+def _init_worker(files, model, device, threads, batch_size):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(threads)
+    _worker.update(files=files, batch_size=batch_size,
+                   model=SentenceTransformer(model, device=device, cache_folder=MODEL_CACHE))
+
+
+def _dim(_):
+    return _worker["model"].get_sentence_embedding_dimension()
+
+
+def _encode_block(task):
+    block_id, rows, locations = task
+    texts, handles = [], {}
+    try:
+        for fi, offset in locations:
+            f = handles.get(fi)
+            if f is None:
+                f = handles[fi] = open(_worker["files"][fi], "rb")
+            f.seek(offset)
+            texts.append(json.loads(f.readline())["text"])
+    finally:
+        for f in handles.values():
+            f.close()
+    emb = _worker["model"].encode(texts, batch_size=_worker["batch_size"], convert_to_numpy=True,
+                                  normalize_embeddings=True, show_progress_bar=False)
+    return block_id, rows, emb.astype("float32")
+
+
+# -------------------------------------------------------
+# CHECKPOINTS
+# -------------------------------------------------------
+
+def _progress_path(out_path):
+    return out_path + ".progress.json"
+
+
+def _load_progress(out_path, fp):
+    """Finished block ids of an interrupted run over the same inputs, else an empty set."""
+    path = _progress_path(out_path)
+    if not (os.path.exists(path) and os.path.exists(out_path + ".partial")):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        progress = json.load(f)
+    if progress.get("fingerprint") != fp:
+        print("Chunks or model changed since the interrupted run; starting over.")
+        return set()
+    return set(progress["done"])
+
+
+def _save_progress(out_path, fp, done):
+    path = _progress_path(out_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fp, "done": sorted(done)}, f)
+    os.replace(tmp, path)
+
+
+def _fmt_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+def embed_corpus(files, lengths, locations, out_path: str, model: str = EMBED_MODEL, workers: int = None,
+                 device: str = None, block_rows: int = BLOCK_ROWS):
+    """Embed every chunk into `out_path` (float32, normalized), resuming a checkpoint; returns it memory-mapped."""
+    if device is None:
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    cores = os.cpu_count() or 1
+    if device == "cuda":
+        workers, threads, batch_size = 1, 1, GPU_BATCH_SIZE
+    else:
+        workers = workers or max(1, cores // THREADS_PER_WORKER)
+        threads, batch_size = max(1, cores // workers), BATCH_SIZE
+
+    n = len(lengths)
+    blocks = make_blocks(lengths, block_rows)
+    fp = fingerprint(files, n, model, block_rows)
+    done = _load_progress(out_path, fp)
+    todo = [b for b in range(len(blocks)) if b not in done]
+    partial = out_path + ".partial"
+    print(f"{n} chunks in {len(blocks)} length-sorted blocks; {len(done)} blocks already done. "
+          f"{workers} encoder process(es) x {threads} threads on {device}, batch {batch_size}")
+
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(files, model, device, threads, batch_size)) as pool:
+        dim = pool.map(_dim, [None])[0]
+        if done:
+            emb = np.load(partial, mmap_mode="r+")
+        else:
+            emb = np.lib.format.open_memmap(partial, mode="w+", dtype="float32", shape=(n, dim))
+
+        tasks = ((b, blocks[b], locations[blocks[b]]) for b in todo)
+        t0 = last_report = last_checkpoint = time.perf_counter()
+        resumed_rows = sum(len(blocks[b]) for b in done)
+        new_rows = 0
+        for block_id, rows, block_emb in pool.imap_unordered(_encode_block, tasks):
+            emb[rows] = block_emb
+            done.add(block_id)
+            new_rows += len(rows)
+
+            now = time.perf_counter()
+            if now - last_checkpoint >= CHECKPOINT_S:
+                # rows reach the disk before the progress file says they are done
+                emb.flush()
+                _save_progress(out_path, fp, done)
+                last_checkpoint = now
+            if now - last_report >= REPORT_S:
+                rate = new_rows / (now - t0)
+                left = n - resumed_rows - new_rows
+                print(f"{resumed_rows + new_rows}/{n} chunks, {rate:.1f} chunks/s, ETA {_fmt_eta(left / max(rate, 1e-9))}")
+                last_report = now
+
+    emb.flush()
+    del emb
+    os.replace(partial, out_path)
+    if os.path.exists(_progress_path(out_path)):
+        os.remove(_progress_path(out_path))
+    elapsed = time.perf_counter() - t0
+    print(f"Embedded {new_rows} chunks in {elapsed:.1f}s ({new_rows / max(elapsed, 1e-9):.1f} chunks/s) -> {out_path}")
+    return np.load(out_path, mmap_mode="r")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunks", default="chunks_dedup" if os.path.isdir("chunks_dedup") else "chunks")
+    ap.add_argument("--out", default="embeddings.npy")
+    ap.add_argument("--model", default=EMBED_MODEL)
+    ap.add_argument("--workers", type=int, default=None, help=f"encoder processes (default: cores / {THREADS_PER_WORKER})")
+    ap.add_argument("--device", default=None)
+    args = ap.parse_args(argv)
+
+    files = chunk_files(args.chunks)
+    _, lengths, locations = scan_chunks(files)
+    emb = embed_corpus(files, lengths, locations, args.out, model=args.model, workers=args.workers,
+                       device=args.device)
+    print("Embedding shape:", emb.shape)
+
+
+if __name__ == "__main__":
+    main()
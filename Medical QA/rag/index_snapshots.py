@@ -0,0 +1,204 @@
+"""
+index_snapshots.py
+
+Versioned index snapshots, so new index data ships without restarting the API.
+
+Layout (rag/snapshots/):
+ - <version>/manifest.json   {"version", "embed_model", "rows", "files", "created"}
+ - <version>/faiss_index.bin, index_map.json (+ shards/ when built)
+ - CURRENT                    name of the live version, replaced atomically
+
+The RAG engine loads CURRENT at startup. When it changes (IndexWatcher polls
+it, or POST /admin/reload_index asks directly) the new snapshot is loaded in
+a background thread and swapped in with a single assignment. Requests that
+already picked up the old snapshot finish on it; the next request sees the
+new one. A snapshot built with a different embedding model than the one the
+engine encodes queries with is refused.
+
+Run from the Medical QA folder after rag/embed_and_build_faiss.py:
+python -m rag.index_snapshots publish
+python -m rag.index_snapshots list
+python -m rag.index_snapshots activate 20261019-142501
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+
+import faiss
+
+from rag.sharded_index import SHARDS_DIR, SEARCH_THREADS, load_sharded_index
+from rag.chunk_store import load_index_map, load_chunk_texts
+
+SNAPSHOTS_DIR = os.path.join("rag", "snapshots")
+CURRENT_FILE = "CURRENT"
+MANIFEST = "manifest.json"
+SNAPSHOT_FILES = ("faiss_index.bin", "index_map.json")
+OPTIONAL_FILES = ("index_map.chunks.bin", "index_map.chunks.idx.npy", "index_map.texts.bin", "index_map.texts.idx.npy")
+WATCH_INTERVAL_S = 10.0
+
+
+class IndexSnapshot:
+    """One immutable (index, index_map, texts) set; a request holds on to it from search to results."""
+
+    def __init__(self, version: str, index, index_map, manifest=None, texts=None):
+        self.version = version
+        self.index = index
+        self.index_map = index_map
+        self.texts = texts           # full chunk texts by row (chunk_store.TextStore), or None
+        self.manifest = manifest or {}
+        self.row_filters = None      # filled lazily by RAG._filter_rows
+
+
+def current_version(root: str = SNAPSHOTS_DIR):
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def set_current(root: str, version: str):
+    if not os.path.exists(os.path.join(root, version, MANIFEST)):
+        raise FileNotFoundError(f"no snapshot {version!r} in {root}")
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def list_snapshots(root: str = SNAPSHOTS_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if os.path.exists(os.path.join(root, d, MANIFEST)))
+
+
+def publish_snapshot(src: str = "rag", root: str = SNAPSHOTS_DIR, embed_model: str = None,
+                     version: str = None, activate: bool = True) -> str:
+    """Copy the built artifacts in `src` into a new version folder (and make it CURRENT)."""
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    dest = os.path.join(root, version)
+    if os.path.exists(dest):
+        raise FileExistsError(dest)
+
+    # copy into a temp folder and rename, so a half-copied snapshot is never visible
+    tmp = dest + ".partial"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    files = []
+    for name in SNAPSHOT_FILES:
+        shutil.copy2(os.path.join(src, name), os.path.join(tmp, name))
+        files.append(name)
+    for name in OPTIONAL_FILES:
+        if os.path.exists(os.path.join(src, name)):
+            shutil.copy2(os.path.join(src, name), os.path.join(tmp, name))
+            files.append(name)
+    if os.path.isdir(os.path.join(src, SHARDS_DIR)):
+        shutil.copytree(os.path.join(src, SHARDS_DIR), os.path.join(tmp, SHARDS_DIR))
+        files.append(SHARDS_DIR)
+
+    with open(os.path.join(tmp, "index_map.json"), "r", encoding="utf-8") as f:
+        rows = len(json.load(f))
+    manifest = {"version": version, "embed_model": embed_model, "rows": rows,
+                "files": files, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(tmp, dest)
+
+    if activate:
+        set_current(root, version)
+    return version
+
+
+def load_snapshot(root: str, version: str = None, embed_model: str = None, layout: str = "flat",
+                  mmap: bool = False, threads: int = SEARCH_THREADS) -> IndexSnapshot:
+    """
+    Load `version` (default: CURRENT). layout "sharded" reads its shards/ folder.
+    mmap maps the vectors and chunk store read-only, shared by all worker processes.
+    """
+    version = version or current_version(root)
+    if not version:
+        raise FileNotFoundError(f"no {CURRENT_FILE} in {root}")
+    folder = os.path.join(root, version)
+    with open(os.path.join(folder, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    built_with = manifest.get("embed_model")
+    if embed_model and built_with and built_with != embed_model:
+        raise ValueError(f"snapshot {version} was embedded with {built_with}, queries use {embed_model}")
+
+    if layout == "sharded":
+        index = load_sharded_index(os.path.join(folder, SHARDS_DIR), threads=threads, mmap=mmap)
+    else:
+        index = faiss.read_index(os.path.join(folder, "faiss_index.bin"), faiss.IO_FLAG_MMAP_IFC if mmap else 0)
+    index_map = load_index_map(os.path.join(folder, "index_map.json"), shared=mmap)
+
+    if index.ntotal != len(index_map):
+        raise ValueError(f"snapshot {version}: index has {index.ntotal} vectors, index_map {len(index_map)} rows")
+    texts = load_chunk_texts(os.path.join(folder, "index_map.json"))
+    if texts is not None and len(texts) != len(index_map):
+        raise ValueError(f"snapshot {version}: {len(texts)} chunk texts for {len(index_map)} index_map rows")
+    return IndexSnapshot(version, index, index_map, manifest, texts)
+
+
+class IndexWatcher:
+    """Polls CURRENT and asks the RAG engine to reload when it points somewhere new."""
+
+    def __init__(self, rag, root: str, interval_s: float = WATCH_INTERVAL_S):
+        self.rag = rag
+        self.root = root
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mediqa-index-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        failed = None
+        while not self._stop.wait(self.interval_s):
+            version = current_version(self.root)
+            if not version or version == self.rag.version or version == failed:
+                continue
+            try:
+                self.rag.reload_snapshot(version)
+            except Exception as e:
+                failed = version        # retried only once CURRENT changes again
+                print(f"[WARN] Index snapshot {version} not loaded, keeping {self.rag.version}: {e}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--root", default=SNAPSHOTS_DIR)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    pub = sub.add_parser("publish", help="snapshot the artifacts in --src and make it CURRENT")
+    pub.add_argument("--src", default="rag")
+    pub.add_argument("--version", default=None)
+    pub.add_argument("--embed-model", default="BAAI/bge-large-en-v1.5")
+    pub.add_argument("--no-activate", action="store_true")
+    sub.add_parser("list")
+    act = sub.add_parser("activate", help="point CURRENT at an existing snapshot")
+    act.add_argument("version")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "publish":
+        version = publish_snapshot(args.src, args.root, embed_model=args.embed_model,
+                                   version=args.version, activate=not args.no_activate)
+        print("Published snapshot:", version, "" if args.no_activate else "(CURRENT)")
+    elif args.cmd == "list":
+        live = current_version(args.root)
+        for v in list_snapshots(args.root):
+            print(("* " if v == live else "  ") + v)
+    else:
+        set_current(args.root, args.version)
+        print("CURRENT ->", args.version)
+
+
+if __name__ == "__main__":
+    main()
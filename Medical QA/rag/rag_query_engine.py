@@ -15,44 +15,141 @@ rag = RAG()
 rag.ask("What are the symptoms of asthma?")
 """
 
-import json
+import os
+import threading
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 import torch
 
+from inference_scripts.encoder_backends import load_sentence_encoder
+from monitoring_scripts import metrics
+from rag.sharded_index import ShardedIndex, load_sharded_index, entry_locations, SEARCH_THREADS
+from rag.index_snapshots import IndexSnapshot, IndexWatcher, current_version, load_snapshot
+from rag.chunk_store import load_index_map, load_chunk_texts
+from inference_scripts.shared_weights import SHARED_MEMORY
+from inference_scripts.thread_budget import apply_thread_budget
+
 RAG_FOLDER = "rag"
 FAISS_INDEX_PATH = r"C:\Users\amanv\Downloads\Adv. NLP\Medical Wellness Assistant\Medical QA\rag\faiss_index.bin"
 INDEX_MAP_PATH   = r"C:\Users\amanv\Downloads\Adv. NLP\Medical Wellness Assistant\Medical QA\rag\index_map.json"
+EMBEDDINGS_PATH  = r"C:\Users\amanv\Downloads\Adv. NLP\Medical Wellness Assistant\Medical QA\rag\embeddings.npy"
+
+# "float32" loads FAISS_INDEX_PATH as before. Any other mode from
+# rag/vector_compression.py searches the compressed index and rescores
+# RESCORE_FACTOR * k candidates against the memmapped EMBEDDINGS_PATH.
+VECTOR_STORAGE = "float32"
+RESCORE_FACTOR = 4
+
+# "flat" searches FAISS_INDEX_PATH; "sharded" searches one shard per book from
+# SHARDS_FOLDER in parallel (rag/sharded_index.py, float32 storage only).
+INDEX_LAYOUT = "flat"
+SHARDS_FOLDER = r"C:\Users\amanv\Downloads\Adv. NLP\Medical Wellness Assistant\Medical QA\rag\shards"
+
+# Versioned index snapshots (rag/index_snapshots.py). When SNAPSHOTS_FOLDER has a
+# CURRENT pointer it is loaded instead of the paths above (float32 storage only),
+# and re-checked every SNAPSHOT_WATCH_S seconds (0 = only via reload_snapshot()).
+SNAPSHOTS_FOLDER = r"C:\Users\amanv\Downloads\Adv. NLP\Medical Wellness Assistant\Medical QA\rag\snapshots"
+SNAPSHOT_WATCH_S = 10.0
 
 EMBED_MODEL = "BAAI/bge-large-en-v1.5"
 
+# "torch" (fp32), "torch_int8" or "onnx_int8" -- see inference_scripts/encoder_backends.py
+ENCODER_BACKEND = "torch"
+
 TOP_K = 5 
 
 class RAG:
 
-    def __init__(self):
-
-        print("Loading embedding model:", EMBED_MODEL)
+    def __init__(self, encoder_backend: str = ENCODER_BACKEND, embedder=None, index=None, index_map=None, texts=None):
+        """embedder / index / index_map / texts (full chunk text by row) can be injected (e.g. stub models in benchmarks)."""
 
-        if torch.cuda.is_available():
-            device = "cuda"
-            print("Using GPU:", torch.cuda.get_device_name(0))
+        if embedder is not None:
+            self.embedder = embedder
         else:
-            device = "cpu"
-            print("Using CPU")
+            print(f"Loading embedding model: {EMBED_MODEL} ({encoder_backend})")
 
-        self.embedder = SentenceTransformer(EMBED_MODEL, device=device, cache_folder="models/bge/")
+            if torch.cuda.is_available():
+                device = "cuda"
+                print("Using GPU:", torch.cuda.get_device_name(0))
+            else:
+                device = "cpu"
+                print("Using CPU")
+
+            self.embedder = load_sentence_encoder(EMBED_MODEL, backend=encoder_backend, device=device, cache_folder="models/bge/")
+
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        # shard search threads come out of the same CPU budget as torch (inference_scripts/thread_budget.py)
+        self._search_threads = apply_thread_budget()["faiss_threads"] if index is None else SEARCH_THREADS
+        versioned = index is None and VECTOR_STORAGE == "float32" and current_version(SNAPSHOTS_FOLDER)
+
+        if versioned:
+            print("Loading index snapshot:", versioned)
+            self.snapshot = load_snapshot(SNAPSHOTS_FOLDER, embed_model=EMBED_MODEL, layout=INDEX_LAYOUT,
+                                          mmap=SHARED_MEMORY, threads=self._search_threads)
+            if SNAPSHOT_WATCH_S:
+                self._watcher = IndexWatcher(self, SNAPSHOTS_FOLDER, SNAPSHOT_WATCH_S).start()
+        else:
+            if index is None:
+                index = self._load_index()
 
-        print("Loading FAISS index:", FAISS_INDEX_PATH)
-        self.index = faiss.read_index(FAISS_INDEX_PATH)
+            if index_map is None:
+                print("Loading index map:", INDEX_MAP_PATH)
+                index_map = load_index_map(INDEX_MAP_PATH, shared=SHARED_MEMORY)
+                texts = load_chunk_texts(INDEX_MAP_PATH)
 
-        print("Loading index map:", INDEX_MAP_PATH)
-        with open(INDEX_MAP_PATH, "r", encoding="utf-8") as f:
-            self.index_map = json.load(f)
+            self.snapshot = IndexSnapshot("unversioned", index, index_map, texts=texts)
 
         print("\nRAG Engine initialized successfully!")
 
+    def _load_index(self):
+        """The unversioned index from the paths above, per INDEX_LAYOUT and VECTOR_STORAGE."""
+        if INDEX_LAYOUT == "sharded":
+            print("Loading FAISS shards:", SHARDS_FOLDER)
+            return load_sharded_index(SHARDS_FOLDER, threads=self._search_threads, mmap=SHARED_MEMORY)
+        if VECTOR_STORAGE == "float32":
+            print("Loading FAISS index:", FAISS_INDEX_PATH)
+            # MEDIQA_SHARED_MEMORY=1: vectors stay in the page cache, shared by all workers
+            return faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP_IFC if SHARED_MEMORY else 0)
+        from rag.vector_compression import load_searcher
+        print(f"Loading {VECTOR_STORAGE} index with rescoring from:", EMBEDDINGS_PATH)
+        return load_searcher(
+            VECTOR_STORAGE,
+            os.path.dirname(FAISS_INDEX_PATH),
+            EMBEDDINGS_PATH,
+            rescore_factor=RESCORE_FACTOR
+        )
+
+    # A request reads self.snapshot once and uses that object throughout, so a
+    # swap never mixes one version's index with another version's index_map.
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def index_map(self):
+        return self.snapshot.index_map
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def reload_snapshot(self, version: str = None):
+        """
+        Load `version` (default: CURRENT) and swap it in. Call it off the request
+        path (IndexWatcher thread, API threadpool); requests keep being served
+        from the old snapshot while it loads. Returns (old_version, new_version).
+        """
+        with self._reload_lock:
+            old = self.snapshot
+            if version is not None and version == old.version:
+                return old.version, old.version
+            snap = load_snapshot(SNAPSHOTS_FOLDER, version, embed_model=EMBED_MODEL, layout=INDEX_LAYOUT,
+                                 mmap=SHARED_MEMORY, threads=self._search_threads)
+            self.snapshot = snap
+        print(f"Index snapshot swapped: {old.version} -> {snap.version} ({snap.index.ntotal} vectors)")
+        return old.version, snap.version
+
     def embed_query(self, query: str):
         """Embed a user query with BGE-large"""
 
@@ -62,35 +159,123 @@ class RAG:
             normalize_embeddings=True
         ).astype("float32")
 
-    def retrieve(self, query: str, k: int = TOP_K):
-        """Retrieve top-k chunks for the user query with normalized similarity score."""
+    def _filter_rows(self, snap, books=None, page=None):
+        """
+        Global rows matching the book list and inclusive page range. A row matches on
+        any of its locations, including the copies dedup replaced with it ("also_in").
+        """
+        if snap.row_filters is None:
+            # rows are the index_map positions (or keys), as in _hits_to_results
+            if isinstance(snap.index_map, dict):
+                items = [(int(key), e) for key, e in snap.index_map.items()]
+            else:
+                items = list(enumerate(snap.index_map))
+            locations = [(row, book, page) for row, e in items for book, page in entry_locations(e)]
+            snap.row_filters = (
+                np.array([row for row, _, _ in locations], dtype="int64"),
+                np.array([book for _, book, _ in locations], dtype=object),
+                np.array([page or 0 for _, _, page in locations], dtype="int64"),
+            )
+        rows, row_books, row_pages = snap.row_filters
+        mask = np.ones(len(rows), dtype=bool)
+        if books:
+            mask &= np.isin(row_books, books)
+        if page:
+            mask &= (row_pages >= page[0]) & (row_pages <= page[1])
+        return np.unique(rows[mask])
+
+    def _search(self, snap, q_embs, k, filters=None):
+        """
+        index.search with optional filters {"book": name or [names], "page": [lo, hi]}.
+        Filtering happens inside FAISS (shard choice / IDSelector), not on the top-k afterwards.
+        """
+        index = snap.index
+        if not filters:
+            return index.search(q_embs, k)
 
-        q_emb = self.embedder.encode(
-            query,
-            convert_to_numpy=True,
-            normalize_embeddings=True
-        ).astype("float32")
+        books = filters.get("book")
+        books = [books] if isinstance(books, str) else books
+        page = filters.get("page")
+
+        if isinstance(index, ShardedIndex):
+            selector = faiss.IDSelectorBatch(self._filter_rows(snap, books, page)) if page else None
+            return index.search(q_embs, k, books=books, selector=selector)
+
+        if not isinstance(index, faiss.Index):
+            raise ValueError("filters need the float32 flat index or INDEX_LAYOUT = 'sharded'")
+        selector = faiss.IDSelectorBatch(self._filter_rows(snap, books, page))
+        return index.search(q_embs, k, params=faiss.SearchParameters(sel=selector))
 
-        distances, indices = self.index.search(np.array([q_emb]), k)
+    def retrieve(self, query: str, k: int = TOP_K, filters: dict = None, snapshot: IndexSnapshot = None):
+        """
+        Retrieve top-k chunks for the user query with normalized similarity score.
+        Pass `snapshot` (rag.snapshot, read once) to pin several calls to one index version.
+        """
+        snap = snapshot or self.snapshot
+
+        with metrics.span("embed"):
+            q_emb = self.embedder.encode(
+                query,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            ).astype("float32")
+
+        with metrics.span("faiss_search"):
+            distances, indices = self._search(snap, np.array([q_emb]), k, filters)
+
+        return self._hits_to_results(snap, distances[0], indices[0])
+
+    def retrieve_batch(self, queries, k: int = TOP_K, batch_size: int = 32, filters: dict = None,
+                       snapshot: IndexSnapshot = None):
+        """Retrieve top-k chunks for many queries: one batched encode and one multi-query index.search."""
+        snap = snapshot or self.snapshot
+
+        if not queries:
+            return []
+
+        with metrics.span("embed_batch"):
+            q_embs = self.embedder.encode(
+                list(queries),
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            ).astype("float32")
+
+        with metrics.span("faiss_search_batch"):
+            distances, indices = self._search(snap, np.ascontiguousarray(q_embs), k, filters)
+
+        return [self._hits_to_results(snap, d, i) for d, i in zip(distances, indices)]
+
+    def attach_texts(self, retrieved, snapshot: IndexSnapshot = None):
+        """Add the full chunk text to each result as "text" (index_map entries carry a 300-char preview only)."""
+        texts = (snapshot or self.snapshot).texts
+        if texts is None:
+            return retrieved
+        for r in retrieved:
+            if r.get("row") is not None:
+                r["text"] = texts[r["row"]]
+        return retrieved
 
+    def _hits_to_results(self, snap, distances, indices):
+        index_map = snap.index_map
         results = []
 
-        for raw, idx in zip(distances[0], indices[0]):
+        for raw, idx in zip(distances, indices):
 
             if idx < 0:
                 continue
 
-            if isinstance(self.index_map, dict):
-                if str(idx) in self.index_map:
-                    meta = dict(self.index_map[str(idx)])
-                elif idx in self.index_map:
-                    meta = dict(self.index_map[idx])
+            if isinstance(index_map, dict):
+                if str(idx) in index_map:
+                    meta = dict(index_map[str(idx)])
+                elif idx in index_map:
+                    meta = dict(index_map[idx])
                 else:
                     continue
             else:
-                if idx >= len(self.index_map):
+                if idx >= len(index_map):
                     continue
-                meta = dict(self.index_map[idx])
+                meta = dict(index_map[idx])
 
             if -1.05 <= raw <= 1.05:
                 score = float(raw)
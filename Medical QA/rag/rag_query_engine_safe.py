@@ -1,16 +1,60 @@
+import os
+
 from rag.rag_query_engine import RAG
-from safety_scripts.safety_pipeline import safety_check_and_answer
-from inference_scripts.mistral_inference import mistral_generate_with_meta
+from safety_scripts.safety_pipeline import safety_check_and_answer, resolve_pending_entailment
+from rag.context_packing import pack_context, format_block, CONTEXT_TOKEN_BUDGET, MMR_LAMBDA
+from rag.reranker import Reranker, RERANK_CANDIDATES, RERANK_TOP_N
+from monitoring_scripts import metrics
+from serving_scripts.request_context import check_cancelled, Cancelled
+from serving_scripts.degradation import current_level, level_meta
+
+# "mistral" loads the real embedder, index and generator at import. "stub" loads none of them; the
+# caller injects stand-ins with use_models() before the first question (benchmark_scripts/stub_pipeline.py).
+GENERATOR = os.environ.get("MEDIQA_GENERATOR", "mistral")
+
+TOP_K = 5
+
+# Retrieve RERANK_CANDIDATES chunks and keep the RERANK_TOP_N best by cross-encoder (rag/reranker.py).
+RERANK = False
+
+N_CONSISTENCY = 2
+
+NLI_MODEL_ID = "pritamdeka/PubMedBERT-MNLI-MedNLI"
+
+# questions whose NLI work is grouped into one batched pass in ask_batch()
+NLI_WINDOW = 16
+
+rag = None
+reranker = None
+_generate = None
+_count_tokens = None
+_generator_lock = None
 
-GENERATOR = "mistral"
+def use_models(rag_engine, generate_fn, count_tokens_fn, lock_fn=None, reranker_model=None, nli_model_id=None):
+    """
+    Run the pipeline on these models. generate_fn has the signature of
+    mistral_generate_with_meta, lock_fn returns the generator's PriorityLock.
+    """
+    global rag, reranker, _generate, _count_tokens, _generator_lock, NLI_MODEL_ID
+    rag = rag_engine
+    reranker = reranker_model
+    _generate = generate_fn
+    _count_tokens = count_tokens_fn
+    _generator_lock = lock_fn
+    if nli_model_id is not None:
+        NLI_MODEL_ID = nli_model_id
 
-rag = RAG()
+if GENERATOR == "mistral":
+    from inference_scripts import mistral_inference
+    use_models(RAG(), mistral_inference.mistral_generate_with_meta, mistral_inference.count_tokens,
+               mistral_inference.generator_lock, Reranker() if RERANK else None)
+elif GENERATOR != "stub":
+    raise ValueError(f"unknown GENERATOR {GENERATOR!r} (expected 'mistral' or 'stub')")
 
-def build_prompt_for_generator(query, retrieved):
-    context = "\n\n".join([
-        f"[Source: {r.get('book')}, Page: {r.get('page')}]\n{r.get('preview', '')}"
-        for r in retrieved
-    ])
+def build_prompt_for_generator(query, retrieved, context=None):
+    """`context` is a pre-packed context block (see _pack); otherwise every chunk is included as is."""
+    if context is None:
+        context = "\n\n".join(format_block(r) for r in retrieved)
 
     return f"""
 You are a medical assistant. Use ONLY the context below to answer the user's question.
@@ -26,26 +70,150 @@ Context:
 Answer:
 """
 
-def generator_fn_mistral(prompt, seed=0, temperature=0.0, return_generate_obj=False):
-    return mistral_generate_with_meta(prompt, seed=seed, temperature=temperature, return_generate_obj=False)
+def generator_fn(prompt, seed=0, temperature=0.0, return_generate_obj=False, max_tokens=256):
+    return _generate(prompt, seed=seed, temperature=temperature, return_generate_obj=False, max_tokens=max_tokens)
 
-def ask(query):
-    retrieved = rag.retrieve(query, k=5)
+def _pack(retrieved):
+    """Prompt builder over the token-budgeted context, plus its packing stats for meta."""
+    with metrics.span("pack_context"):
+        context, stats = pack_context(retrieved, _count_tokens, budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=MMR_LAMBDA)
+    return (lambda q, r: build_prompt_for_generator(q, r, context=context)), stats
 
-    decision = safety_check_and_answer(
-        query, retrieved,
-        build_prompt_for_generator,
-        generator_fn_mistral,
-        thresholds=None,
-        n_consistency=2,
-        nli_model_id="pritamdeka/PubMedBERT-MNLI-MedNLI"
-    )
+def _safety_args(level):
+    """safety_check_and_answer arguments for a degradation level (serving_scripts/degradation.py)."""
+    max_tokens = level.get("max_tokens", 256)
+    return {
+        "generator_fn": lambda p, **kw: generator_fn(p, max_tokens=max_tokens, **kw),
+        "thresholds": level.get("thresholds"),
+        "n_consistency": level.get("n_consistency", N_CONSISTENCY),
+        "nli_top_m": level.get("nli_top_m"),
+    }
+
+def _rerank(query, candidates):
+    """Narrow FAISS candidates to the reranked top; returns (retrieved, extra meta)."""
+    if reranker is None:
+        return candidates, {}
+    with metrics.span("rerank"):
+        top, info = reranker.rerank(query, candidates, top_n=RERANK_TOP_N)
+    return top, {"rerank": info}
+
+def index_version():
+    """Version of the index snapshot new requests retrieve from (part of api.py's coalescing key)."""
+    return rag.version
 
+def generator_lock():
+    """The generator's PriorityLock, for api.py's scheduler gauges."""
+    return _generator_lock() if _generator_lock is not None else None
+
+def reload_index(version=None):
+    """Load an index snapshot (default: CURRENT) and swap it in; returns (old_version, new_version)."""
+    return rag.reload_snapshot(version)
+
+def _finalize(decision, retrieved, extra_meta=None):
+    metrics.record_decision(decision["status"])
+    decision.setdefault("meta", {})["retrieved_rows"] = [r.get("row") for r in retrieved]
+    if extra_meta:
+        decision["meta"].update(extra_meta)
     if decision["status"] == "accept":
         return decision
 
     return {
         "status": "abstain",
         "answer": "I’m not confident enough to answer safely.",
-        "meta": decision.get("meta", {})
+        "meta": dict(decision["meta"], reason=decision.get("reason"))
     }
+
+def ask(query, filters=None):
+    """filters: optional {"book": name or [names], "page": [lo, hi]} (see RAG.retrieve)."""
+    snapshot = rag.snapshot
+    with metrics.span("retrieve"):
+        retrieved = rag.retrieve(query, k=RERANK_CANDIDATES if reranker else TOP_K, filters=filters, snapshot=snapshot)
+    check_cancelled()
+    # the reranker, the packer and NLI work on full chunk texts, not index_map previews
+    rag.attach_texts(retrieved, snapshot)
+    retrieved, extra = _rerank(query, retrieved)
+    extra["index_version"] = snapshot.version
+    level = current_level()
+    extra["degradation"] = level_meta(level)
+
+    build_prompt, extra["context"] = _pack(retrieved)
+
+    decision = safety_check_and_answer(
+        query, retrieved,
+        build_prompt,
+        nli_model_id=NLI_MODEL_ID,
+        **_safety_args(level)
+    )
+
+    return _finalize(decision, retrieved, extra)
+
+def _failed(i, e):
+    """ask_batch result for a question whose own work raised; cancellation still ends the batch."""
+    if isinstance(e, Cancelled):
+        raise e
+    print(f"[ask_batch] question {i} failed: {e!r}")
+    metrics.record_decision("error")
+    return i, {"status": "error", "error": f"{type(e).__name__}: {e}", "meta": {}}
+
+def ask_batch(queries, nli_window: int = NLI_WINDOW):
+    """
+    Answer many questions. Retrieval is one batched embed + one multi-query
+    FAISS search; NLI is grouped across up to `nli_window` questions.
+    Yields (position, result) as each question finishes (not in input order).
+    A question that raises gets {"status": "error", "error": ...} and the
+    others go on.
+    """
+    snapshot = rag.snapshot
+    with metrics.span("retrieve_batch"):
+        all_retrieved = rag.retrieve_batch(queries, k=RERANK_CANDIDATES if reranker else TOP_K, snapshot=snapshot)
+
+    pending = []
+
+    def _flush():
+        window = list(pending)
+        pending.clear()
+        try:
+            decisions = resolve_pending_entailment([d for _, _, _, d in window], nli_model_id=NLI_MODEL_ID)
+        except Exception as e:
+            if isinstance(e, Cancelled):
+                raise
+            # one question broke the grouped pass: redo the window per question so only that one is lost
+            decisions = [None] * len(window)
+        for (i, retrieved, extra, pending_decision), decision in zip(window, decisions):
+            try:
+                if decision is None:
+                    decision = resolve_pending_entailment([pending_decision], nli_model_id=NLI_MODEL_ID)[0]
+                result = i, _finalize(decision, retrieved, extra)
+            except Exception as e:
+                result = _failed(i, e)
+            yield result
+
+    for i, (query, candidates) in enumerate(zip(queries, all_retrieved)):
+        check_cancelled()
+        try:
+            rag.attach_texts(candidates, snapshot)
+            retrieved, extra = _rerank(query, candidates)
+            extra["index_version"] = snapshot.version
+            level = current_level()
+            extra["degradation"] = level_meta(level)
+            build_prompt, extra["context"] = _pack(retrieved)
+            decision = safety_check_and_answer(
+                query, retrieved,
+                build_prompt,
+                nli_model_id=NLI_MODEL_ID,
+                defer_entailment=True,
+                **_safety_args(level)
+            )
+            if decision["status"] != "pending":
+                result = i, _finalize(decision, retrieved, extra)
+            else:
+                pending.append((i, retrieved, extra, decision))
+                result = None
+        except Exception as e:
+            result = _failed(i, e)
+        if result is not None:
+            yield result
+        if len(pending) >= nli_window:
+            yield from _flush()
+
+    yield from _flush()
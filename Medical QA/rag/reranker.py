@@ -0,0 +1,109 @@
+"""
+reranker.py
+
+Retrieve-wide, rerank-narrow: FAISS returns RERANK_CANDIDATES chunks, a
+cross-encoder scores every (query, chunk) pair in one batched forward
+pass, and the best RERANK_TOP_N go on to the safety pipeline.
+
+Candidates are scored on their full chunk text (RAG.attach_texts, before
+rerank) up to RERANK_MAX_LENGTH tokens; a candidate without one is scored
+on its 300-character index_map preview.
+
+Reranked chunks keep their FAISS similarity in "faiss_score" and get a
+"rerank_score" in [0, 1] (sigmoid of a single-logit head, or the last
+class probability of a multi-class head). safety_check_and_answer checks
+retrieval confidence on "rerank_score" with its own thresholds when it is
+present.
+
+Latency budget: the reranker keeps a moving average of its cost per pair.
+If the predicted cost of a call exceeds the budget it is skipped and the
+top FAISS chunks are returned unchanged. A call that runs over is still
+used (its cost is already paid) and makes the next prediction larger;
+every PROBE_EVERY skips one call runs anyway so the estimate can recover.
+
+Use:
+from rag.reranker import Reranker
+
+reranker = Reranker()
+top, info = reranker.rerank(query, rag.retrieve(query, k=30))
+"""
+import time
+
+import numpy as np
+import torch
+
+from inference_scripts.encoder_backends import load_sequence_classifier
+from rag.context_packing import chunk_text
+
+RERANK_MODEL = "BAAI/bge-reranker-base"
+RERANK_BACKEND = "torch"        # or "torch_int8" / "onnx_int8", see inference_scripts/encoder_backends.py
+RERANK_CANDIDATES = 30
+RERANK_TOP_N = 3
+RERANK_BUDGET_MS = 300.0
+RERANK_MAX_LENGTH = 512
+EWMA_ALPHA = 0.2
+PROBE_EVERY = 20                # after this many skips in a row, rerank anyway to refresh the estimate
+
+
+class Reranker:
+
+    def __init__(self, model_id: str = RERANK_MODEL, backend: str = RERANK_BACKEND, device: str = None,
+                 budget_ms: float = RERANK_BUDGET_MS, tokenizer=None, model=None):
+        """tokenizer / model can be injected (e.g. stub models in benchmarks)."""
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if model is None:
+            print(f"Loading reranker: {model_id} ({backend})")
+            tokenizer, model = load_sequence_classifier(model_id, backend=backend, device=self.device)
+        self.tokenizer = tokenizer
+        self.model = model
+        if hasattr(self.model, "eval"):
+            self.model.eval()
+        self.budget_ms = budget_ms
+        self.ms_per_pair = None
+        self._skips_in_row = 0
+        self.stats = {"reranked": 0, "skipped_budget": 0, "overrun": 0}
+
+    def predicted_ms(self, n_pairs: int):
+        return None if self.ms_per_pair is None else self.ms_per_pair * n_pairs
+
+    def score(self, query: str, texts):
+        """Relevance in [0, 1] for each text, from one batched forward pass."""
+        enc = self.tokenizer([query] * len(texts), list(texts), truncation=True, padding=True,
+                             max_length=RERANK_MAX_LENGTH, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            logits = self.model(**enc).logits
+        if logits.shape[-1] == 1:
+            return torch.sigmoid(logits[:, 0]).cpu().numpy()
+        return torch.softmax(logits, dim=-1)[:, -1].cpu().numpy()
+
+    def rerank(self, query: str, candidates, top_n: int = RERANK_TOP_N, budget_ms: float = None):
+        """Returns (top_n chunks, info); info["reranked"] is False when the budget forced FAISS order."""
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        if not candidates:
+            return [], {"reranked": False, "candidates": 0}
+
+        predicted = self.predicted_ms(len(candidates))
+        if budget_ms is not None and predicted is not None and predicted > budget_ms \
+                and self._skips_in_row < PROBE_EVERY:
+            self._skips_in_row += 1
+            self.stats["skipped_budget"] += 1
+            return candidates[:top_n], {"reranked": False, "candidates": len(candidates),
+                                        "predicted_ms": round(predicted, 1)}
+
+        self._skips_in_row = 0
+        t0 = time.perf_counter()
+        scores = self.score(query, [chunk_text(c) for c in candidates])
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+
+        per_pair = elapsed_ms / len(candidates)
+        self.ms_per_pair = per_pair if self.ms_per_pair is None else \
+            (1 - EWMA_ALPHA) * self.ms_per_pair + EWMA_ALPHA * per_pair
+        self.stats["reranked"] += 1
+        if budget_ms is not None and elapsed_ms > budget_ms:
+            self.stats["overrun"] += 1
+
+        order = np.argsort(-scores, kind="stable")[:top_n]
+        top = [dict(candidates[i], faiss_score=candidates[i].get("score"), rerank_score=float(scores[i]))
+               for i in order]
+        return top, {"reranked": True, "candidates": len(candidates), "ms": round(elapsed_ms, 1),
+                     "faiss_ranks": [int(i) for i in order]}
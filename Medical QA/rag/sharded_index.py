@@ -0,0 +1,166 @@
+"""
+sharded_index.py
+
+One FAISS shard per book, searched in parallel and merged into a global top-k.
+
+Each shard is an IndexIDMap2 over IndexFlatIP whose ids are the global rows
+of index_map.json / embeddings.npy, so merged results need no translation
+and a single book's shard can be rebuilt without touching the others.
+
+Files (in rag/shards/):
+ - <book>.faiss
+ - manifest.json   [{"book", "file", "ntotal"}, ...]
+
+Filters (RAG.retrieve(..., filters=...)):
+ - {"book": "Tripathi_Pharmacology"} or {"book": [...]}  -> only those shards are searched
+ - {"page": [lo, hi]}                                     -> FAISS IDSelector over the rows on those pages
+
+A chunk kept by dedup_chunks.py in place of copies from other books
+("also_in") is built into the shard of every book it appears in, and
+filters match it on any of its (book, page) locations. Shards searched
+together can return the same row; the merge keeps it once.
+
+Run from the rag/ folder to (re)build shards from embeddings.npy + index_map.json:
+python sharded_index.py
+python sharded_index.py --books Oxford_Handbook
+"""
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+SHARDS_DIR = "shards"
+MANIFEST = "manifest.json"
+SEARCH_THREADS = 4
+
+
+def shard_file(book: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", book) + ".faiss"
+
+
+def entry_locations(entry):
+    """(book, page) of a chunk and of every copy dedup_chunks.py replaced with it."""
+    return [(entry.get("book"), entry.get("page"))] + [(a.get("book"), a.get("page")) for a in entry.get("also_in") or ()]
+
+
+def rows_by_book(index_map):
+    out = {}
+    for entry in index_map:
+        for book in dict.fromkeys(b for b, _ in entry_locations(entry)):
+            out.setdefault(book, []).append(entry["row"])
+    return {b: np.array(r, dtype="int64") for b, r in out.items()}
+
+
+def build_shard(embeddings, rows):
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(embeddings.shape[1]))
+    index.add_with_ids(np.ascontiguousarray(embeddings[rows], dtype="float32"), rows)
+    return index
+
+
+def build_shards(embeddings, index_map, folder: str, books=None):
+    """Write one shard per book (or only `books`) and update the manifest."""
+    os.makedirs(folder, exist_ok=True)
+    manifest_path = os.path.join(folder, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = {m["book"]: m for m in json.load(f)}
+
+    for book, rows in rows_by_book(index_map).items():
+        if books and book not in books:
+            continue
+        index = build_shard(embeddings, rows)
+        faiss.write_index(index, os.path.join(folder, shard_file(book)))
+        manifest[book] = {"book": book, "file": shard_file(book), "ntotal": int(index.ntotal)}
+        print(f"Saved shard {book}: {index.ntotal} vectors")
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(manifest.values(), key=lambda m: m["book"]), f, indent=2)
+    return manifest
+
+
+def _merge(results, k):
+    """results: [(D (nq, k), I (nq, k))] from each shard -> global top-k per query."""
+    D = np.concatenate([d for d, _ in results], axis=1)
+    I = np.concatenate([i for _, i in results], axis=1)
+    D = np.where(I < 0, -np.inf, D)
+    order = np.argsort(-D, axis=1, kind="stable")
+    D = np.take_along_axis(D, order, axis=1)
+    I = np.take_along_axis(I, order, axis=1)
+    if len(results) > 1:
+        # a row in several books' shards (also_in) comes back once per shard
+        for q in range(len(I)):
+            _, first = np.unique(I[q], return_index=True)
+            repeated = np.ones(I.shape[1], dtype=bool)
+            repeated[first] = False
+            D[q, repeated] = -np.inf
+            I[q, repeated] = -1
+        order = np.argsort(-D, axis=1, kind="stable")
+        D = np.take_along_axis(D, order, axis=1)
+        I = np.take_along_axis(I, order, axis=1)
+    D, I = D[:, :k], I[:, :k]
+    return np.where(np.isinf(D), -1.0, D).astype("float32"), I
+
+
+class ShardedIndex:
+
+    def __init__(self, shards: dict, threads: int = SEARCH_THREADS):
+        self.shards = dict(shards)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="mediqa-shard")
+
+    @property
+    def ntotal(self):
+        return sum(s.ntotal for s in self.shards.values())
+
+    def replace_shard(self, book: str, index):
+        """Swap in a rebuilt (or new) book without touching the other shards."""
+        shards = dict(self.shards)
+        shards[book] = index
+        self.shards = shards
+
+    def search(self, q, k, books=None, selector=None):
+        shards = self.shards
+        names = [b for b in (books or shards) if b in shards]
+        if not names:
+            nq = len(q)
+            return np.full((nq, k), -1.0, dtype="float32"), np.full((nq, k), -1, dtype="int64")
+        params = faiss.SearchParameters(sel=selector) if selector is not None else None
+
+        def one(name):
+            return shards[name].search(q, k, params=params)
+
+        # FAISS releases the GIL during search, so shards really run in parallel
+        results = list(self._pool.map(one, names)) if len(names) > 1 else [one(names[0])]
+        return _merge(results, k)
+
+
+def load_sharded_index(folder: str, threads: int = SEARCH_THREADS, mmap: bool = False) -> ShardedIndex:
+    """mmap: map the shard vectors read-only instead of reading them into process memory."""
+    with open(os.path.join(folder, MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    flags = faiss.IO_FLAG_MMAP_IFC if mmap else 0
+    shards = {m["book"]: faiss.read_index(os.path.join(folder, m["file"]), flags) for m in manifest}
+    return ShardedIndex(shards, threads=threads)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--embeddings", default="embeddings.npy")
+    ap.add_argument("--index-map", default="index_map.json")
+    ap.add_argument("--out", default=SHARDS_DIR)
+    ap.add_argument("--books", nargs="+", default=None, help="only rebuild these books' shards")
+    args = ap.parse_args(argv)
+
+    embeddings = np.load(args.embeddings, mmap_mode="r")
+    with open(args.index_map, "r", encoding="utf-8") as f:
+        index_map = json.load(f)
+    build_shards(embeddings, index_map, args.out, books=args.books)
+    print("Saved manifest ->", os.path.join(args.out, MANIFEST))
+
+
+if __name__ == "__main__":
+    main()
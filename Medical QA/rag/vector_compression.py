@@ -0,0 +1,186 @@
+"""
+vector_compression.py
+
+Compressed storage for the chunk embeddings.
+
+The flat float32 index costs 4 KB per 1024-dim chunk in every worker. The
+modes below keep a much smaller index in RAM for the first-pass search and
+rescore only a shortlist against the full-precision vectors, which stay on
+disk in embeddings.npy and are opened as a read-only memmap.
+
+Modes:
+ - "float32"  : plain IndexFlatIP (no compression, no rescoring)
+ - "fp16"     : scalar quantizer, 2 bytes / dim
+ - "int8"     : scalar quantizer, 1 byte / dim
+ - "binary"   : sign bits, 1 bit / dim, Hamming search
+ - "pca"      : PCA projection to COMPRESSED_DIM, float32
+ - "truncate" : Matryoshka-style prefix of COMPRESSED_DIM dims, float32
+
+Use:
+from rag.vector_compression import build_compressed_index, save_compressed, load_searcher
+
+index, transform = build_compressed_index(embeddings, "int8")
+save_compressed(index, transform, "int8", "rag")
+searcher = load_searcher("int8", "rag", "rag/embeddings.npy")
+D, I = searcher.search(q_embs, k=5)
+"""
+
+import os
+import numpy as np
+import faiss
+
+STORAGE_MODES = ("float32", "fp16", "int8", "binary", "pca", "truncate")
+
+COMPRESSED_DIM = 256
+RESCORE_FACTOR = 4
+
+
+def l2_normalize(x):
+    x = np.ascontiguousarray(x, dtype="float32")
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _binarize(x):
+    return np.packbits(np.asarray(x) > 0, axis=1)
+
+
+def index_path(folder, mode):
+    return os.path.join(folder, f"faiss_index_{mode}.bin")
+
+
+def transform_path(folder, mode, dim=COMPRESSED_DIM):
+    return os.path.join(folder, f"{mode}_{dim}.bin")
+
+
+def build_compressed_index(embeddings, mode, dim=COMPRESSED_DIM):
+    """Build the first-pass index for `mode`. Returns (index, transform or None)."""
+
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown storage mode: {mode}")
+
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    full_dim = embeddings.shape[1]
+
+    if mode == "float32":
+        index = faiss.IndexFlatIP(full_dim)
+        index.add(embeddings)
+        return index, None
+
+    if mode in ("fp16", "int8"):
+        qtype = faiss.ScalarQuantizer.QT_fp16 if mode == "fp16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(full_dim, qtype, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.add(embeddings)
+        return index, None
+
+    if mode == "binary":
+        index = faiss.IndexBinaryFlat(full_dim)
+        index.add(_binarize(embeddings))
+        return index, None
+
+    if mode == "pca":
+        pca = faiss.PCAMatrix(full_dim, dim)
+        pca.train(embeddings)
+        reduced = l2_normalize(pca.apply(embeddings))
+        index = faiss.IndexFlatIP(dim)
+        index.add(reduced)
+        return index, pca
+
+    reduced = l2_normalize(embeddings[:, :dim])
+    index = faiss.IndexFlatIP(dim)
+    index.add(reduced)
+    return index, None
+
+
+def save_compressed(index, transform, mode, folder, dim=COMPRESSED_DIM):
+    path = index_path(folder, mode)
+    if mode == "binary":
+        faiss.write_index_binary(index, path)
+    else:
+        faiss.write_index(index, path)
+    if transform is not None:
+        faiss.write_VectorTransform(transform, transform_path(folder, mode, dim))
+    return path
+
+
+def index_nbytes(index, mode):
+    """Serialized size of the first-pass index, i.e. what each worker keeps resident."""
+    if mode == "binary":
+        return int(faiss.serialize_index_binary(index).nbytes)
+    return int(faiss.serialize_index(index).nbytes)
+
+
+class CompressedSearcher:
+    """
+    Search over the compressed index, then rescore a shortlist exactly.
+
+    Exposes the same `search(q, k) -> (D, I)` and `ntotal` as a FAISS index,
+    so RAG.retrieve can use it in place of the flat index.
+    """
+
+    def __init__(self, index, mode, full_embeddings, transform=None,
+                 dim=COMPRESSED_DIM, rescore_factor=RESCORE_FACTOR):
+        self.index = index
+        self.mode = mode
+        self.full = full_embeddings
+        self.transform = transform
+        self.dim = dim
+        self.rescore_factor = max(1, int(rescore_factor))
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def _encode_queries(self, q):
+        if self.mode == "binary":
+            return _binarize(q)
+        if self.mode == "pca":
+            return l2_normalize(self.transform.apply(q))
+        if self.mode == "truncate":
+            return l2_normalize(q[:, :self.dim])
+        return q
+
+    def shortlist(self, q, n):
+        q = np.ascontiguousarray(q, dtype="float32")
+        _, ids = self.index.search(self._encode_queries(q), n)
+        return ids
+
+    def search(self, q, k):
+        q = np.ascontiguousarray(q, dtype="float32")
+        n = min(self.ntotal, k * self.rescore_factor)
+        ids = self.shortlist(q, n)
+
+        D = np.full((len(q), k), -np.inf, dtype="float32")
+        I = np.full((len(q), k), -1, dtype="int64")
+
+        for qi in range(len(q)):
+            cand = ids[qi][ids[qi] >= 0]
+            if cand.size == 0:
+                continue
+            # sorted row order keeps memmap reads sequential
+            rows = np.sort(cand)
+            scores = np.asarray(self.full[rows], dtype="float32") @ q[qi]
+            order = np.argsort(-scores)[:k]
+            D[qi, :len(order)] = scores[order]
+            I[qi, :len(order)] = rows[order]
+
+        return D, I
+
+
+def load_searcher(mode, folder, embeddings_path, dim=COMPRESSED_DIM, rescore_factor=RESCORE_FACTOR):
+    """Load a compressed index and memmap the full-precision embeddings for rescoring."""
+
+    path = index_path(folder, mode)
+    if mode == "binary":
+        index = faiss.read_index_binary(path)
+    else:
+        index = faiss.read_index(path)
+
+    transform = None
+    if mode == "pca":
+        transform = faiss.read_VectorTransform(transform_path(folder, mode, dim))
+
+    full = np.load(embeddings_path, mmap_mode="r")
+    return CompressedSearcher(index, mode, full, transform=transform, dim=dim, rescore_factor=rescore_factor)
@@ -7,20 +7,27 @@ Function:
 
 model_generate_fn(prompt, seed, temperature) -> text
 """
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import util
 import numpy as np
 
+from inference_scripts.encoder_backends import load_sentence_encoder
+from monitoring_scripts import metrics
+
+# "torch" (fp32), "torch_int8" or "onnx_int8" -- see inference_scripts/encoder_backends.py
+ENCODER_BACKEND = "torch"
+
 _embedder = None
-def _get_embedder():
+def _get_embedder(backend: str = None):
     global _embedder
     if _embedder is None:
-        _embedder = SentenceTransformer("BAAI/bge-large-en-v1.5", cache_folder="models/bge/")
+        _embedder = load_sentence_encoder("BAAI/bge-large-en-v1.5", backend=backend or ENCODER_BACKEND, cache_folder="models/bge/")
     return _embedder
 
 def check_consistency(model_generate_fn, prompt: str, n: int = 3, sim_thr: float = 0.75, temperature: float = 0.2):
     samples = []
     for i in range(n):
-        out = model_generate_fn(prompt, seed=1000 + i, temperature=temperature)
+        with metrics.span("consistency_generation"):
+            out = model_generate_fn(prompt, seed=1000 + i, temperature=temperature)
         txt = out if isinstance(out, str) else out.get("text", "")
         samples.append(txt.strip())
 
@@ -28,9 +35,10 @@ def check_consistency(model_generate_fn, prompt: str, n: int = 3, sim_thr: float
     if len(uniq) == 1:
         return True, {"samples": samples, "mean_pairwise_sim": 1.0}
 
-    embedder = _get_embedder()
-    embs = embedder.encode(samples, convert_to_tensor=True)
-    sim_matrix = util.cos_sim(embs, embs).cpu().numpy()
+    with metrics.span("consistency_similarity"):
+        embedder = _get_embedder()
+        embs = embedder.encode(samples, convert_to_tensor=True)
+        sim_matrix = util.cos_sim(embs, embs).cpu().numpy()
 
     sims = []
     for i in range(len(samples)):
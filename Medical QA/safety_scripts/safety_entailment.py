@@ -3,25 +3,30 @@ Biomedical entailment using a MedNLI-tuned sequence classification model.
 
 Uses a model like 'pritamdeka/PubMedBERT-MNLI-MedNLI' (example). Adjust model_id if you prefer another.
 """
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 from typing import List, Tuple
 import numpy as np
 
+from inference_scripts.encoder_backends import load_sequence_classifier
+
 DEFAULT_NLI = "pritamdeka/PubMedBERT-MNLI-MedNLI"
 
+# "torch" (fp32), "torch_int8" or "onnx_int8" -- see inference_scripts/encoder_backends.py
+NLI_BACKEND = "torch"
+
+# (premise, hypothesis) pairs per forward pass; pairs are length-sorted and padded per batch
+NLI_BATCH_SIZE = 16
+
 _nli_tokenizer = None
 _nli_model = None
 _label_map = None
 
-def load_entailment_model(model_id: str = DEFAULT_NLI, device: str = None):
+def load_entailment_model(model_id: str = DEFAULT_NLI, device: str = None, backend: str = None):
     global _nli_tokenizer, _nli_model, _label_map
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
-    if _nli_tokenizer is None:
-        _nli_tokenizer = AutoTokenizer.from_pretrained(model_id)
     if _nli_model is None:
-        _nli_model = AutoModelForSequenceClassification.from_pretrained(model_id).to(device)
+        _nli_tokenizer, _nli_model = load_sequence_classifier(model_id, backend=backend or NLI_BACKEND, device=device)
         cfg = _nli_model.config
         id2label = getattr(cfg, "id2label", None)
         if id2label:
@@ -49,30 +54,54 @@ def entailment_check(hypotheses: List[str], retrieved_texts: List[str],
       entailment_pct: fraction of hypothesis sentences with entail_prob >= entailment_threshold
       details: list of {hypothesis, best_entail_p, best_premise_idx}
     """
+    return entailment_check_batch([(hypotheses, retrieved_texts)], model_id=model_id, device=device,
+                                  entailment_threshold=entailment_threshold)[0]
+
+def entailment_check_batch(items: List[Tuple[List[str], List[str]]],
+                           model_id: str = DEFAULT_NLI, device: str = None,
+                           entailment_threshold: float = 0.6,
+                           batch_size: int = NLI_BATCH_SIZE) -> List[Tuple[float, List[dict]]]:
+    """
+    entailment_check for several (hypotheses, retrieved_texts) items at once.
+    All (premise, hypothesis) pairs across items are sorted by length and run
+    through the model in padded batches of `batch_size`.
+    """
     tokenizer, model, label_map = load_entailment_model(model_id, device)
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
+    entail_idx = label_map.get("entailment", 2)
 
-    retrieved_chunks = _chunk_texts(retrieved_texts, max_chars=1500)
-    details = []
-    entailed_count = 0
+    pairs = []
+    for item_idx, (hypotheses, retrieved_texts) in enumerate(items):
+        retrieved_chunks = _chunk_texts(retrieved_texts, max_chars=1500)
+        for hyp_idx, hyp in enumerate(hypotheses):
+            for prem_idx, premise in enumerate(retrieved_chunks):
+                pairs.append((item_idx, hyp_idx, prem_idx, premise, hyp))
+    pairs.sort(key=lambda x: len(x[3]) + len(x[4]))
 
-    for hyp in hypotheses:
-        best_p = 0.0
-        best_idx = None
-        for idx, premise in enumerate(retrieved_chunks):
-            enc = tokenizer(premise, hyp, truncation='only_first', padding='max_length', max_length=512, return_tensors="pt").to(device)
-            with torch.no_grad():
-                out = model(**enc)
-                probs = torch.softmax(out.logits, dim=-1).cpu().numpy()[0]
-            entail_idx = label_map.get("entailment", 2)
-            entail_p = float(probs[entail_idx])
-            if entail_p > best_p:
-                best_p = entail_p
-                best_idx = idx
-        details.append({"hypothesis": hyp, "best_entail_p": best_p, "best_premise_idx": best_idx})
-        if best_p >= entailment_threshold:
-            entailed_count += 1
+    best = {}
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start:start + batch_size]
+        enc = tokenizer([b[3] for b in batch], [b[4] for b in batch], truncation='only_first',
+                        padding=True, max_length=512, return_tensors="pt").to(device)
+        with torch.no_grad():
+            out = model(**enc)
+            probs = torch.softmax(out.logits, dim=-1).cpu().numpy()
+        for (item_idx, hyp_idx, prem_idx, _, _), p in zip(batch, probs):
+            entail_p = float(p[entail_idx])
+            key = (item_idx, hyp_idx)
+            cur_p, cur_idx = best.get(key, (0.0, None))
+            if entail_p > cur_p or (entail_p == cur_p and cur_idx is not None and prem_idx < cur_idx):
+                best[key] = (entail_p, prem_idx)
 
-    entailment_pct = entailed_count / max(1, len(hypotheses))
-    return entailment_pct, details
+    results = []
+    for item_idx, (hypotheses, _) in enumerate(items):
+        details = []
+        entailed_count = 0
+        for hyp_idx, hyp in enumerate(hypotheses):
+            best_p, best_idx = best.get((item_idx, hyp_idx), (0.0, None))
+            details.append({"hypothesis": hyp, "best_entail_p": best_p, "best_premise_idx": best_idx})
+            if best_p >= entailment_threshold:
+                entailed_count += 1
+        results.append((entailed_count / max(1, len(hypotheses)), details))
+    return results
@@ -1,7 +1,9 @@
 from safety_scripts.safety_retrieval import check_retrieval_confidence
 from safety_scripts.safety_consistency import check_consistency
-from safety_scripts.safety_entailment import entailment_check, load_entailment_model
+from safety_scripts.safety_entailment import entailment_check, entailment_check_batch, load_entailment_model
 from safety_scripts.safety_logprob import compute_avg_logprob_from_generate
+from monitoring_scripts import metrics
+from serving_scripts.request_context import check_cancelled
 import nltk
 nltk.download('punkt', quiet=True)
 from nltk import sent_tokenize
@@ -9,6 +11,8 @@ from nltk import sent_tokenize
 DEFAULTS = {
     "retrieval_top1": 0.55,
     "retrieval_mean3": 0.50,
+    "rerank_top1": 0.30,
+    "rerank_mean3": 0.15,
     "consistency_sim": 0.75,
     "entailment_pct": 0.60,
     "avg_logprob": -2.5
@@ -20,21 +24,42 @@ def safety_check_and_answer(query: str,
                             generator_fn,
                             thresholds: dict = None,
                             n_consistency: int = 3,
-                            nli_model_id: str = None):
+                            nli_model_id: str = None,
+                            defer_entailment: bool = False,
+                            nli_top_m: int = None):
     """
     build_prompt_fn(query, retrieved) -> prompt string
     generator_fn(prompt, seed=..., temperature=..., return_generate_obj=bool) -> dict { "text":..., "generate_obj":..., "tokenizer":... }
+    defer_entailment=True stops before NLI and returns status "pending"; pass a list of
+    those to resolve_pending_entailment() to run NLI for many questions at once.
+    nli_top_m limits NLI premises to the top-m retrieved chunks. n_consistency=0 or
+    nli_top_m=0 skips that gate, and a question that passes retrieval then abstains
+    without generating: no gate is dropped from an accepted answer.
+    See serving_scripts/degradation.py.
     """
     thr = DEFAULTS.copy()
     if thresholds:
         thr.update(thresholds)
 
-    ok, reason, metrics = check_retrieval_confidence(retrieved, top1_thr=thr["retrieval_top1"], mean3_thr=thr["retrieval_mean3"])
-    meta = {"retrieval": metrics}
+    if retrieved and all("rerank_score" in r for r in retrieved):
+        # cross-encoder scores (rag/reranker.py) are on a different scale than cosine similarity
+        ok, reason, ret_metrics = check_retrieval_confidence(retrieved, top1_thr=thr["rerank_top1"],
+                                                             mean3_thr=thr["rerank_mean3"], score_key="rerank_score")
+        ret_metrics["score_key"] = "rerank_score"
+    else:
+        ok, reason, ret_metrics = check_retrieval_confidence(retrieved, top1_thr=thr["retrieval_top1"], mean3_thr=thr["retrieval_mean3"])
+    meta = {"retrieval": ret_metrics}
     if not ok:
+        metrics.record_abstain("retrieval")
         return {"status": "abstain", "reason": reason, "meta": meta}
 
-    prompt = build_prompt_fn(query, retrieved)
+    if n_consistency == 0 or nli_top_m == 0:
+        metrics.record_abstain("degraded")
+        return {"status": "abstain", "reason": "Safety checks skipped under load.", "meta": meta}
+
+    check_cancelled()
+    with metrics.span("build_prompt"):
+        prompt = build_prompt_fn(query, retrieved)
 
     def _gen_text(p, seed, temperature=0.2):
         out = generator_fn(p, seed=seed, temperature=temperature, return_generate_obj=False)
@@ -43,9 +68,12 @@ def safety_check_and_answer(query: str,
     cons_ok, cons_meta = check_consistency(_gen_text, prompt, n=n_consistency, sim_thr=thr["consistency_sim"], temperature=0.2)
     meta["consistency"] = cons_meta
     if not cons_ok:
+        metrics.record_abstain("consistency")
         return {"status": "abstain", "reason": "Inconsistent generations (low self-consistency).", "meta": meta}
 
-    main_out = generator_fn(prompt, seed=0, temperature=0.0, return_generate_obj=True)
+    check_cancelled()
+    with metrics.span("greedy_generation"):
+        main_out = generator_fn(prompt, seed=0, temperature=0.0, return_generate_obj=True)
     text = main_out["text"]
     gen_obj = main_out.get("generate_obj", None)
     avg_logp = None
@@ -56,24 +84,52 @@ def safety_check_and_answer(query: str,
             avg_logp = None
     meta["avg_logprob"] = avg_logp
     if avg_logp is not None and avg_logp < thr["avg_logprob"]:
+        metrics.record_abstain("logprob")
         return {"status": "abstain", "reason": f"Low model confidence (avg_logprob={avg_logp:.3f}).", "meta": meta}
 
     if nli_model_id == "disable":
         meta["entailment"] = {"pct": None, "details": "disabled"}
         return {"status": "accept", "answer": text, "meta": meta}
 
-    sentences = sent_tokenize(text)
-    sentences = [s for s in sentences if len(s.split()) >= 3]
-    retrieved_texts = [r["text"] if "text" in r else r.get("preview", "") for r in retrieved]
+    check_cancelled()
+    with metrics.span("sentence_split"):
+        sentences = sent_tokenize(text)
+        sentences = [s for s in sentences if len(s.split()) >= 3]
+    retrieved_texts = [r["text"] if "text" in r else r.get("preview", "") for r in retrieved[:nli_top_m]]
+
+    if defer_entailment:
+        return {"status": "pending", "answer": text, "meta": meta, "thresholds": thr,
+                "sentences": sentences, "retrieved_texts": retrieved_texts}
+
+    check_cancelled()
+    with metrics.span("nli"):
+        entail_pct, entail_details = entailment_check(
+            sentences,
+            retrieved_texts,
+            model_id=nli_model_id if nli_model_id else None
+        )
 
-    entail_pct, entail_details = entailment_check(
-        sentences,
-        retrieved_texts,
-        model_id=nli_model_id if nli_model_id else None
-    )
+    return _entailment_decision(text, meta, entail_pct, entail_details, thr)
 
+def _entailment_decision(text, meta, entail_pct, entail_details, thr):
     meta["entailment"] = {"pct": entail_pct, "details": entail_details}
     if entail_pct < thr["entailment_pct"]:
+        metrics.record_abstain("entailment")
         return {"status": "abstain", "reason": f"Insufficient evidence in retrieved docs (entailment_pct={entail_pct:.2f}).", "meta": meta}
 
     return {"status": "accept", "answer": text, "meta": meta}
+
+def resolve_pending_entailment(pending: list, nli_model_id: str = None):
+    """
+    Finish decisions returned with status "pending" (defer_entailment=True) with
+    one grouped NLI pass across all of them. Returns decisions in the same order.
+    """
+    if not pending:
+        return []
+    with metrics.span("nli_batch"):
+        results = entailment_check_batch(
+            [(p["sentences"], p["retrieved_texts"]) for p in pending],
+            model_id=nli_model_id if nli_model_id else None
+        )
+    return [_entailment_decision(p["answer"], p["meta"], pct, details, p["thresholds"])
+            for p, (pct, details) in zip(pending, results)]
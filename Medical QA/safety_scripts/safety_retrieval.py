@@ -3,14 +3,16 @@ import numpy as np
 
 def check_retrieval_confidence(retrieved: List[Dict],
                                top1_thr: float = 0.55,
-                               mean3_thr: float = 0.50):
+                               mean3_thr: float = 0.50,
+                               score_key: str = "score"):
     """
-    retrieved: list of dicts with 'score' keys (descending order)
+    retrieved: list of dicts with `score_key` keys (descending order);
+               "rerank_score" for chunks reordered by rag/reranker.py
     Returns: (ok:bool, reason:str, metrics:dict)
     """
     if not retrieved:
         return False, "No retrieved context.", {"top1": None, "mean3": None}
-    scores = [float(x.get("score", 0.0)) for x in retrieved]
+    scores = [float(x.get(score_key, 0.0)) for x in retrieved]
     top1 = scores[0]
     mean3 = float(np.mean(scores[:3])) if len(scores) >= 3 else float(np.mean(scores))
     if top1 < top1_thr or mean3 < mean3_thr:
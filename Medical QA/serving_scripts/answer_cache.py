@@ -0,0 +1,112 @@
+"""
+Answer cache for /chat, keyed by (index version, normalized question).
+
+The pipeline answers a message without session history, so the same
+question against the same index snapshot gets the same answer. Entries are
+keyed by the index version, so a hot-swapped index never serves answers
+retrieved from the previous one. Bounded by MAX_ENTRIES (LRU) and TTL_SECONDS.
+
+serving_scripts/cache_warmer.py precomputes entries offline; the API loads
+them with load_jsonl() at startup (before traffic is admitted) and after an
+index reload.
+
+Use:
+from serving_scripts.answer_cache import AnswerCache
+
+cache = AnswerCache()
+cache.put(("20261019-142501", "what is asthma"), resp)
+cache.get(("20261019-142501", "what is asthma"))
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+MAX_ENTRIES = 5000
+TTL_SECONDS = 24 * 3600
+
+
+def read_warm_records(path: str):
+    """
+    Records of a cache_warmer.py file, and how many lines were skipped because
+    they could not be read (a warmer killed mid-write leaves a truncated line).
+    """
+    records, skipped = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(rec, dict) or "key" not in rec:
+                skipped += 1
+                continue
+            records.append(rec)
+    if skipped:
+        print(f"[answer_cache] {path}: skipped {skipped} unreadable line(s)")
+    return records, skipped
+
+
+class AnswerCache:
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl_seconds: float = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.warmed = 0
+        self.warm_skipped = 0
+        self.evictions = 0
+
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or time.time() - item[0] > self.ttl_seconds:
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, resp: Dict[str, Any], stored_at: float = None) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (stored_at or time.time(), resp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def load_jsonl(self, path: str, version) -> int:
+        """Add warm entries written by cache_warmer.py for index `version`; returns how many were loaded."""
+        records, skipped = read_warm_records(path)
+        loaded = 0
+        for rec in records:
+            if rec.get("index_version") != version:
+                continue
+            self.put((version, rec["key"]),
+                     {"status": rec.get("status"), "answer": rec.get("answer"), "meta": rec.get("meta") or {}},
+                     stored_at=rec.get("t"))
+            loaded += 1
+        self.warmed += loaded
+        self.warm_skipped += skipped
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "warmed": self.warmed, "warm_skipped": self.warm_skipped, "evictions": self.evictions}
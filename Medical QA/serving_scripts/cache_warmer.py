@@ -0,0 +1,209 @@
+"""
+cache_warmer.py
+
+Offline warmer for the /chat answer cache (serving_scripts/answer_cache.py).
+
+This script:
+1. Picks questions: the most frequent ones in a traffic log
+   (TRAFFIC_LOG_PATH, see monitoring_scripts/traffic_recorder.py) first,
+   then MedDialog patient descriptions from datasets/raw/meddialog
+2. Runs them through the pipeline's ask_batch in small chunks at low OS
+   priority, within a budget: --count questions, --max-seconds wall time,
+   and --cpu-share (it sleeps between chunks so it is busy at most that
+   share of the time). Its generator calls are WARM priority, behind
+   interactive and batch work sharing the process
+3. Appends {"key", "question", "index_version", "status", "answer", "meta", "t"}
+   lines to --out. Keys already warmed for the same index version are
+   skipped, so a budget can be spread over several runs
+4. Prints a report: questions warmed, time used, and the hit rate the warmed
+   set would have had on the traffic log
+
+The API loads the file for its current index version at startup, before
+it accepts requests, and again after /admin/reload_index
+(WARM_CACHE_PATH=warm_cache.jsonl). Afterwards mediqa_answer_cache_* in
+/metrics report the real hit rate. After publishing a new index snapshot,
+run the warmer again (it reads CURRENT) and then reload the index.
+
+Run from the Medical QA folder:
+python -m serving_scripts.cache_warmer --traffic traffic.jsonl.gz --meddialog --count 500
+python -m serving_scripts.cache_warmer --meddialog --count 2000 --max-seconds 3600 --cpu-share 0.5
+"""
+import argparse
+import importlib
+import json
+import os
+import time
+from collections import Counter
+from glob import glob
+
+from serving_scripts.answer_cache import read_warm_records
+from serving_scripts.single_flight import normalize_query
+from serving_scripts.session_store import compact_meta
+from serving_scripts.request_context import RequestContext, activate, WARM
+from monitoring_scripts.traffic_recorder import read_log
+from dataset_scripts.ingest_meddialog import RAW_GLOB, iter_json_array
+
+PIPELINE = os.environ.get("MEDIQA_PIPELINE", "rag.rag_query_engine_safe:ask")
+OUT_PATH = "warm_cache.jsonl"
+WARM_COUNT = 500
+MAX_SECONDS = 3600.0
+CPU_SHARE = 0.5
+CHUNK = 16          # questions per ask_batch call (one NLI window)
+NICE = 10
+MAX_QUESTION_CHARS = 500
+
+
+def traffic_counts(paths):
+    """Counter of normalized questions, plus the first raw text seen for each key."""
+    counts, text = Counter(), {}
+    for path in paths:
+        for rec in read_log(path):
+            q = (rec.get("q") or "").strip()
+            if not q:
+                continue
+            key = normalize_query(q)
+            counts[key] += 1
+            text.setdefault(key, q)
+    return counts, text
+
+
+def meddialog_counts(paths):
+    counts, text = Counter(), {}
+    for path in paths:
+        for d in iter_json_array(path):
+            q = (d.get("description") or "").strip()
+            if not q or len(q) >= MAX_QUESTION_CHARS:
+                continue
+            key = normalize_query(q)
+            counts[key] += 1
+            text.setdefault(key, q)
+    return counts, text
+
+
+def select_questions(sources, count: int, skip=()):
+    """[(key, question)] from (counts, text) sources in priority order, most frequent first."""
+    picked, seen = [], set(skip)
+    for counts, text in sources:
+        for key, _ in counts.most_common():
+            if len(picked) >= count:
+                return picked
+            if key in seen:
+                continue
+            seen.add(key)
+            picked.append((key, text[key]))
+    return picked
+
+
+def warmed_keys(path: str, version):
+    if not os.path.exists(path):
+        return set()
+    records, _ = read_warm_records(path)
+    return {rec["key"] for rec in records if rec.get("index_version") == version}
+
+
+def _end_line(path: str):
+    """Terminate a truncated last line (a run killed mid-write) so appended records start on a line of their own."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def _load_pipeline(spec: str):
+    module, _, attr = spec.partition(":")
+    mod = importlib.import_module(module)
+    ask = getattr(mod, attr or "ask")
+    ask_batch = getattr(mod, "ask_batch", None)
+    if ask_batch is None:
+        ask_batch = lambda qs: ((i, ask(q)) for i, q in enumerate(qs))
+    return ask_batch, getattr(mod, "index_version", lambda: None)
+
+
+def warm(ask_batch, picked, out_f, version, max_seconds: float = MAX_SECONDS, cpu_share: float = CPU_SHARE):
+    """Answer `picked` chunk by chunk within the budget; returns (warmed keys, statuses, busy seconds)."""
+    deadline = time.perf_counter() + max_seconds
+    done, statuses, busy = [], Counter(), 0.0
+    ctx = RequestContext(priority=WARM)
+    for start in range(0, len(picked), CHUNK):
+        if time.perf_counter() >= deadline:
+            print("Time budget used up.")
+            break
+        chunk = picked[start:start + CHUNK]
+        t0 = time.perf_counter()
+        with activate(ctx):
+            results = list(ask_batch([q for _, q in chunk]))
+        for pos, resp in results:
+            key, q = chunk[pos]
+            if resp.get("status") == "error":
+                # not an answer: leave the key unwarmed so a later run retries it
+                statuses["error"] += 1
+                continue
+            rec = {"key": key, "question": q, "index_version": version, "status": resp.get("status"),
+                   "answer": resp.get("answer"), "meta": compact_meta(resp.get("meta")), "t": round(time.time(), 3)}
+            out_f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            done.append(key)
+            statuses[rec["status"]] += 1
+        out_f.flush()
+        spent = time.perf_counter() - t0
+        busy += spent
+        print(f"Warmed {len(done)}/{len(picked)} ({spent:.1f}s for {len(chunk)})")
+        if 0 < cpu_share < 1:
+            time.sleep(min(spent * (1.0 / cpu_share - 1.0), max(0.0, deadline - time.perf_counter())))
+    return done, statuses, busy
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--traffic", nargs="*", default=[], help="traffic logs written with TRAFFIC_LOG_PATH")
+    ap.add_argument("--meddialog", nargs="*", default=None,
+                    help=f"MedDialog JSON files (no value: {RAW_GLOB})")
+    ap.add_argument("--out", default=OUT_PATH)
+    ap.add_argument("--pipeline", default=PIPELINE)
+    ap.add_argument("--count", type=int, default=WARM_COUNT)
+    ap.add_argument("--max-seconds", type=float, default=MAX_SECONDS)
+    ap.add_argument("--cpu-share", type=float, default=CPU_SHARE, help="fraction of wall time spent answering")
+    args = ap.parse_args(argv)
+
+    if NICE and hasattr(os, "nice"):
+        os.nice(NICE)
+
+    sources = []
+    traffic = traffic_counts(args.traffic) if args.traffic else (Counter(), {})
+    if args.traffic:
+        print(f"Traffic: {sum(traffic[0].values())} requests, {len(traffic[0])} distinct questions")
+        sources.append(traffic)
+    if args.meddialog is not None:
+        med = meddialog_counts(sorted(args.meddialog or glob(RAW_GLOB)))
+        print(f"MedDialog: {len(med[0])} distinct patient descriptions")
+        sources.append(med)
+    if not sources:
+        ap.error("give --traffic and/or --meddialog")
+
+    ask_batch, index_version = _load_pipeline(args.pipeline)
+    version = index_version()
+    already = warmed_keys(args.out, version)
+    picked = select_questions(sources, max(0, args.count - len(already)), skip=already)
+    print(f"Index version: {version} | already warmed: {len(already)} | to warm: {len(picked)}")
+
+    _end_line(args.out)
+    t0 = time.perf_counter()
+    with open(args.out, "a", encoding="utf-8") as f:
+        done, statuses, busy = warm(ask_batch, picked, f, version, args.max_seconds, args.cpu_share)
+    elapsed = time.perf_counter() - t0
+
+    warmed = already | set(done)
+    print(f"\nWarmed {len(done)} new questions in {elapsed:.1f}s "
+          f"(busy {busy:.1f}s, {busy / max(elapsed, 1e-9):.0%}) -> {args.out}")
+    print("Decisions:", dict(statuses))
+    total = sum(traffic[0].values())
+    if total:
+        hits = sum(n for key, n in traffic[0].items() if key in warmed)
+        covered = sum(1 for key in traffic[0] if key in warmed)
+        print(f"Hit rate on the traffic log: {hits / total:.1%} of requests "
+              f"({covered}/{len(traffic[0])} distinct questions warmed)")
+
+
+if __name__ == "__main__":
+    main()
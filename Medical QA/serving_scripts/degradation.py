@@ -0,0 +1,161 @@
+"""
+Load-adaptive degradation of the safety pipeline.
+
+With a deep queue, every request still pays for retrieval, the consistency
+samples, the greedy pass and NLI over every premise, and latency grows for
+everyone. The controller watches two signals: the /chat runs in flight
+(queue depth) and the p95 latency of the runs recently finished at the
+current level. It moves through LEVELS one step at a time.
+
+Each level drops work but never accepts an answer the full pipeline would
+abstain on: every level runs the same generations, a gate that runs has the
+same or a stricter threshold than at full, and a level that skips the
+consistency or NLI gate abstains instead of answering without it:
+
+  0 full          everything, as configured in the pipeline
+  1 lean          NLI against the top 3 premises only, stricter entailment
+  2 minimal       NLI against the top 2, stricter thresholds everywhere
+  3 abstain_only  retrieval check only, then abstain without generating
+
+It steps up when the depth reaches QUEUE_HIGH or the p95 exceeds
+SLO_P95_S, at most once per MIN_DWELL_S. It steps back down one level for
+every RECOVER_S in which the depth stayed at most QUEUE_LOW and the p95
+under RECOVER_RATIO * SLO_P95_S, idle time included.
+
+api.py picks the level when a pipeline run starts and passes it to the pipeline
+on its RequestContext. The pipeline records it in meta["degradation"], and
+degraded answers are not put in the answer cache. The controller is off
+unless DEGRADE=1.
+
+Use (in a pipeline):
+from serving_scripts.degradation import current_level, level_meta
+
+level = current_level()      # LEVELS[0] outside api.py / when the controller is off
+safety_check_and_answer(..., n_consistency=level.get("n_consistency", 2), nli_top_m=level.get("nli_top_m"))
+"""
+import threading
+import time
+from collections import deque
+
+from serving_scripts.request_context import current
+
+SLO_P95_S = 30.0
+QUEUE_HIGH = 4
+QUEUE_LOW = 1
+RECOVER_RATIO = 0.7
+MIN_DWELL_S = 5.0
+RECOVER_S = 30.0
+WINDOW_S = 60.0
+MIN_SAMPLES = 5      # finished runs at the current level before its p95 counts
+
+# Missing keys mean "as the pipeline is configured". Thresholds may only get stricter than the pipeline's
+# DEFAULTS, and n_consistency=0 / nli_top_m=0 make the pipeline abstain (see safety_check_and_answer).
+LEVELS = [
+    {"name": "full"},
+    {"name": "lean", "nli_top_m": 3,
+     "thresholds": {"entailment_pct": 0.65}},
+    {"name": "minimal", "nli_top_m": 2,
+     "thresholds": {"retrieval_top1": 0.60, "retrieval_mean3": 0.55, "rerank_top1": 0.35, "rerank_mean3": 0.20,
+                    "consistency_sim": 0.80, "avg_logprob": -2.0, "entailment_pct": 0.70}},
+    {"name": "abstain_only", "n_consistency": 0, "nli_top_m": 0},
+]
+
+
+def current_level() -> dict:
+    """Degradation level of the current request (the full pipeline when there is none)."""
+    ctx = current()
+    level = getattr(ctx, "degradation", None)
+    return level if level is not None else LEVELS[0]
+
+
+def level_meta(level: dict) -> dict:
+    return {"level": LEVELS.index(level) if level in LEVELS else None, "name": level.get("name")}
+
+
+def is_degraded(resp) -> bool:
+    meta = resp.get("meta") if isinstance(resp, dict) else None
+    return bool(((meta or {}).get("degradation") or {}).get("level"))
+
+
+def _p95(values):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(0.95 * len(values)))]
+
+
+class DegradationController:
+
+    def __init__(self, levels=None, slo_p95_s: float = SLO_P95_S, queue_high: int = QUEUE_HIGH,
+                 queue_low: int = QUEUE_LOW):
+        self.levels = levels or LEVELS
+        self.slo_p95_s = slo_p95_s
+        self.queue_high = queue_high
+        self.queue_low = queue_low
+        self._lock = threading.Lock()
+        self._level = 0
+        self._changed_at = time.monotonic()
+        self._calm_since = None
+        self._in_flight = 0
+        self._recent = deque()          # (finished at, latency s, level)
+        self.steps_up = 0
+        self.steps_down = 0
+
+    def start(self) -> dict:
+        """A run is starting; returns the level it should use."""
+        with self._lock:
+            self._in_flight += 1
+            self._update(time.monotonic())
+            return self.levels[self._level]
+
+    def finish(self, latency_s: float, level: dict):
+        with self._lock:
+            now = time.monotonic()
+            self._in_flight -= 1
+            self._recent.append((now, latency_s, self.levels.index(level)))
+            self._update(now)
+
+    def _update(self, now):
+        while self._recent and self._recent[0][0] < now - WINDOW_S:
+            self._recent.popleft()
+        at_level = [lat for _, lat, lvl in self._recent if lvl == self._level]
+        p95 = _p95(at_level) if len(at_level) >= MIN_SAMPLES else None
+
+        overloaded = self._in_flight >= self.queue_high or (p95 is not None and p95 > self.slo_p95_s)
+        if overloaded:
+            self._calm_since = None
+            if self._level < len(self.levels) - 1 and now - self._changed_at >= MIN_DWELL_S:
+                self._set(self._level + 1, now)
+                self.steps_up += 1
+            return
+
+        calm = self._in_flight <= self.queue_low and (p95 is None or p95 < RECOVER_RATIO * self.slo_p95_s)
+        if not calm:
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif self._level > 0 and now - self._calm_since >= RECOVER_S:
+            # one level per RECOVER_S of calm, including idle time with no requests to trigger an update
+            steps = min(self._level, int((now - self._calm_since) // RECOVER_S))
+            calm_since = self._calm_since
+            self._set(self._level - steps, now)
+            self._calm_since = calm_since + steps * RECOVER_S
+            self.steps_down += steps
+
+    def _set(self, level: int, now):
+        print(f"[degradation] level {self._level} -> {level} ({self.levels[level]['name']}), "
+              f"{self._in_flight} in flight")
+        self._level = level
+        self._changed_at = now
+        self._calm_since = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._update(time.monotonic())
+            at_level = [lat for _, lat, lvl in self._recent if lvl == self._level]
+            return {
+                "level": self._level,
+                "name": self.levels[self._level]["name"],
+                "in_flight": self._in_flight,
+                "p95_s": _p95(at_level) if at_level else None,
+                "steps_up": self.steps_up,
+                "steps_down": self.steps_down,
+            }
@@ -0,0 +1,48 @@
+"""
+JSON encoding for API responses and NDJSON stream lines.
+
+Uses orjson when it is installed (several times faster than json.dumps and
+compact output); otherwise json.dumps with compact separators. Both write
+UTF-8 without \\u escapes and turn numpy scalars/arrays into plain numbers.
+
+Use:
+from serving_scripts.fast_json import dumps, ndjson_line, FastJSONResponse
+
+app = FastAPI(default_response_class=FastJSONResponse)
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+
+def _default(obj):
+    # numpy scalars and arrays (scores, ids) that reach meta unconverted
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+try:
+    import orjson
+
+    BACKEND = "orjson"
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+except ImportError:
+    BACKEND = "json"
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def ndjson_line(obj: Any) -> bytes:
+    return dumps(obj) + b"\n"
+
+
+class FastJSONResponse(JSONResponse):
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,149 @@
+"""
+Deadlines, cancellation and priorities for pipeline runs.
+
+Each /chat request gets a RequestContext with a deadline (ChatRequest.timeout_s
+or REQUEST_TIMEOUT_S) and a priority. api.py cancels it when the client
+disconnects. The pipeline calls check_cancelled() between stages, and
+llama.cpp checks stop_requested() after every generated token, so abandoned
+work stops within one token instead of running to the end.
+
+The generator is the contended resource (one Llama context), so its lock is
+a PriorityLock: when it frees up, the waiting interactive request goes
+first, then batch jobs, then cache warming.
+
+Use:
+from serving_scripts.request_context import RequestContext, activate, check_cancelled, INTERACTIVE
+
+ctx = RequestContext(timeout_s=120, priority=INTERACTIVE)
+with activate(ctx):
+    ask(question)          # raises Cancelled once ctx.cancel() is called or the deadline passes
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+INTERACTIVE = 0
+BATCH = 1
+WARM = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", WARM: "warm"}
+
+LOCK_POLL_S = 0.05
+
+
+class Cancelled(Exception):
+    """Raised inside a pipeline run whose request was cancelled or ran out of time."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class RequestContext:
+
+    def __init__(self, timeout_s: float = None, priority: int = INTERACTIVE, degradation: dict = None):
+        self.deadline = time.monotonic() + timeout_s if timeout_s else None
+        self.priority = priority
+        # level from serving_scripts/degradation.py; None runs the full pipeline
+        self.degradation = degradation
+        self.reason = None
+
+    def cancel(self, reason: str = "cancelled"):
+        if self.reason is None:
+            self.reason = reason
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = "deadline"
+        return self.reason is not None
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+
+_current: ContextVar = ContextVar("mediqa_request_context", default=None)
+
+
+@contextmanager
+def activate(ctx: RequestContext):
+    """Make `ctx` the context of pipeline code run in this thread / task."""
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def check_cancelled():
+    """Stage boundary: raise Cancelled if the current request was cancelled or is past its deadline."""
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.check()
+
+
+def stop_requested(*_args) -> bool:
+    """Per-token stopping criterion for llama.cpp (ignores input_ids / logits)."""
+    ctx = _current.get()
+    return ctx is not None and ctx.cancelled
+
+
+class PriorityLock:
+    """
+    Mutex whose waiters are served by (priority, arrival) instead of OS order.
+    A waiter whose request is cancelled while queued leaves with Cancelled.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._held = False
+        self._waiting = []
+        self._seq = itertools.count()
+        self.waits = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    def acquire(self):
+        ctx = _current.get()
+        priority = ctx.priority if ctx is not None else INTERACTIVE
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            if self._held or self._waiting[0] != entry:
+                self.waits[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            try:
+                while self._held or self._waiting[0] != entry:
+                    if ctx is not None and ctx.cancelled:
+                        raise Cancelled(ctx.reason)
+                    self._cond.wait(LOCK_POLL_S)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._held = True
+
+    def release(self):
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
+    def queued(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,391 @@
+"""
+Bounded chat session storage for api.py.
+
+Classes:
+ - SessionStore        : interface used by the API
+ - MemorySessionStore  : in-process LRU with TTL, per-session message cap and a global byte budget
+ - SQLiteSessionStore  : MemorySessionStore as a hot cache over SQLite, with batched writes
+
+Stored assistant messages keep only a compact summary of `meta` (scores and
+abstain reason); consistency samples and per-sentence NLI details are dropped.
+
+Use:
+from serving_scripts.session_store import make_session_store
+
+store = make_session_store(db_path=None)
+sid = store.create()
+store.append(sid, {"role": "user", "content": "hi"})
+store.stats()
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+MAX_MESSAGES_PER_SESSION = 50
+MAX_SESSIONS = 10000
+MAX_TOTAL_BYTES = 64 * 1024 * 1024
+SESSION_TTL_SECONDS = 6 * 3600
+
+FLUSH_BATCH = 64
+FLUSH_INTERVAL_SECONDS = 1.0
+EXPIRE_INTERVAL_SECONDS = 600.0
+
+
+def new_session_id() -> str:
+    return "sess_" + uuid.uuid4().hex[:12]
+
+
+def compact_meta(meta: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Summary of a pipeline `meta` that is worth keeping in session history."""
+    if not meta:
+        return {}
+    out = {}
+    if "retrieval" in meta:
+        out["retrieval"] = meta["retrieval"]
+    if isinstance(meta.get("consistency"), dict):
+        out["consistency"] = {"mean_pairwise_sim": meta["consistency"].get("mean_pairwise_sim")}
+    if "avg_logprob" in meta:
+        out["avg_logprob"] = meta["avg_logprob"]
+    if isinstance(meta.get("entailment"), dict):
+        out["entailment"] = {"pct": meta["entailment"].get("pct")}
+    if "reason" in meta:
+        out["reason"] = meta["reason"]
+    if "degradation" in meta:
+        out["degradation"] = meta["degradation"]
+    return out
+
+
+def _message_bytes(msg: Dict[str, Any]) -> int:
+    return len(json.dumps(msg, ensure_ascii=False, default=str))
+
+
+class SessionStore:
+    """Interface. Methods are thread-safe in every implementation."""
+
+    def create(self, sid: str = None) -> str:
+        raise NotImplementedError
+
+    def exists(self, sid: str) -> bool:
+        raise NotImplementedError
+
+    def get(self, sid: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def append(self, sid: str, message: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def clear(self, sid: str) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class _Session:
+    __slots__ = ("messages", "nbytes", "last_access")
+
+    def __init__(self):
+        self.messages = []
+        self.nbytes = 0
+        self.last_access = time.time()
+
+
+class MemorySessionStore(SessionStore):
+
+    def __init__(self,
+                 max_messages_per_session: int = MAX_MESSAGES_PER_SESSION,
+                 max_sessions: int = MAX_SESSIONS,
+                 max_total_bytes: int = MAX_TOTAL_BYTES,
+                 ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_messages = max_messages_per_session
+        self.max_sessions = max_sessions
+        self.max_total_bytes = max_total_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._evictions = {"lru": 0, "ttl": 0, "budget": 0, "trimmed_messages": 0}
+
+    # --- hooks for persistent subclasses ------------------------------------
+    def _load(self, sid: str) -> Optional[_Session]:
+        return None
+
+    def _on_append(self, sid: str, message: Dict[str, Any]) -> None:
+        pass
+
+    def _on_clear(self, sid: str) -> None:
+        pass
+
+    def _on_expire(self, sid: str) -> None:
+        pass
+
+    # --- internals -----------------------------------------------------------
+    def _drop(self, sid: str, reason: str) -> None:
+        sess = self._sessions.pop(sid)
+        self._total_bytes -= sess.nbytes
+        self._evictions[reason] += 1
+        if reason == "ttl":
+            self._on_expire(sid)
+
+    def _evict(self) -> None:
+        now = time.time()
+        while self._sessions:
+            sid, sess = next(iter(self._sessions.items()))
+            if now - sess.last_access > self.ttl_seconds:
+                self._drop(sid, "ttl")
+            elif len(self._sessions) > self.max_sessions:
+                self._drop(sid, "lru")
+            elif self._total_bytes > self.max_total_bytes and len(self._sessions) > 1:
+                self._drop(sid, "budget")
+            else:
+                break
+
+    def _ensure_loaded(self, sid: str) -> None:
+        """Bring a persisted session into memory; the IO of _load() runs outside the store lock."""
+        with self._lock:
+            if sid in self._sessions:
+                return
+        sess = self._load(sid)
+        if sess is None:
+            return
+        with self._lock:
+            # another thread may have loaded or created it meanwhile; that copy wins
+            if sid not in self._sessions:
+                self._sessions[sid] = sess
+                self._total_bytes += sess.nbytes
+
+    def _touch(self, sid: str) -> Optional[_Session]:
+        sess = self._sessions.get(sid)
+        if sess is None:
+            return None
+        sess.last_access = time.time()
+        self._sessions.move_to_end(sid)
+        return sess
+
+    # --- interface -----------------------------------------------------------
+    def create(self, sid: str = None) -> str:
+        if sid:
+            self._ensure_loaded(sid)
+        sid = sid or new_session_id()
+        with self._lock:
+            if self._touch(sid) is None:
+                self._sessions[sid] = _Session()
+            self._evict()
+        return sid
+
+    def exists(self, sid: str) -> bool:
+        self._ensure_loaded(sid)
+        with self._lock:
+            return self._touch(sid) is not None
+
+    def get(self, sid: str) -> List[Dict[str, Any]]:
+        self._ensure_loaded(sid)
+        with self._lock:
+            sess = self._touch(sid)
+            return list(sess.messages) if sess else []
+
+    def append(self, sid: str, message: Dict[str, Any]) -> None:
+        if "meta" in message:
+            message = dict(message, meta=compact_meta(message["meta"]))
+        size = _message_bytes(message)
+        self._ensure_loaded(sid)
+        with self._lock:
+            sess = self._touch(sid)
+            if sess is None:
+                self._sessions[sid] = sess = _Session()
+            sess.messages.append(message)
+            sess.nbytes += size
+            self._total_bytes += size
+            while len(sess.messages) > self.max_messages:
+                old = sess.messages.pop(0)
+                old_size = _message_bytes(old)
+                sess.nbytes -= old_size
+                self._total_bytes -= old_size
+                self._evictions["trimmed_messages"] += 1
+            self._on_append(sid, message)
+            self._evict()
+
+    def clear(self, sid: str) -> None:
+        self._ensure_loaded(sid)
+        with self._lock:
+            sess = self._touch(sid)
+            if sess is not None:
+                self._total_bytes -= sess.nbytes
+                sess.messages = []
+                sess.nbytes = 0
+            self._on_clear(sid)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(s.messages) for s in self._sessions.values()),
+                "bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_total_bytes": self.max_total_bytes,
+                "evictions": dict(self._evictions),
+            }
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """
+    Memory store backed by SQLite so sessions survive restarts and LRU/budget
+    evictions. Writes are queued and flushed by a background thread every
+    FLUSH_INTERVAL_SECONDS or FLUSH_BATCH operations, whichever comes first.
+    Every EXPIRE_INTERVAL_SECONDS the same thread deletes the sessions whose
+    newest message is older than the TTL and that are no longer in memory.
+    """
+
+    def __init__(self, db_path: str, flush_batch: int = FLUSH_BATCH,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS,
+                 expire_interval: float = EXPIRE_INTERVAL_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self.expire_interval = expire_interval
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " session_id TEXT NOT NULL, ts REAL NOT NULL, role TEXT, content TEXT, meta TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_messages_sid ON messages(session_id, ts)")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        # one flush at a time, from taking the batch to commit, so batches reach SQLite in queue order
+        self._flush_lock = threading.Lock()
+
+        self._pending: List[tuple] = []
+        self._flushing: List[tuple] = []    # taken from _pending, not committed yet
+        self._flushes = 0
+        self._db_expired = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _queue(self, op: tuple) -> None:
+        self._pending.append(op)
+        if len(self._pending) >= self.flush_batch:
+            self._wake.set()
+
+    def _load(self, sid: str) -> Optional[_Session]:
+        with self._lock:
+            unwritten = any(op[1] == sid for op in self._pending + self._flushing)
+        if unwritten:
+            # only a lookup of a session with queued writes has to wait for them
+            self.flush()
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT role, content, meta, ts FROM messages WHERE session_id=? ORDER BY ts DESC LIMIT ?",
+                (sid, self.max_messages),
+            ).fetchall()
+        if not rows or time.time() - rows[0][3] > self.ttl_seconds:
+            return None
+        sess = _Session()
+        for role, content, meta, _ in reversed(rows):
+            msg = {"role": role, "content": content}
+            if meta is not None:
+                msg["meta"] = json.loads(meta)
+            sess.messages.append(msg)
+            sess.nbytes += _message_bytes(msg)
+        return sess
+
+    def _on_append(self, sid, message):
+        meta = json.dumps(message["meta"], default=str) if "meta" in message else None
+        self._queue(("append", sid, time.time(), message.get("role"), message.get("content"), meta))
+
+    def _on_clear(self, sid):
+        self._queue(("delete", sid))
+
+    def _on_expire(self, sid):
+        self._queue(("delete", sid))
+
+    def flush(self) -> None:
+        # never called with self._lock held: the flusher thread takes _flush_lock before self._lock
+        with self._flush_lock:
+            with self._lock:
+                ops, self._pending = self._pending, []
+                self._flushing = ops
+            if not ops:
+                return
+            with self._db_lock:
+                for op in ops:
+                    if op[0] == "append":
+                        self._db.execute("INSERT INTO messages VALUES (?, ?, ?, ?, ?)", op[1:])
+                    else:
+                        self._db.execute("DELETE FROM messages WHERE session_id=?", (op[1],))
+                # keep only the newest max_messages rows of each touched session
+                for sid in {op[1] for op in ops if op[0] == "append"}:
+                    self._db.execute(
+                        "DELETE FROM messages WHERE session_id=? AND ts < ("
+                        " SELECT MIN(ts) FROM (SELECT ts FROM messages WHERE session_id=? ORDER BY ts DESC LIMIT ?))",
+                        (sid, sid, self.max_messages),
+                    )
+                self._db.commit()
+                self._flushes += 1
+            with self._lock:
+                self._flushing = []
+
+    def expire(self) -> int:
+        """Delete persisted sessions idle past the TTL that are not in memory; returns how many."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._db_lock:
+            sids = [row[0] for row in self._db.execute(
+                "SELECT session_id FROM messages GROUP BY session_id HAVING MAX(ts) < ?", (cutoff,))]
+        with self._lock:
+            # sessions in memory expire by their own last access (_evict)
+            sids = [sid for sid in sids if sid not in self._sessions]
+        if not sids:
+            return 0
+        with self._db_lock:
+            self._db.executemany("DELETE FROM messages WHERE session_id=? AND ts < ?", [(sid, cutoff) for sid in sids])
+            self._db.commit()
+        self._db_expired += len(sids)
+        return len(sids)
+
+    def _flush_loop(self):
+        last_expire = time.monotonic()
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if time.monotonic() - last_expire >= self.expire_interval:
+                last_expire = time.monotonic()
+                self.expire()
+
+    def stats(self) -> Dict[str, Any]:
+        out = super().stats()
+        with self._lock:
+            out["pending_writes"] = len(self._pending)
+        out["backend"] = "sqlite"
+        out["db_path"] = self.db_path
+        out["flushes"] = self._flushes
+        out["db_expired"] = self._db_expired
+        return out
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+
+def make_session_store(db_path: str = None, **kwargs) -> SessionStore:
+    if db_path:
+        return SQLiteSessionStore(db_path, **kwargs)
+    return MemorySessionStore(**kwargs)
@@ -0,0 +1,75 @@
+"""
+In-flight request coalescing for api.py.
+
+Concurrent /chat requests whose questions normalize to the same key share
+one pipeline run: the first caller (leader) starts it as a task, later
+callers (followers) await the same task, and everyone gets the same
+result. The key is released as soon as the run finishes, so nothing is
+cached; a question asked after the run completes starts a fresh one.
+
+The run is shielded from its callers' asyncio tasks, but it carries the
+leader's RequestContext: if the leader disconnects or hits its deadline the
+run stops, and api.py reruns the question for each follower that is still
+waiting.
+
+Use:
+from serving_scripts.single_flight import SingleFlight, normalize_query
+
+flights = SingleFlight()
+result, shared = await flights.do(normalize_query(q), lambda: run_in_threadpool(ask, q))
+"""
+import asyncio
+import re
+import unicodedata
+
+_WS = re.compile(r"\s+")
+_TRAILING_PUNCT = " ?!.;,"
+
+
+def normalize_query(text: str) -> str:
+    """Case, unicode form, whitespace and trailing punctuation don't change the pipeline's answer."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _WS.sub(" ", text).strip().rstrip(_TRAILING_PUNCT)
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.followers = 0
+        self.max_fanout = 0
+        self._fanout = {}
+
+    async def do(self, key: str, fn):
+        """
+        Run `fn()` (returning an awaitable) once for all concurrent callers with `key`.
+        Returns (result, shared); shared is True for followers. Exceptions reach every caller.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.followers += 1
+            self._fanout[key] += 1
+            self.max_fanout = max(self.max_fanout, self._fanout[key])
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        self._fanout[key] = 1
+        self.leaders += 1
+        task.add_done_callback(lambda _t, k=key: self._release(k))
+        return await asyncio.shield(task), False
+
+    def _release(self, key):
+        self._inflight.pop(key, None)
+        self._fanout.pop(key, None)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "coalesced_rate": self.followers / total if total else 0.0,
+            "max_fanout": self.max_fanout,
+        }
@@ -0,0 +1,71 @@
+"""
+Bounded store of full pipeline traces, keyed by request id.
+
+/chat returns only the meta a caller asked for (a compact summary, or the
+full meta in developer mode). The full meta of every answered request is kept
+here by reference, so nothing is copied or serialized unless someone fetches
+it with GET /trace/{request_id}. The oldest traces are dropped beyond
+MAX_TRACES or after TRACE_TTL_SECONDS.
+
+Use:
+from serving_scripts.trace_store import TraceStore
+
+traces = TraceStore()
+traces.put(request_id, {"question": ..., "meta": meta})
+traces.get(request_id)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+MAX_TRACES = 2000
+TRACE_TTL_SECONDS = 3600
+
+
+class TraceStore:
+
+    def __init__(self, max_traces: int = MAX_TRACES, ttl_seconds: float = TRACE_TTL_SECONDS):
+        self.max_traces = max_traces
+        self.ttl_seconds = ttl_seconds
+        self._traces: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = {"lru": 0, "ttl": 0}
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, now: float) -> None:
+        while self._traces:
+            rid, (stored_at, _) = next(iter(self._traces.items()))
+            if now - stored_at > self.ttl_seconds:
+                reason = "ttl"
+            elif len(self._traces) > self.max_traces:
+                reason = "lru"
+            else:
+                break
+            del self._traces[rid]
+            self._evictions[reason] += 1
+
+    def put(self, request_id: str, trace: Dict[str, Any]) -> None:
+        if self.max_traces <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._traces[request_id] = (now, trace)
+            self._traces.move_to_end(request_id)
+            self._evict(now)
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._evict(time.time())
+            item = self._traces.get(request_id)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"traces": len(self._traces), "hits": self.hits, "misses": self.misses,
+                    "evictions": dict(self._evictions)}
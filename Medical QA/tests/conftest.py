@@ -0,0 +1,7 @@
+import os
+import sys
+
+# tests import the project modules the way the scripts do, from the "Medical QA" folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the real models are never loaded by the tests
+os.environ.setdefault("MEDIQA_GENERATOR", "stub")
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+
+from rag import rag_query_engine_safe as engine
+from serving_scripts.request_context import Cancelled
+
+
+class FakeRAG:
+    snapshot = SimpleNamespace(version="v1")
+
+    def retrieve_batch(self, queries, k=5, snapshot=None):
+        return [[{"row": n, "score": 0.9, "text": q}] for n, q in enumerate(queries)]
+
+    def attach_texts(self, retrieved, snapshot=None):
+        if retrieved[0]["text"] == "bad attach":
+            raise KeyError("chunk text missing")
+
+
+def _pending(query, retrieved, build_prompt, **kwargs):
+    if query == "bad answer":
+        raise RuntimeError("generation failed")
+    return {"status": "pending", "answer": query, "meta": {}}
+
+
+def _resolve(pending, nli_model_id=None):
+    if any(p["answer"] == "bad nli" for p in pending):
+        raise RuntimeError("NLI failed")
+    return [{"status": "accept", "answer": p["answer"], "meta": p["meta"]} for p in pending]
+
+
+@pytest.fixture(autouse=True)
+def fake_pipeline(monkeypatch):
+    monkeypatch.setattr(engine, "rag", FakeRAG())
+    monkeypatch.setattr(engine, "reranker", None)
+    monkeypatch.setattr(engine, "_pack", lambda retrieved: (None, {}))
+    monkeypatch.setattr(engine, "safety_check_and_answer", _pending)
+    monkeypatch.setattr(engine, "resolve_pending_entailment", _resolve)
+
+
+@pytest.mark.parametrize("bad", ["bad answer", "bad attach", "bad nli"])
+def test_one_failing_question_in_a_window_does_not_lose_the_others(bad):
+    queries = [f"q{n}" for n in range(3)] + [bad] + [f"q{n}" for n in range(4, 7)]
+    results = dict(engine.ask_batch(queries, nli_window=4))
+
+    assert sorted(results) == list(range(len(queries)))
+    assert results[3]["status"] == "error"
+    assert results[3]["error"]
+    for pos, resp in results.items():
+        if pos != 3:
+            assert resp["status"] == "accept" and resp["answer"] == queries[pos]
+
+
+def test_cancellation_still_ends_the_batch(monkeypatch):
+    def cancelled(*args, **kwargs):
+        raise Cancelled("deadline")
+
+    monkeypatch.setattr(engine, "safety_check_and_answer", cancelled)
+    with pytest.raises(Cancelled):
+        list(engine.ask_batch(["q0", "q1"]))
@@ -0,0 +1,74 @@
+import itertools
+
+import pytest
+
+from rag import rag_query_engine_safe as engine
+from safety_scripts import safety_pipeline
+from serving_scripts.degradation import LEVELS
+
+SENTENCES = ["first answer sentence here.", "second answer sentence here."]
+
+# (retrieval score, rerank scores or None, consistency similarity, avg logprob, entailment per premise)
+RETRIEVAL = [0.40, 0.56, 0.61, 0.70]
+RERANK = [None, 0.32, 0.38, 0.60]
+CONSISTENCY = [0.70, 0.78, 0.90]
+LOGPROB = [-3.0, -2.2, -1.0]
+# best entailment probability of each answer sentence against premises 1..5
+ENTAILMENT = [
+    [[0.9, 0.1, 0.1, 0.1, 0.1], [0.9, 0.1, 0.1, 0.1, 0.1]],
+    [[0.1, 0.1, 0.1, 0.1, 0.9], [0.9, 0.1, 0.1, 0.1, 0.1]],
+    [[0.1, 0.1, 0.9, 0.1, 0.1], [0.1, 0.9, 0.1, 0.1, 0.1]],
+    [[0.1, 0.1, 0.1, 0.1, 0.1], [0.9, 0.1, 0.1, 0.1, 0.1]],
+]
+
+
+@pytest.fixture
+def decide(monkeypatch):
+    case = {}
+
+    def consistency(gen_fn, prompt, n=3, sim_thr=0.75, temperature=0.2):
+        samples = [gen_fn(prompt, seed=1000 + i, temperature=temperature) for i in range(n)]
+        return case["sim"] >= sim_thr, {"samples": samples, "mean_pairwise_sim": case["sim"]}
+
+    def entailment(sentences, premises, model_id=None):
+        probs = [max(case["entail"][s][int(p)] for p in premises) for s in range(len(sentences))]
+        return sum(p >= 0.6 for p in probs) / len(probs), probs
+
+    def generate(prompt, seed=0, temperature=0.0, return_generate_obj=False, max_tokens=256):
+        return {"text": " ".join(SENTENCES), "generate_obj": object(), "avg_logprob": case["logprob"]}
+
+    monkeypatch.setattr(safety_pipeline, "check_consistency", consistency)
+    monkeypatch.setattr(safety_pipeline, "entailment_check", entailment)
+    monkeypatch.setattr(safety_pipeline, "sent_tokenize", lambda text: SENTENCES)
+    monkeypatch.setattr(engine, "_generate", generate)
+
+    def run(level, retrieval, rerank, sim, logprob, entail):
+        case.update(sim=sim, logprob=logprob, entail=entail)
+        retrieved = [{"text": str(i), "score": retrieval} for i in range(5)]
+        if rerank is not None:
+            for r in retrieved:
+                r["rerank_score"] = rerank
+        decision = safety_pipeline.safety_check_and_answer(
+            "question", retrieved, lambda q, r: "prompt", nli_model_id="stub", **engine._safety_args(level))
+        return decision["status"]
+
+    return run
+
+
+def test_degraded_levels_never_accept_what_full_abstains_on(decide):
+    accepted_at_full = 0
+    for inputs in itertools.product(RETRIEVAL, RERANK, CONSISTENCY, LOGPROB, ENTAILMENT):
+        full = decide(LEVELS[0], *inputs)
+        accepted_at_full += full == "accept"
+        for level in LEVELS[1:]:
+            status = decide(level, *inputs)
+            assert full == "accept" or status == "abstain", (level["name"], inputs)
+    # the grid is not vacuous: full accepts some inputs
+    assert accepted_at_full
+
+
+def test_levels_that_skip_a_gate_abstain_without_generating(decide, monkeypatch):
+    monkeypatch.setattr(engine, "_generate", lambda *a, **kw: pytest.fail("generated at a level that skips a gate"))
+    for level in LEVELS:
+        if level.get("n_consistency") == 0 or level.get("nli_top_m") == 0:
+            assert decide(level, 0.70, 0.60, 0.90, -1.0, ENTAILMENT[0]) == "abstain"
@@ -1,10 +1,12 @@
 import os
 import torch
 from datasets import load_dataset
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, Trainer, TrainingArguments, DataCollatorForLanguageModeling
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, TrainingArguments
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 import bitsandbytes as bnb
 
+from training_scripts.sft_data import build_sft_datasets, SFTCollator, SFTTrainer, packing_available
+
 MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.2"
 
 TRAIN_PATH = "datasets/processed/train_inst.jsonl"
@@ -18,20 +20,24 @@ GRAD_ACCUM = 8
 LR = 2e-4
 EPOCHS = 2
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=False)
-tokenizer.pad_token = tokenizer.eos_token
+# "auto": pack several examples per MAX_LEN row when flash-attention-2 is installed
+# (needed to keep packed examples from attending to each other), otherwise
+# length-grouped dynamic padding. Or force "pack" / "pad".
+PACKING = "auto"
+TOKENIZE_NUM_PROC = max(1, (os.cpu_count() or 2) // 2)
 
-def make_prompt(example):
-    instr = example["instruction"]
-    out   = example["output"]
-    prompt = f"### Instruction:\n{instr}\n\n### Response:\n{out}{tokenizer.eos_token}"
-    return {"text": prompt}
+packing = packing_available() if PACKING == "auto" else PACKING == "pack"
+print("Data layout:", "packed (flash-attention-2)" if packing else "dynamic padding, grouped by length")
+
+tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
+tokenizer.pad_token = tokenizer.eos_token
 
 ds = load_dataset("json", data_files={"train": TRAIN_PATH, "val": VAL_PATH})
+ds = build_sft_datasets(ds, tokenizer, MAX_LEN, packing=packing, num_proc=TOKENIZE_NUM_PROC)
 
-ds = ds.map(make_prompt)
-ds = ds.map(lambda batch: tokenizer(batch["text"], truncation=True, max_length=MAX_LEN, padding="max_length"), batched=True)
-ds.set_format(type="torch", columns=["input_ids", "attention_mask"])
+real = sum(ds["train"]["length"])
+rows = len(ds["train"])
+print(f"Train rows: {rows} | real tokens: {real} | fill of {MAX_LEN}-token rows: {real / (rows * MAX_LEN):.1%}")
 
 bnb_config = {
     "load_in_4bit": True,
@@ -44,6 +50,7 @@ model = AutoModelForCausalLM.from_pretrained(
     MODEL_NAME,
     device_map="auto",
     trust_remote_code=True,
+    attn_implementation="flash_attention_2" if packing else None,
     **bnb_config
 )
 
@@ -73,11 +80,13 @@ args = TrainingArguments(
     fp16=True,
     save_total_limit=3,
     evaluation_strategy="steps",
+    group_by_length=not packing,
+    length_column_name="length",
 )
 
-data_collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
+data_collator = SFTCollator(tokenizer.pad_token_id, packed=packing)
 
-trainer = Trainer(
+trainer = SFTTrainer(
     model=model,
     args=args,
     train_dataset=ds["train"],
@@ -85,6 +94,11 @@ trainer = Trainer(
     data_collator=data_collator,
 )
 
-trainer.train()
+result = trainer.train()
 model.save_pretrained(OUT_DIR)
+
+runtime = result.metrics.get("train_runtime")
+if runtime:
+    print(f"Effective tokens/sec: {trainer.real_tokens / runtime:.1f} "
+          f"(padding {1.0 - trainer.real_tokens / max(1, trainer.padded_tokens):.1%} of processed tokens)")
 print("Training complete.")
@@ -0,0 +1,157 @@
+"""
+sft_data.py
+
+Data pipeline for mistral_finetune_qLoRA.py.
+
+- Fast tokenizer, run through datasets.map(num_proc=...), so the tokenized
+  dataset is cached by `datasets` and reused by later runs
+- Loss on the response only: prompt tokens get label -100, and the EOS
+  token that ends the response is learned
+- "pack": examples are first-fit packed into MAX_LEN rows. position_ids
+  restart at 0 for every example and no attention_mask is passed, so
+  flash-attention-2 keeps attention inside each example (Mistral in
+  transformers reads the boundaries from position_ids)
+- "pad": one example per row, each batch padded only to its longest row,
+  with rows grouped by length (TrainingArguments(group_by_length=True))
+
+SFTTrainer adds effective (non-padding) tokens/sec to the training logs.
+
+Use:
+from training_scripts.sft_data import build_sft_datasets, SFTCollator, SFTTrainer
+"""
+import time
+
+import torch
+from transformers import Trainer
+
+PROMPT_TEMPLATE = "### Instruction:\n{instruction}\n\n### Response:\n"
+IGNORE_INDEX = -100
+PACK_MAP_BATCH = 2000     # examples bin-packed together per datasets.map batch
+
+
+def packing_available() -> bool:
+    try:
+        import flash_attn  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def tokenize_sft(batch, tokenizer, max_len):
+    prompts = [PROMPT_TEMPLATE.format(instruction=i) for i in batch["instruction"]]
+    p_ids = tokenizer(prompts, add_special_tokens=True)["input_ids"]
+    r_ids = tokenizer(batch["output"], add_special_tokens=False)["input_ids"]
+
+    input_ids, labels = [], []
+    for p, r in zip(p_ids, r_ids):
+        r = r + [tokenizer.eos_token_id]
+        input_ids.append((p + r)[:max_len])
+        labels.append(([IGNORE_INDEX] * len(p) + r)[:max_len])
+    return {"input_ids": input_ids, "labels": labels, "length": [len(x) for x in input_ids]}
+
+
+def pack_sft(batch, max_len):
+    """First-fit decreasing bin packing of tokenized examples into rows of at most max_len tokens."""
+    order = sorted(range(len(batch["input_ids"])), key=lambda i: -batch["length"][i])
+    bins = []
+    for i in order:
+        n = batch["length"][i]
+        for b in bins:
+            if b[0] + n <= max_len:
+                b[0] += n
+                b[1].append(i)
+                break
+        else:
+            bins.append([n, [i]])
+
+    out = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+    for used, idx in bins:
+        out["input_ids"].append([t for i in idx for t in batch["input_ids"][i]])
+        out["labels"].append([t for i in idx for t in batch["labels"][i]])
+        out["position_ids"].append([p for i in idx for p in range(batch["length"][i])])
+        out["length"].append(used)
+    return out
+
+
+def build_sft_datasets(ds, tokenizer, max_len, packing, num_proc=None):
+    """ds: DatasetDict with instruction/output columns -> tokenized (and packed) DatasetDict."""
+    columns = ds["train"].column_names
+    ds = ds.map(tokenize_sft, batched=True, num_proc=num_proc, remove_columns=columns,
+                fn_kwargs={"tokenizer": tokenizer, "max_len": max_len}, desc="Tokenizing")
+    # prompts longer than max_len leave nothing to learn
+    ds = ds.filter(lambda ex: any(t != IGNORE_INDEX for t in ex["labels"]), num_proc=num_proc)
+    if packing:
+        ds = ds.map(pack_sft, batched=True, batch_size=PACK_MAP_BATCH, num_proc=num_proc,
+                    fn_kwargs={"max_len": max_len}, desc="Packing")
+    return ds
+
+
+class SFTCollator:
+    """Pads a batch to its longest row; counts real vs padded tokens for throughput logging."""
+
+    def __init__(self, pad_token_id, packed: bool, pad_to_multiple_of: int = 8):
+        self.pad_token_id = pad_token_id
+        self.packed = packed
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        width = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids, labels, extra = [], [], []
+        for f in features:
+            n = len(f["input_ids"])
+            pad = width - n
+            input_ids.append(list(f["input_ids"]) + [self.pad_token_id] * pad)
+            labels.append(list(f["labels"]) + [IGNORE_INDEX] * pad)
+            if self.packed:
+                # padding becomes its own segment, so it never attends to a real example
+                extra.append(list(f["position_ids"]) + list(range(pad)))
+            else:
+                extra.append([1] * n + [0] * pad)
+
+        batch = {
+            "input_ids": torch.tensor(input_ids, dtype=torch.long),
+            "labels": torch.tensor(labels, dtype=torch.long),
+            "num_real_tokens": sum(len(f["input_ids"]) for f in features),
+        }
+        key = "position_ids" if self.packed else "attention_mask"
+        batch[key] = torch.tensor(extra, dtype=torch.long)
+        return batch
+
+
+class SFTTrainer(Trainer):
+    """Trainer that logs effective_tokens_per_sec (real tokens, excluding padding) and padding_ratio."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self._window = [0, 0, time.perf_counter()]
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        n = inputs.pop("num_real_tokens", 0)
+        self.real_tokens += n
+        self.padded_tokens += inputs["input_ids"].numel()
+        self._window[0] += n
+        self._window[1] += inputs["input_ids"].numel()
+        return super().training_step(model, inputs, *args, **kwargs)
+
+    def prediction_step(self, model, inputs, *args, **kwargs):
+        inputs.pop("num_real_tokens", None)
+        return super().prediction_step(model, inputs, *args, **kwargs)
+
+    def evaluate(self, *args, **kwargs):
+        out = super().evaluate(*args, **kwargs)
+        self._window[2] = time.perf_counter()     # keep eval time out of the training throughput
+        return out
+
+    def log(self, logs, *args, **kwargs):
+        if "loss" in logs and self._window[1]:
+            real, padded, t0 = self._window
+            now = time.perf_counter()
+            logs["effective_tokens_per_sec"] = round(real / max(now - t0, 1e-9), 1)
+            logs["padding_ratio"] = round(1.0 - real / padded, 4)
+            self._window = [0, 0, now]
+        super().log(logs, *args, **kwargs)